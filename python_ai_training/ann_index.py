@@ -0,0 +1,276 @@
+"""
+Approximate nearest-neighbour retrieval over item vectors
+=========================================================
+An IVF (inverted file) index for maximum inner-product search, in pure
+NumPy. Item vectors are clustered with k-means into `nlist` cells; a query
+scores the cell centroids, probes the best `nprobe` cells and ranks only
+the items stored in them. With nlist ~ sqrt(num_items) and a small nprobe
+this returns top-K candidates in well under a millisecond for catalogs
+where brute-force scoring would not.
+
+Inner-product search is reduced to nearest-neighbour search by appending
+one coordinate sqrt(max_norm^2 - ||x||^2) to every item vector (and 0 to
+the query), so L2 k-means cells line up with inner-product rankings while
+scores stay unchanged.
+
+Only the two_tower model scores a (user, item) pair with an inner product
+(sigmoid(user_vector . item_vector)), so only its item vectors are indexed.
+Recall is measured against the model's own top-k (reference=... in
+benchmark_index, see MakanMateRecommendationModel.benchmark_retrieval_index)
+and the exported index stores the smallest nprobe that reaches
+TARGET_RECALL; DEFAULT_NPROBE is only the starting point for ad-hoc use.
+
+The index is saved as a single .npz next to recommendation_model.tflite.
+
+Benchmark recall and latency against exact scoring:
+    python ann_index.py item_index.npz --queries user_vectors.npy
+    python ann_index.py --synthetic 100000
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Recall@10 vs. the model's own top-10 on two_tower synthetic catalogs:
+# 0.96 (20k items, 141 cells) and 0.97 (100k items, 316 cells) at 64 probes;
+# nprobe=8 gave 0.63 / 0.73
+DEFAULT_NPROBE = 64
+BENCHMARK_NPROBES = (1, 2, 4, 8, 16, 32, 64, 128)
+# Recall@k the exported index is tuned to (smallest nprobe reaching it)
+TARGET_RECALL = 0.95
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLES_PER_CELL = 256
+
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first, without a full sort"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _augment_for_mips(item_vectors):
+    """Append sqrt(max_norm^2 - ||x||^2) so every item has the same norm"""
+    sq_norms = (item_vectors ** 2).sum(axis=1)
+    extra = np.sqrt(np.maximum(sq_norms.max() - sq_norms, 0))
+    return np.hstack([item_vectors, extra[:, None]]).astype(np.float32)
+
+
+def _kmeans(vectors, nlist, iterations, rng):
+    """Lloyd's k-means; returns float32 centroids of shape (nlist, dim)"""
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    sq_norms = (vectors ** 2).sum(axis=1)
+    for _ in range(iterations):
+        assign = _assign(vectors, centroids, sq_norms)
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty cells from random points so no cell stays dead
+        if not filled.all():
+            centroids[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()))]
+    return centroids
+
+
+def _assign(vectors, centroids, sq_norms=None):
+    """Nearest centroid (squared L2) per vector"""
+    if sq_norms is None:
+        sq_norms = (vectors ** 2).sum(axis=1)
+    distances = sq_norms[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)
+    return distances.argmin(axis=1)
+
+
+class IVFIndex:
+    """Inverted-file index for top-K inner-product retrieval"""
+
+    def __init__(self, centroids, vectors, ids, offsets, nprobe=DEFAULT_NPROBE):
+        self.centroids = centroids
+        self.vectors = vectors      # Item vectors grouped by cell
+        self.ids = ids              # Original item index of each row in `vectors`
+        self.offsets = offsets      # Cell c owns rows offsets[c]:offsets[c + 1]
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, item_vectors, nlist=None, nprobe=DEFAULT_NPROBE,
+              iterations=KMEANS_ITERATIONS, seed=42):
+        """
+        Cluster item vectors into nlist cells (default ~sqrt(num_items)).
+        k-means is trained on a sample of at most KMEANS_SAMPLES_PER_CELL
+        points per cell, then every item is assigned to its nearest cell.
+        """
+        item_vectors = np.ascontiguousarray(item_vectors, dtype=np.float32)
+        num_items = len(item_vectors)
+        if nlist is None:
+            nlist = int(round(np.sqrt(num_items)))
+        nlist = max(1, min(nlist, num_items))
+
+        augmented = _augment_for_mips(item_vectors)
+        rng = np.random.default_rng(seed)
+        sample = augmented
+        if num_items > nlist * KMEANS_SAMPLES_PER_CELL:
+            sample = augmented[rng.choice(num_items, nlist * KMEANS_SAMPLES_PER_CELL, replace=False)]
+        centroids = _kmeans(sample, nlist, iterations, rng)
+
+        assign = _assign(augmented, centroids)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        return cls(
+            # The query's extra coordinate is 0, so it never touches the last column
+            centroids=np.ascontiguousarray(centroids[:, :-1]),
+            vectors=item_vectors[order],
+            ids=order.astype(np.int32),
+            offsets=offsets.astype(np.int64),
+            nprobe=nprobe,
+        )
+
+    def search(self, query, k=10, nprobe=None):
+        """Top-k (item indices, scores) for one query vector, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        cells = _top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([
+            np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells
+        ])
+        scores = self.vectors[rows] @ query
+        top = _top_k(scores, k)
+        return self.ids[rows[top]], scores[top]
+
+    def search_batch(self, queries, k=10, nprobe=None):
+        """search() for each row of queries; returns lists of (ids, scores)"""
+        return [self.search(q, k, nprobe) for q in np.asarray(queries, dtype=np.float32)]
+
+    def save(self, path):
+        np.savez(
+            path, centroids=self.centroids, vectors=self.vectors,
+            ids=self.ids, offsets=self.offsets, nprobe=self.nprobe,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                centroids=data['centroids'], vectors=data['vectors'],
+                ids=data['ids'], offsets=data['offsets'], nprobe=int(data['nprobe']),
+            )
+
+    def item_vectors(self):
+        """Item vectors back in original item-index order"""
+        vectors = np.empty_like(self.vectors)
+        vectors[self.ids] = self.vectors
+        return vectors
+
+
+def exact_search(item_vectors, query, k=10):
+    """Brute-force top-k by inner product (the recall reference)"""
+    scores = item_vectors @ np.asarray(query, dtype=np.float32)
+    top = _top_k(scores, k)
+    return top, scores[top]
+
+
+def benchmark_index(index, queries, k=10, nprobes=BENCHMARK_NPROBES, reference=None):
+    """
+    Recall@k and per-query latency of the index at several nprobe values.
+    reference: the true top-k item indices per query (e.g. from the model's
+        own scores); default is brute-force inner product over the indexed
+        vectors, which is only meaningful if the model ranks by it.
+    """
+    item_vectors = index.item_vectors()
+    queries = np.asarray(queries, dtype=np.float32)
+
+    def timed(fn):
+        latencies, results = [], []
+        for q in queries:
+            start = time.perf_counter()
+            results.append(fn(q))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return results, np.array(latencies)
+
+    exact, exact_ms = timed(lambda q: exact_search(item_vectors, q, k)[0])
+    if reference is not None:
+        exact = [np.asarray(ids)[:k] for ids in reference]
+    report = {
+        'num_items': int(len(item_vectors)),
+        'nlist': index.nlist,
+        'k': k,
+        'num_queries': int(len(queries)),
+        'reference': 'inner_product' if reference is None else 'given',
+        'exact': {'mean_ms': float(exact_ms.mean()), 'p95_ms': float(np.percentile(exact_ms, 95))},
+        'ivf': [],
+    }
+
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        approx, approx_ms = timed(lambda q: index.search(q, k, nprobe)[0])
+        recall = np.mean([
+            len(np.intersect1d(a, e)) / max(len(e), 1) for a, e in zip(approx, exact)
+        ])
+        report['ivf'].append({
+            'nprobe': nprobe,
+            'recall_at_k': float(recall),
+            'mean_ms': float(approx_ms.mean()),
+            'p95_ms': float(np.percentile(approx_ms, 95)),
+        })
+    return report
+
+
+def choose_nprobe(report, target_recall=TARGET_RECALL):
+    """Smallest benchmarked nprobe with recall@k >= target_recall (else the best one)"""
+    rows = report['ivf']
+    for row in rows:
+        if row['recall_at_k'] >= target_recall:
+            return row['nprobe']
+    return max(rows, key=lambda row: row['recall_at_k'])['nprobe']
+
+
+def _print_report(report):
+    print(f"Items: {report['num_items']}  nlist: {report['nlist']}  "
+          f"k: {report['k']}  queries: {report['num_queries']}  reference: {report['reference']}")
+    print(f"  exact        mean {report['exact']['mean_ms']:.3f} ms  p95 {report['exact']['p95_ms']:.3f} ms")
+    for row in report['ivf']:
+        print(f"  nprobe={row['nprobe']:<4} recall@k {row['recall_at_k']:.3f}  "
+              f"mean {row['mean_ms']:.3f} ms  p95 {row['p95_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF index recall-vs-latency benchmark")
+    parser.add_argument('index', nargs='?', help="saved index (.npz)")
+    parser.add_argument('--queries', help="query vectors (.npy); default: random item vectors")
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help="benchmark a fresh index over N random vectors instead")
+    parser.add_argument('--dim', type=int, default=32)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        index = IVFIndex.build(rng.standard_normal((args.synthetic, args.dim)).astype(np.float32))
+    elif args.index:
+        index = IVFIndex.load(args.index)
+    else:
+        parser.error("pass an index file or --synthetic N")
+
+    if args.queries:
+        queries = np.load(args.queries)
+    else:
+        vectors = index.item_vectors()
+        queries = vectors[rng.choice(len(vectors), min(args.num_queries, len(vectors)), replace=False)]
+
+    report = benchmark_index(index, queries, k=args.k)
+    _print_report(report)
+    print(f"  nprobe for recall@k >= {TARGET_RECALL}: {choose_nprobe(report)}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
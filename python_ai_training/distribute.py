@@ -0,0 +1,399 @@
+"""
+Data-parallel CPU training with tf.distribute
+=============================================
+Strategies (see make_strategy):
+
+    default       one replica, plain model.fit
+    mirrored      MirroredStrategy over N logical CPU devices carved out of
+                  the host CPU; synchronous all-reduce inside one process
+    multi_worker  MultiWorkerMirroredStrategy over the processes (or hosts)
+                  listed in TF_CONFIG; ring all-reduce over gRPC
+
+The training `batch_size` is per replica; the global batch is batch_size *
+num_replicas_in_sync. Under multi_worker every worker reads a disjoint shard
+of the interaction rows and runs a fixed number of steps per epoch, so no
+worker waits on a collective another worker never joins.
+
+Keras 3's model.fit fails reducing scalar logs under
+MultiWorkerMirroredStrategy, so multi_worker training goes through
+fit_multi_worker, a small custom loop with the same loss, metric, early
+stopping and learning-rate schedule as train_model's callbacks.
+
+Run a multi-worker job on one host (one local process per worker):
+    python distribute.py launch --workers 2 -- train --strategy multi_worker
+
+Scaling benchmark (training samples/sec against replica or worker count):
+    python distribute.py benchmark --strategy mirrored --replicas 1 2 4
+    python distribute.py benchmark --strategy multi_worker --replicas 1 2 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('default', 'mirrored', 'multi_worker')
+TRAINING_SCRIPT = Path(__file__).parent / 'train_recommendation_model.py'
+# Marks the JSON result line a benchmark worker prints on stdout
+BENCHMARK_RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+
+def configure_cpu_replicas(num_replicas):
+    """
+    Split the host CPU into num_replicas logical devices. Must run before
+    TensorFlow initializes its devices (i.e. before any op executes).
+    """
+    import tensorflow as tf
+
+    cpu = tf.config.list_physical_devices('CPU')[0]
+    tf.config.set_logical_device_configuration(
+        cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(num_replicas)]
+    )
+    return [device.name for device in tf.config.list_logical_devices('CPU')]
+
+
+def make_strategy(kind='default', num_replicas=None):
+    """
+    A tf.distribute strategy, or None for 'default'.
+    num_replicas: logical CPU devices for 'mirrored' (default: os.cpu_count())
+    """
+    if kind not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {kind} (expected one of {STRATEGIES})")
+    if kind == 'default':
+        return None
+
+    import tensorflow as tf
+
+    if kind == 'mirrored':
+        devices = configure_cpu_replicas(num_replicas or os.cpu_count() or 1)
+        # NCCL is GPU-only; reduce through one device on CPU
+        strategy = tf.distribute.MirroredStrategy(
+            devices, cross_device_ops=tf.distribute.ReductionToOneDevice()
+        )
+    else:
+        if 'TF_CONFIG' not in os.environ:
+            raise ValueError("multi_worker needs TF_CONFIG (see `python distribute.py launch`)")
+        strategy = tf.distribute.MultiWorkerMirroredStrategy(
+            communication_options=tf.distribute.experimental.CommunicationOptions(
+                implementation=tf.distribute.experimental.CommunicationImplementation.RING
+            )
+        )
+    num_workers, worker_index = worker_info(strategy)
+    logger.info(f"Using {kind} strategy: {strategy.num_replicas_in_sync} replicas, "
+                f"worker {worker_index + 1}/{num_workers}")
+    return strategy
+
+
+def is_multi_worker(strategy):
+    return strategy is not None and worker_info(strategy)[0] > 1
+
+
+def worker_info(strategy):
+    """(num_workers, worker_index); (1, 0) unless running multi-worker"""
+    resolver = getattr(strategy, 'cluster_resolver', None)
+    if resolver is None or not resolver.cluster_spec().jobs:
+        return 1, 0
+    spec = resolver.cluster_spec()
+    num_workers = sum(spec.num_tasks(job) for job in ('chief', 'worker') if job in spec.jobs)
+    index = resolver.task_id or 0
+    if resolver.task_type == 'worker' and 'chief' in spec.jobs:
+        index += 1
+    return num_workers, index
+
+
+def is_chief(strategy):
+    """True on the worker that saves state and writes reports"""
+    return worker_info(strategy)[1] == 0
+
+
+def strategy_scope(strategy):
+    return strategy.scope() if strategy is not None else nullcontext()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def local_cluster(num_workers):
+    """TF_CONFIG dicts for num_workers processes on localhost (worker 0 is chief)"""
+    workers = [f'localhost:{_free_port()}' for _ in range(num_workers)]
+    return [
+        {'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': i}}
+        for i in range(num_workers)
+    ]
+
+
+def launch_local_workers(num_workers, command, capture=False, timeout=None):
+    """
+    Run `command` (argv) once per worker with its TF_CONFIG set, wait for all
+    of them and return their exit codes (and stdout if capture). If one
+    worker fails the others are stopped, since they would block forever in
+    the next collective.
+    """
+    procs = []
+    for config in local_cluster(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps(config))
+        procs.append(subprocess.Popen(
+            command, env=env, text=True,
+            stdout=subprocess.PIPE if capture else None,
+        ))
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while any(p.poll() is None for p in procs):
+        if any(p.poll() not in (None, 0) for p in procs) or (deadline and time.monotonic() > deadline):
+            for p in procs:
+                if p.poll() is None:
+                    p.terminate()
+            break
+        time.sleep(0.2)
+
+    outputs = [p.communicate()[0] if capture else None for p in procs]
+    codes = [p.wait() for p in procs]
+    return (codes, outputs) if capture else codes
+
+
+def distributed_dataset_options():
+    """Sharding is done on the index rows (see train_model), so turn auto-sharding off"""
+    import tensorflow as tf
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return options
+
+
+def fit_multi_worker(model, strategy, train_ds, val_ds, epochs, steps_per_epoch,
+                     validation_steps, global_batch_size, patience=10,
+                     lr_patience=5, lr_factor=0.8):
+    """
+    Synchronous data-parallel training loop for MultiWorkerMirroredStrategy.
+    train_ds / val_ds are this worker's repeated shards, batched per
+    replica and yielding (inputs, rating[, weight]); each local replica
+    reads its own batch (distribute_datasets_from_function), so nothing
+    is rebatched or dropped.
+    Mirrors train_model's callbacks: early stopping with best-weight
+    restore and learning-rate decay on a val_loss plateau (on loss when
+    val_ds is None).
+    Returns a History whose .history has loss, mae and, with val_ds,
+    val_loss, val_mae.
+    """
+    import tensorflow as tf
+
+    if not model.optimizer.built:
+        with strategy.scope():
+            model.optimizer.build(model.trainable_variables)
+
+    def batch_errors(batch, training):
+        inputs, rating = batch[0], batch[1]
+        weight = batch[2] if len(batch) > 2 else tf.ones_like(rating)
+        prediction = tf.reshape(model(inputs, training=training), [-1])
+        error = rating - prediction
+        return tf.square(error) * weight, tf.abs(error) * weight
+
+    def train_step(*batch):
+        with tf.GradientTape() as tape:
+            squared, absolute = batch_errors(batch, training=True)
+            loss = tf.nn.compute_average_loss(squared, global_batch_size=global_batch_size)
+            if model.losses:
+                loss += tf.nn.scale_regularization_loss(tf.add_n(model.losses))
+        gradients = tape.gradient(loss, model.trainable_variables)
+        model.optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+        return loss, tf.nn.compute_average_loss(absolute, global_batch_size=global_batch_size)
+
+    def test_step(*batch):
+        squared, absolute = batch_errors(batch, training=False)
+        return (tf.nn.compute_average_loss(squared, global_batch_size=global_batch_size),
+                tf.nn.compute_average_loss(absolute, global_batch_size=global_batch_size))
+
+    def distributed(step_fn, dataset):
+        dataset = dataset.with_options(distributed_dataset_options())
+        iterator = iter(strategy.distribute_datasets_from_function(lambda _: dataset))
+
+        @tf.function
+        def step():
+            losses = strategy.run(step_fn, args=next(iterator))
+            return [strategy.reduce('SUM', value, axis=None) for value in losses]
+        return step
+
+    def run_epoch(step, steps):
+        totals = np.zeros(2)
+        for _ in range(steps):
+            totals += [float(value) for value in step()]
+        return totals / steps
+
+    train_fn = distributed(train_step, train_ds)
+    test_fn = distributed(test_step, val_ds) if val_ds is not None else None
+
+    history = tf.keras.callbacks.History()
+    history.history = {'loss': [], 'mae': [], 'learning_rate': []}
+    if test_fn is not None:
+        history.history.update(val_loss=[], val_mae=[])
+    best_loss, best_weights, since_best, since_lr = np.inf, None, 0, 0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        metrics = dict(zip(('loss', 'mae'), run_epoch(train_fn, steps_per_epoch)))
+        if test_fn is not None:
+            metrics.update(zip(('val_loss', 'val_mae'), run_epoch(test_fn, validation_steps)))
+        learning_rate = float(model.optimizer.learning_rate.numpy())
+        for key, value in {**metrics, 'learning_rate': learning_rate}.items():
+            history.history[key].append(float(value))
+        logger.info(f"Epoch {epoch + 1}/{epochs} - {time.perf_counter() - start:.1f}s - "
+                    + " - ".join(f"{key}: {value:.4f}" for key, value in metrics.items()))
+
+        # Every worker sees the same reduced loss, so they stop together
+        monitored = metrics.get('val_loss', metrics['loss'])
+        if monitored < best_loss:
+            best_loss, best_weights, since_best, since_lr = monitored, model.get_weights(), 0, 0
+            continue
+        since_best += 1
+        since_lr += 1
+        if since_lr >= lr_patience:
+            model.optimizer.learning_rate.assign(learning_rate * lr_factor)
+            since_lr = 0
+        if since_best >= patience:
+            logger.info(f"Early stopping after epoch {epoch + 1}")
+            break
+    if best_weights is not None:
+        model.set_weights(best_weights)
+    return history
+
+
+def _benchmark_worker(args):
+    """Train on synthetic data under one strategy and print samples/sec (chief only)"""
+    from train_recommendation_model import MakanMateRecommendationModel
+
+    strategy = make_strategy(args.strategy, args.replicas)
+    model = MakanMateRecommendationModel(num_users=args.users, num_items=args.items,
+                                         architecture=args.architecture, strategy=strategy)
+    processed_data = model.preprocess_data(model.generate_synthetic_data(seed=0))
+    model.build_model()
+    train_rows = int(len(processed_data['ratings']) * (1 - args.validation_split))
+
+    # One warm-up epoch traces the step functions; time the ones after it
+    model.train_model(processed_data, epochs=1, batch_size=args.batch_size,
+                      validation_split=args.validation_split, verbose=0)
+    start = time.perf_counter()
+    history = model.train_model(processed_data, epochs=args.epochs, batch_size=args.batch_size,
+                                validation_split=args.validation_split, verbose=0)
+    elapsed = time.perf_counter() - start
+
+    if is_chief(strategy):
+        epochs_run = len(history.history['loss'])
+        replicas = strategy.num_replicas_in_sync if strategy is not None else 1
+        print(BENCHMARK_RESULT_PREFIX + json.dumps({
+            'strategy': args.strategy,
+            'replicas': replicas,
+            'workers': worker_info(strategy)[0],
+            'global_batch_size': args.batch_size * replicas,
+            'train_rows': train_rows,
+            'epochs': epochs_run,
+            'seconds': elapsed,
+            'samples_per_sec': train_rows * epochs_run / elapsed,
+            'final_loss': history.history['loss'][-1],
+            'final_val_loss': history.history.get('val_loss', [float('nan')])[-1],
+        }), flush=True)
+
+
+def _parse_result(output):
+    for line in (output or '').splitlines():
+        if line.startswith(BENCHMARK_RESULT_PREFIX):
+            return json.loads(line[len(BENCHMARK_RESULT_PREFIX):])
+    return None
+
+
+def benchmark_scaling(strategy='mirrored', replica_counts=(1, 2, 4), users=20000, items=1000,
+                      epochs=3, batch_size=512, architecture='mlp', timeout=None):
+    """
+    Training throughput per replica count: for 'mirrored' one process with
+    N logical CPU devices, for 'multi_worker' N local worker processes.
+    Each configuration runs in fresh processes (logical devices can only be
+    set before TensorFlow starts).
+    """
+    results = []
+    for count in replica_counts:
+        kind = strategy if count > 1 or strategy == 'multi_worker' else 'default'
+        command = [
+            sys.executable, str(Path(__file__).resolve()), 'worker',
+            '--strategy', kind, '--replicas', str(count), '--users', str(users),
+            '--items', str(items), '--epochs', str(epochs), '--batch-size', str(batch_size),
+            '--architecture', architecture,
+        ]
+        logger.info(f"Benchmarking {strategy} with {count} replica(s)...")
+        if strategy == 'multi_worker':
+            codes, outputs = launch_local_workers(count, command, capture=True, timeout=timeout)
+            output = outputs[0]
+        else:
+            done = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+            codes, output = [done.returncode], done.stdout
+        result = _parse_result(output)
+        if result is None or any(codes):
+            logger.error(f"{count} replica(s) failed with exit codes {codes}")
+            continue
+        results.append(result)
+
+    baseline = results[0]['samples_per_sec'] if results else None
+    for result in results:
+        result['speedup'] = result['samples_per_sec'] / baseline
+    return {'strategy': strategy, 'cpu_count': os.cpu_count(), 'users': users,
+            'items': items, 'results': results}
+
+
+def print_scaling(report):
+    print(f"{report['strategy']} scaling ({report['cpu_count']} CPUs, "
+          f"{report['users']} users x {report['items']} items)")
+    print(f"  {'replicas':>8} {'workers':>7} {'global batch':>12} {'samples/s':>11} {'speedup':>8} {'val_loss':>9}")
+    for r in report['results']:
+        print(f"  {r['replicas']:>8} {r['workers']:>7} {r['global_batch_size']:>12} "
+              f"{r['samples_per_sec']:>11.0f} {r['speedup']:>7.2f}x {r['final_val_loss']:>9.4f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="tf.distribute launcher and scaling benchmark")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('launch', help="run a training command as N local workers")
+    sub.add_argument('--workers', type=int, default=2)
+    sub.add_argument('args', nargs=argparse.REMAINDER,
+                     help="train_recommendation_model.py arguments, after --")
+
+    for name in ('benchmark', 'worker'):
+        sub = subparsers.add_parser(name, help="samples/sec against replica count" if name == 'benchmark'
+                                    else argparse.SUPPRESS)
+        sub.add_argument('--strategy', choices=STRATEGIES, default='mirrored')
+        sub.add_argument('--users', type=int, default=20000)
+        sub.add_argument('--items', type=int, default=1000)
+        sub.add_argument('--epochs', type=int, default=3)
+        sub.add_argument('--batch-size', type=int, default=512, help="per replica")
+        sub.add_argument('--architecture', default='mlp')
+        if name == 'benchmark':
+            sub.add_argument('--replicas', type=int, nargs='+', default=[1, 2, 4])
+            sub.add_argument('--json', help="also write the report to this file")
+        else:
+            sub.add_argument('--replicas', type=int, default=1)
+            sub.add_argument('--validation-split', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == 'launch':
+        argv = args.args[1:] if args.args[:1] == ['--'] else args.args
+        codes = launch_local_workers(args.workers, [sys.executable, str(TRAINING_SCRIPT)] + argv)
+        sys.exit(max(codes, key=abs))
+    elif args.command == 'worker':
+        _benchmark_worker(args)
+    else:
+        report = benchmark_scaling(args.strategy, args.replicas, args.users, args.items,
+                                   args.epochs, args.batch_size, args.architecture)
+        print_scaling(report)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, indent=2))
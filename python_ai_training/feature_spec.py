@@ -0,0 +1,218 @@
+"""
+Declarative user and item feature specs
+=======================================
+Each feature table is a list of feature definitions; FeatureSpec compiles
+the list into column offsets once and `transform` turns a whole batch of
+records into a float64 matrix with one vectorized pass per source column:
+
+    Numeric('price', divide_by=100.0)            value / 100, missing -> default
+    Flag('isHalal')                              1.0 if truthy
+    OneHot('cuisineType', CUISINES, 'western')   lowercased, one column per value
+    MultiHot('categories', CATEGORIES, match='substring')
+                                                 1.0 if any list element matches
+
+Nested fields use dotted paths ('behaviorPatterns.morning_activity').
+Records can be a list of dicts (Firestore documents), a pandas DataFrame
+(flat or json_normalize'd) or a pyarrow Table.
+
+Adding a feature means adding a line to USER_FEATURES / ITEM_FEATURES; the
+model input dims follow from `spec.dim`. Changing a spec changes the
+feature layout, so retrain (warm start will refuse mismatched dims).
+"""
+
+from dataclasses import dataclass
+from itertools import chain
+
+import numpy as np
+
+CUISINES = ['malay', 'chinese', 'indian', 'western', 'thai']
+CULTURES = ['malay', 'chinese', 'indian', 'mixed']
+DIETARY_RESTRICTIONS = ['halal', 'vegetarian', 'vegan']
+ITEM_CATEGORIES = ['rice', 'noodles', 'soup', 'dessert']
+
+
+@dataclass(frozen=True)
+class Numeric:
+    """A number, divided by `divide_by` and capped at `max_value`"""
+    field: str
+    default: float = 0.0
+    divide_by: float = 1.0
+    max_value: float = None
+
+    width = 1
+
+    def names(self):
+        return [self.field]
+
+    def fill(self, column, out):
+        try:
+            # Fast path: numbers and None (-> NaN) convert in C
+            values = np.asarray(column, dtype=np.float64)
+        except (TypeError, ValueError):
+            import pandas as pd
+            values = pd.to_numeric(pd.Series(column, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        values = np.where(np.isnan(values), self.default, values)
+        if self.divide_by != 1.0:
+            values = values / self.divide_by
+        if self.max_value is not None:
+            values = np.minimum(values, self.max_value)
+        out[:, 0] = values
+
+
+@dataclass(frozen=True)
+class Flag:
+    """1.0 when the field is truthy, 0.0 when falsy or missing"""
+    field: str
+
+    width = 1
+
+    def names(self):
+        return [self.field]
+
+    def fill(self, column, out):
+        import pandas as pd
+
+        out[:, 0] = pd.Series(column, dtype=object).fillna(False).astype(bool).to_numpy()
+
+
+@dataclass(frozen=True)
+class OneHot:
+    """One column per value; the field is lowercased, missing -> default"""
+    field: str
+    values: tuple
+    default: str = None
+
+    @property
+    def width(self):
+        return len(self.values)
+
+    def names(self):
+        return [f"{self.field}={v}" for v in self.values]
+
+    def fill(self, column, out):
+        import pandas as pd
+
+        series = pd.Series(column, dtype=object)
+        if self.default is not None:
+            series = series.fillna(self.default)
+        # Categorize the distinct strings, not every row
+        codes, uniques = pd.factorize(series)
+        lowered = pd.Series(uniques, dtype=object).astype(str).str.lower()
+        value_codes = pd.Categorical(lowered, categories=list(self.values)).codes
+        row_codes = np.where(codes >= 0, value_codes[np.maximum(codes, 0)], -1)
+        rows = np.flatnonzero(row_codes >= 0)
+        out[rows, row_codes[rows]] = 1.0
+
+
+@dataclass(frozen=True)
+class MultiHot:
+    """
+    One column per value, 1.0 if any element of a list field matches.
+    match='exact' compares elements as-is; match='substring' tests whether
+    the value occurs in the lowercased element ('Fried Rice' -> rice).
+    """
+    field: str
+    values: tuple
+    match: str = 'exact'
+
+    @property
+    def width(self):
+        return len(self.values)
+
+    def names(self):
+        return [f"{self.field}:{v}" for v in self.values]
+
+    def fill(self, column, out):
+        import pandas as pd
+
+        lists = [v if isinstance(v, (list, tuple, np.ndarray)) else () for v in column]
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        if not lengths.any():
+            return
+        rows = np.repeat(np.arange(len(lists)), lengths)
+        codes, uniques = pd.factorize(np.fromiter(chain.from_iterable(lists), dtype=object, count=lengths.sum()))
+        uniques = pd.Series(uniques, dtype=object).astype(str)
+        if self.match == 'substring':
+            uniques = uniques.str.lower()
+        for j, value in enumerate(self.values):
+            if self.match == 'substring':
+                hit = uniques.str.contains(value, regex=False).to_numpy()
+            else:
+                hit = (uniques == value).to_numpy()
+            # Trailing False: None elements factorize to code -1
+            out[rows[np.append(hit, False)[codes]], j] = 1.0
+
+
+def _nested(values, key):
+    return [v.get(key) if isinstance(v, dict) else None for v in values]
+
+
+class FeatureSpec:
+    """A compiled feature table: column offsets plus per-feature fill ops"""
+
+    def __init__(self, features):
+        self.features = list(features)
+        self.offsets = np.cumsum([0] + [f.width for f in self.features])
+
+    @property
+    def dim(self):
+        return int(self.offsets[-1])
+
+    @property
+    def names(self):
+        return [name for f in self.features for name in f.names()]
+
+    def _columns(self, records):
+        """Column getter over dicts, a DataFrame or an Arrow table (dotted paths allowed)"""
+        if hasattr(records, 'to_pandas') and not hasattr(records, 'iloc'):
+            records = records.to_pandas()
+        is_frame = hasattr(records, 'iloc')
+        cache = {}
+
+        def column(path):
+            if path in cache:
+                return cache[path]
+            if is_frame and path in records.columns:
+                values = records[path].to_numpy(dtype=object)
+            elif '.' in path:
+                parent, key = path.rsplit('.', 1)
+                values = _nested(column(parent), key)
+            elif is_frame:
+                values = [None] * len(records)
+            else:
+                values = [r.get(path) for r in records]
+            cache[path] = values
+            return values
+
+        return column, len(records)
+
+    def transform(self, records):
+        """Feature matrix (num_records, dim), float64, rows in record order"""
+        column, n = self._columns(records)
+        out = np.zeros((n, self.dim), dtype=np.float64)
+        if n == 0:
+            return out
+        for feature, start, stop in zip(self.features, self.offsets[:-1], self.offsets[1:]):
+            feature.fill(column(feature.field), out[:, start:stop])
+        return out
+
+
+USER_FEATURES = FeatureSpec(
+    [Numeric(f'cuisinePreferences.{c}') for c in CUISINES]
+    + [MultiHot('dietaryRestrictions', tuple(DIETARY_RESTRICTIONS))]
+    + [Numeric('spiceTolerance', default=0.5)]
+    + [OneHot('culturalBackground', tuple(CULTURES), default='mixed')]
+    + [Numeric('behaviorPatterns.morning_activity'),
+       Numeric('behaviorPatterns.evening_activity')]
+)
+
+ITEM_FEATURES = FeatureSpec([
+    Numeric('price', divide_by=100.0),
+    Numeric('spiceLevel', default=0.5),
+    Flag('isHalal'),
+    Flag('isVegetarian'),
+    Numeric('averageRating', divide_by=5.0),
+    Numeric('totalOrders', divide_by=100.0, max_value=1.0),
+    OneHot('cuisineType', tuple(CUISINES), default='western'),
+    MultiHot('categories', tuple(ITEM_CATEGORIES), match='substring'),
+])
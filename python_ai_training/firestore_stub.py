@@ -0,0 +1,93 @@
+"""
+In-memory stand-in for a Firestore client
+=========================================
+Implements the part of the query API firestore_export uses (where,
+order_by, limit, start_after, document, stream), so exports, shard
+queries and snapshot refreshes can run without Firebase:
+
+    model.db = StubFirestore({'users': {'u1': {'updatedAt': ...}}, ...})
+
+Every collection records the filters of each streamed query
+(`queries`) and the IDs it returned (`streamed`).
+"""
+
+import operator
+
+OPS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq}
+
+
+class StubDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class StubQuery:
+    """The subset of the Firestore query API used by firestore_export"""
+
+    def __init__(self, collection, filters=(), orders=(), page_size=None, after=None):
+        self.collection = collection
+        self.filters, self.orders = filters, orders
+        self.page_size, self.after = page_size, after
+
+    def _derive(self, **changes):
+        args = dict(filters=self.filters, orders=self.orders, page_size=self.page_size, after=self.after)
+        args.update(changes)
+        return StubQuery(self.collection, **args)
+
+    def where(self, filter):
+        return self._derive(filters=self.filters + ((filter.field_path, filter.op_string, filter.value),))
+
+    def order_by(self, field):
+        return self._derive(orders=self.orders + (field,))
+
+    def limit(self, page_size):
+        return self._derive(page_size=page_size)
+
+    def start_after(self, position):
+        return self._derive(after=tuple(position[field] for field in self.orders))
+
+    def document(self, doc_id):
+        return doc_id
+
+    def _key(self, doc_id, data):
+        return tuple(doc_id if field == '__name__' else data.get(field) for field in self.orders)
+
+    @staticmethod
+    def _matches(doc_id, data, field, op, value):
+        if field == '__name__':
+            return OPS[op](doc_id, value)
+        return field in data and OPS[op](data[field], value)
+
+    def stream(self):
+        self.collection.queries.append(self.filters)
+        docs = [
+            (doc_id, data) for doc_id, data in self.collection.docs.items()
+            if all(self._matches(doc_id, data, *condition) for condition in self.filters)
+        ]
+        docs.sort(key=lambda doc: self._key(*doc))
+        if self.after is not None:
+            docs = [doc for doc in docs if self._key(*doc) > self.after]
+        docs = docs[:self.page_size]
+        self.collection.streamed.extend(doc_id for doc_id, _ in docs)
+        return [StubDocument(doc_id, data) for doc_id, data in docs]
+
+
+class StubCollection(StubQuery):
+    def __init__(self, name, docs):
+        super().__init__(self)
+        self.id = name
+        self.docs = dict(docs)
+        self.queries = []
+        self.streamed = []
+
+
+class StubFirestore:
+    def __init__(self, collections):
+        self.collections = {name: StubCollection(name, docs) for name, docs in collections.items()}
+
+    def collection(self, name):
+        return self.collections[name]
@@ -8,18 +8,34 @@ This script creates:
 - 15 authentic Malaysian food items
 - 1000+ realistic user-food interactions
 
+Writes are grouped into Firestore WriteBatch commits (up to 500 documents
+each) that run concurrently with retry and exponential backoff.
+
 Usage:
     python generate_synthetic_data.py
+    python generate_synthetic_data.py --users 5000 --interactions-per-user 20
+    python generate_synthetic_data.py --dry-run --out-dir synthetic_data
+    python generate_synthetic_data.py --emulator localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python generate_synthetic_data.py --emulator --project demo-test
 
 Requirements:
     - Firebase project with Firestore enabled
     - firebase-credentials.json file in the same directory
+      (not needed for --dry-run or --emulator)
 """
 
+import argparse
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core import exceptions as gcp_exceptions
+import json
+import os
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 
 # ============================================
 # CONFIGURATION - EDIT THESE IF NEEDED
@@ -27,6 +43,25 @@ from datetime import datetime, timedelta
 FIREBASE_CREDENTIALS_FILE = 'firebase-credentials.json'
 NUM_USERS = 50
 NUM_INTERACTIONS_PER_USER = 20  # Will create ~1000 total interactions
+# Emulator writes go to this project unless --project / GCLOUD_PROJECT say
+# otherwise. The 'demo-' prefix marks a project that does not exist, so a
+# misconfigured client cannot reach production data.
+EMULATOR_PROJECT_ID = 'demo-makanmate'
+
+# Firestore write batching
+BATCH_SIZE = 500           # Firestore limit per WriteBatch
+WRITE_WORKERS = 8          # Concurrent batch commits
+MAX_COMMIT_RETRIES = 5
+RETRY_BASE_DELAY = 0.5     # Seconds, doubled per attempt (plus jitter)
+
+# Errors worth retrying a batch commit on
+TRANSIENT_ERRORS = (
+    gcp_exceptions.Aborted,
+    gcp_exceptions.DeadlineExceeded,
+    gcp_exceptions.InternalServerError,
+    gcp_exceptions.ResourceExhausted,
+    gcp_exceptions.ServiceUnavailable,
+)
 
 # ============================================
 # MALAYSIAN FOOD DATABASE
@@ -157,6 +192,25 @@ MALAYSIAN_FOODS = [
 # ============================================
 # INITIALIZATION
 # ============================================
+def initialize_emulator(emulator_host=None, project=EMULATOR_PROJECT_ID):
+    """
+    Client for the Firestore emulator at emulator_host (default:
+    FIRESTORE_EMULATOR_HOST). Exits rather than fall back to a live project.
+    """
+    if emulator_host:
+        os.environ['FIRESTORE_EMULATOR_HOST'] = emulator_host
+    emulator_host = os.environ.get('FIRESTORE_EMULATOR_HOST')
+    if not emulator_host:
+        print("ERROR: --emulator needs HOST:PORT or FIRESTORE_EMULATOR_HOST;")
+        print("refusing to seed without an emulator to write to")
+        exit(1)
+
+    # The emulator accepts unauthenticated clients; no credentials file needed
+    from google.cloud import firestore as gcp_firestore
+    db = gcp_firestore.Client(project=project)
+    print(f"Connected to Firestore emulator at {emulator_host} (project {project})")
+    return db
+
 def initialize_firebase():
     """Initialize Firebase Admin SDK"""
     try:
@@ -178,10 +232,104 @@ def initialize_firebase():
         print(f"ERROR initializing Firebase: {e}")
         exit(1)
 
+# ============================================
+# WRITE SINKS
+# ============================================
+class FirestoreBatchSink:
+    """
+    Buffers document writes into WriteBatch commits of up to BATCH_SIZE
+    documents. Full batches are committed on a thread pool; transient
+    failures are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, db, batch_size=BATCH_SIZE, max_workers=WRITE_WORKERS,
+                 max_retries=MAX_COMMIT_RETRIES):
+        self.db = db
+        self.batch_size = min(batch_size, BATCH_SIZE)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+        self.in_flight = []
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def set(self, collection, doc_id, data):
+        self.pending.append((collection, doc_id, data))
+        if len(self.pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        ops, self.pending = self.pending, []
+        self.in_flight.append(self.pool.submit(self._commit, ops))
+        # Bound memory: wait for the oldest commits once the pool is saturated
+        while len(self.in_flight) > 2 * self.max_workers:
+            self.in_flight.pop(0).result()
+
+    def _commit(self, ops):
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for collection, doc_id, data in ops:
+                batch.set(self.db.collection(collection).document(doc_id), data)
+            try:
+                batch.commit()
+                break
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+                print(f"  Batch commit failed ({e.__class__.__name__}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+        with self._lock:
+            self.written += len(ops)
+
+    def flush(self):
+        """Commit any partial batch and wait for all in-flight commits"""
+        if self.pending:
+            self._submit()
+        while self.in_flight:
+            self.in_flight.pop(0).result()
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+
+
+class JsonlSink:
+    """Dry-run sink: appends documents to <out_dir>/<collection>.jsonl instead of Firestore"""
+
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.files = {}
+        self.written = 0
+
+    def set(self, collection, doc_id, data):
+        if collection not in self.files:
+            self.files[collection] = open(self.out_dir / f"{collection}.jsonl", 'w', encoding='utf-8')
+        record = {'id': doc_id, 'data': data}
+        self.files[collection].write(json.dumps(record, default=_json_default) + '\n')
+        self.written += 1
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
 # ============================================
 # DATA GENERATORS
 # ============================================
-def generate_users(db, num_users=NUM_USERS):
+def generate_users(sink, num_users=NUM_USERS):
     """Generate diverse user profiles with Malaysian preferences"""
     print(f"\n Generating {num_users} users...")
     
@@ -228,18 +376,18 @@ def generate_users(db, num_users=NUM_USERS):
             }
         }
         
-        # Save to Firestore
-        db.collection('users').document(user_id).set(user_data)
+        sink.set('users', user_id, user_data)
         user_profiles.append(user_data)
         
         # Progress indicator
         if (i + 1) % 10 == 0:
             print(f"  Created {i + 1}/{num_users} users...")
     
+    sink.flush()
     print(f" {num_users} users created")
     return user_profiles
 
-def generate_foods(db, foods_data=MALAYSIAN_FOODS):
+def generate_foods(sink, foods_data=MALAYSIAN_FOODS):
     """Add Malaysian food items to Firestore"""
     print(f"\n Generating {len(foods_data)} food items...")
     
@@ -262,19 +410,39 @@ def generate_foods(db, foods_data=MALAYSIAN_FOODS):
             "createdAt": datetime.now() - timedelta(days=random.randint(30, 365)),
         }
         
-        db.collection('foods').document(food_id).set(food_data)
+        sink.set('foods', food_id, food_data)
         created_foods.append((food_id, food_data))
         
         print(f"  ✓ {food['name']} ({food['cuisine']})")
     
+    sink.flush()
     print(f" {len(foods_data)} foods created")
     return created_foods
 
-def generate_interactions(db, users, foods, interactions_per_user=NUM_INTERACTIONS_PER_USER):
+def _suitable_foods_for(cache, foods, cuisine_prefs, spice_pref, dietary_restrictions):
+    """
+    Foods matching a user's preferences. The match only depends on the
+    (cuisines, spice level, halal) profile, so each profile bucket is
+    computed once and shared by every user that falls into it.
+    """
+    halal_required = "halal" in dietary_restrictions
+    profile = (frozenset(cuisine_prefs), spice_pref, halal_required)
+    if profile not in cache:
+        suitable_foods = [
+            (food_id, food_data) for food_id, food_data in foods
+            if food_data["cuisineType"] in cuisine_prefs
+            and abs(food_data["spiceLevel"] - spice_pref) <= 2
+            and (not halal_required or food_data["isHalal"])
+        ]
+        cache[profile] = suitable_foods or foods
+    return cache[profile]
+
+def generate_interactions(sink, users, foods, interactions_per_user=NUM_INTERACTIONS_PER_USER):
     """Generate realistic user-food interactions based on preferences"""
     print(f"\n Generating user interactions...")
     
     total_interactions = 0
+    suitable_cache = {}
     
     for user_idx, user in enumerate(users):
         user_id = user["userId"]
@@ -289,29 +457,16 @@ def generate_interactions(db, users, foods, interactions_per_user=NUM_INTERACTIO
             int(interactions_per_user * 1.5)
         )
         
-        for _ in range(num_interactions):
-            # Select food based on preferences (70%) or random exploration (30%)
-            if random.random() < (1 - exploration_level):
-                # Match preferences
-                suitable_foods = [
-                    (food_id, food_data) for food_id, food_data in foods
-                    if food_data["cuisineType"] in cuisine_prefs
-                    and abs(food_data["spiceLevel"] - spice_pref) <= 2
-                    and (
-                        not dietary_restrictions 
-                        or ("halal" in dietary_restrictions and food_data["isHalal"])
-                        or "halal" not in dietary_restrictions
-                    )
-                ]
-                
-                if not suitable_foods:
-                    suitable_foods = foods
-                
-                food_id, selected_food = random.choice(suitable_foods)
-            else:
-                # Random exploration
-                food_id, selected_food = random.choice(foods)
-            
+        # Select food based on preferences (70%) or random exploration (30%),
+        # sampling each group in one call from the cached candidate list
+        suitable_foods = _suitable_foods_for(suitable_cache, foods, cuisine_prefs, spice_pref, dietary_restrictions)
+        num_matched = sum(random.random() < (1 - exploration_level) for _ in range(num_interactions))
+        selections = (
+            random.choices(suitable_foods, k=num_matched)
+            + random.choices(foods, k=num_interactions - num_matched)
+        )
+        
+        for food_id, selected_food in selections:
             # Generate rating based on match quality
             spice_match = 1 - (abs(selected_food["spiceLevel"] - spice_pref) / 5.0)
             cuisine_match = 1.0 if selected_food["cuisineType"] in cuisine_prefs else 0.5
@@ -335,35 +490,70 @@ def generate_interactions(db, users, foods, interactions_per_user=NUM_INTERACTIO
                 "action": random.choice(["rated", "rated", "rated", "viewed", "bookmarked"])
             }
             
-            # Save to Firestore
-            db.collection('interactions').document(interaction_id).set(interaction_data)
+            sink.set('interactions', interaction_id, interaction_data)
             total_interactions += 1
         
         # Progress indicator
         if (user_idx + 1) % 10 == 0:
             print(f"  Processed {user_idx + 1}/{len(users)} users...")
     
+    sink.flush()
     print(f" {total_interactions} interactions created")
     return total_interactions
 
 # ============================================
 # MAIN EXECUTION
 # ============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="MakanMate synthetic data generator")
+    parser.add_argument('--users', type=int, default=NUM_USERS,
+                        help="number of user profiles to create")
+    parser.add_argument('--interactions-per-user', type=int, default=NUM_INTERACTIONS_PER_USER,
+                        help="average interactions per user")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="write JSONL files locally instead of Firestore")
+    parser.add_argument('--out-dir', default='synthetic_data',
+                        help="output directory for --dry-run")
+    parser.add_argument('--emulator', metavar='HOST:PORT', nargs='?', const='',
+                        help="write to a Firestore emulator instead of the live project "
+                             "(default host: $FIRESTORE_EMULATOR_HOST)")
+    parser.add_argument('--project', default=os.environ.get('GCLOUD_PROJECT', EMULATOR_PROJECT_ID),
+                        help="project ID for --emulator (default: $GCLOUD_PROJECT or %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="documents per WriteBatch (max 500)")
+    parser.add_argument('--workers', type=int, default=WRITE_WORKERS,
+                        help="concurrent batch commits")
+    return parser.parse_args()
+
 def main():
     """Main data generation pipeline"""
+    args = parse_args()
+
     print("=" * 60)
     print("     MakanMate Synthetic Data Generator")
     print("=" * 60)
     
-    # Initialize Firebase
-    db = initialize_firebase()
+    if args.dry_run:
+        sink = JsonlSink(args.out_dir)
+        print(f"Dry run: writing JSONL files to {Path(args.out_dir).resolve()}")
+    else:
+        if args.emulator is not None:
+            db = initialize_emulator(emulator_host=args.emulator, project=args.project)
+        else:
+            db = initialize_firebase()
+        sink = FirestoreBatchSink(db, batch_size=args.batch_size, max_workers=args.workers)
     
     # Generate data
     print("\n Starting data generation...\n")
     
-    users = generate_users(db, num_users=NUM_USERS)
-    foods = generate_foods(db, foods_data=MALAYSIAN_FOODS)
-    interactions = generate_interactions(db, users, foods, interactions_per_user=NUM_INTERACTIONS_PER_USER)
+    started = time.perf_counter()
+    try:
+        users = generate_users(sink, num_users=args.users)
+        foods = generate_foods(sink, foods_data=MALAYSIAN_FOODS)
+        interactions = generate_interactions(sink, users, foods, interactions_per_user=args.interactions_per_user)
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - started
     
     # Summary
     print("\n" + "=" * 60)
@@ -372,6 +562,7 @@ def main():
     print(f"  Users: {len(users)}")
     print(f"  Foods: {len(foods)}")
     print(f"  Interactions: {interactions}")
+    print(f"  Documents written: {sink.written} in {elapsed:.1f}s")
     print("=" * 60)
     
     print("\nData Distribution:")
@@ -0,0 +1,159 @@
+"""
+Precision and compilation modes for training and inference
+==========================================================
+    default         float32; Keras runs train/predict steps as tf.functions
+    xla             float32; model.compile(jit_compile=True), so every
+                    train/predict step is one XLA cluster (fused kernels)
+    mixed_bfloat16  bfloat16 compute with float32 variables; the output and
+                    tower-output layers stay float32. Fast only on CPUs with
+                    native bf16 (AVX512_BF16 / AMX), emulated elsewhere
+
+Variables are float32 in every mode, so weights, training state and the
+TFLite export are interchangeable between modes.
+
+Compare step time, throughput and accuracy on the same data:
+    python precision.py --users 20000 --items 1000 --epochs 5
+"""
+
+import argparse
+import json
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PRECISION_MODES = ('default', 'xla', 'mixed_bfloat16')
+# /proc/cpuinfo flags for native bfloat16 arithmetic
+BF16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+
+def cpu_supports_bfloat16():
+    """True if the CPU advertises native bf16 instructions (Linux only)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return any(flag in line.split() for flag in BF16_CPU_FLAGS)
+    except OSError:
+        pass
+    return False
+
+
+@contextmanager
+def precision_policy(mode):
+    """Keras dtype policy for layers created inside the block"""
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision mode: {mode} (expected one of {PRECISION_MODES})")
+    if mode != 'mixed_bfloat16':
+        yield
+        return
+
+    import tensorflow as tf
+
+    if not cpu_supports_bfloat16():
+        logger.warning("CPU has no native bfloat16 support; mixed_bfloat16 will be emulated and slow")
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+def benchmark_precision_modes(modes=None, users=20000, items=1000, epochs=5,
+                              batch_size=512, architecture='mlp', seed=0):
+    """
+    Train a fresh model per mode on the same synthetic data, split and seed,
+    and report step time, training and inference throughput, and final
+    RMSE/MAE (evaluate_model over all interactions).
+    """
+    import tensorflow as tf
+
+    from train_recommendation_model import MakanMateRecommendationModel
+    from training_callbacks import StepTimer
+
+    if modes is None:
+        modes = [m for m in PRECISION_MODES if m != 'mixed_bfloat16' or cpu_supports_bfloat16()]
+
+    data_model = MakanMateRecommendationModel(num_users=users, num_items=items)
+    processed_data = data_model.preprocess_data(data_model.generate_synthetic_data(seed=seed))
+
+    results = []
+    for mode in modes:
+        logger.info(f"Benchmarking precision mode '{mode}'...")
+        tf.keras.utils.set_random_seed(seed)
+        model = MakanMateRecommendationModel(num_users=data_model.num_users, num_items=data_model.num_items,
+                                             architecture=architecture, precision=mode)
+        model.build_model()
+
+        timer = StepTimer()
+        start = time.perf_counter()
+        history = model.train_model(processed_data, epochs=epochs, batch_size=batch_size,
+                                    callbacks=[timer], verbose=0)
+        train_seconds = time.perf_counter() - start
+        steps = timer.steady_step_seconds()
+
+        # Second predict pass: the first one traces / compiles
+        dataset = model._make_dataset(processed_data, batch_size=4096)
+        model.model.predict(dataset, verbose=0)
+        start = time.perf_counter()
+        model.model.predict(dataset, verbose=0)
+        predict_seconds = time.perf_counter() - start
+
+        metrics = model.evaluate_model(processed_data)
+        results.append({
+            'mode': mode,
+            'epochs': len(history.history['loss']),
+            'train_seconds': train_seconds,
+            'first_epoch_seconds': float(sum(timer.epoch_steps[0])),
+            'step_ms_median': float(np.median(steps) * 1000),
+            'step_ms_p95': float(np.percentile(steps, 95) * 1000),
+            'train_samples_per_sec': float(batch_size / np.median(steps)),
+            'predict_samples_per_sec': float(len(processed_data['ratings']) / predict_seconds),
+            'rmse': float(metrics['rmse']),
+            'mae': float(metrics['mae']),
+        })
+
+    return {
+        'users': data_model.num_users,
+        'items': data_model.num_items,
+        'interactions': int(len(processed_data['ratings'])),
+        'batch_size': batch_size,
+        'cpu_bfloat16': cpu_supports_bfloat16(),
+        'results': results,
+    }
+
+
+def print_precision_report(report):
+    print(f"{report['interactions']} interactions, {report['users']} users x {report['items']} items, "
+          f"batch {report['batch_size']} (native bf16: {report['cpu_bfloat16']})")
+    print(f"  {'mode':<15} {'step ms':>8} {'p95 ms':>8} {'train/s':>9} {'predict/s':>10} "
+          f"{'1st epoch':>9} {'RMSE':>7} {'MAE':>7}")
+    for r in report['results']:
+        print(f"  {r['mode']:<15} {r['step_ms_median']:>8.2f} {r['step_ms_p95']:>8.2f} "
+              f"{r['train_samples_per_sec']:>9.0f} {r['predict_samples_per_sec']:>10.0f} "
+              f"{r['first_epoch_seconds']:>8.1f}s {r['rmse']:>7.4f} {r['mae']:>7.4f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Training/inference benchmark per precision mode")
+    parser.add_argument('--modes', nargs='+', choices=PRECISION_MODES,
+                        help="default: all modes (mixed_bfloat16 only on CPUs with native bf16)")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--architecture', choices=('mlp', 'two_tower'), default='mlp')
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = benchmark_precision_modes(args.modes, args.users, args.items, args.epochs,
+                                       args.batch_size, args.architecture)
+    print_precision_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
@@ -0,0 +1,156 @@
+"""
+Compact preprocessing artifacts for serving
+===========================================
+Everything needed to turn a real user/item ID and raw features into model
+inputs, without sklearn or pickle:
+
+    <dir>/user_ids.npy        sorted IDs, UTF-8 bytes (row i = embedding index i)
+    <dir>/item_ids.npy
+    <dir>/scalers.npz         user_mean, user_scale, item_mean, item_scale (float32),
+                              and optionally seen_indptr / seen_indices: the
+                              CSR user x item matrix of items each user has
+                              interacted with (for recommend's exclude_seen)
+    <dir>/user_features.npy   scaled feature tables, float32 (num_users, 15)
+    <dir>/item_features.npy                                   (num_items, 15)
+    <dir>/manifest.json       counts and feature dims
+
+ID tables are sorted the way LabelEncoder sorts its classes (UTF-8 byte
+order is code point order), so an ID's index is a binary search away and
+the .npy files can be memory-mapped instead of read.
+
+    artifacts = PreprocessingArtifacts.load('preprocessing')
+    user_idx = artifacts.user_index(['abc123'])     # -1 for unknown IDs
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+ARTIFACTS_VERSION = 1
+
+
+def _encode_ids(ids):
+    return np.array([str(i).encode('utf-8') for i in ids], dtype=np.bytes_)
+
+
+def _lookup(sorted_ids, ids):
+    """Index of each ID in a sorted ID table, -1 where absent"""
+    queries = _encode_ids(ids)
+    if len(sorted_ids) == 0:
+        return np.full(len(queries), -1, dtype=np.int64)
+    positions = np.searchsorted(sorted_ids, queries)
+    clipped = np.minimum(positions, len(sorted_ids) - 1)
+    found = sorted_ids[clipped] == queries
+    return np.where(found, clipped, -1)
+
+
+def save_preprocessing_artifacts(out_dir, user_ids, item_ids, user_mean, user_scale,
+                                 item_mean, item_scale, user_features, item_features, seen_items=None):
+    """
+    Write the artifacts listed in the module docstring. IDs must already be
+    sorted (encoder class order) and feature rows must follow them.
+    seen_items: optional CSR matrix (anything with indptr/indices), one row
+        per user ID
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    user_ids, item_ids = _encode_ids(user_ids), _encode_ids(item_ids)
+    for name, ids in (('user', user_ids), ('item', item_ids)):
+        if len(ids) > 1 and not (ids[1:] > ids[:-1]).all():
+            raise ValueError(f"{name} IDs must be unique and sorted")
+
+    seen = {}
+    if seen_items is not None:
+        if len(seen_items.indptr) != len(user_ids) + 1:
+            raise ValueError("seen_items must have one row per user ID")
+        seen = {
+            'seen_indptr': np.asarray(seen_items.indptr, dtype=np.int64),
+            'seen_indices': np.asarray(seen_items.indices, dtype=np.int32),
+        }
+
+    np.save(out_dir / 'user_ids.npy', user_ids)
+    np.save(out_dir / 'item_ids.npy', item_ids)
+    np.savez(
+        out_dir / 'scalers.npz',
+        user_mean=np.asarray(user_mean, dtype=np.float32),
+        user_scale=np.asarray(user_scale, dtype=np.float32),
+        item_mean=np.asarray(item_mean, dtype=np.float32),
+        item_scale=np.asarray(item_scale, dtype=np.float32),
+        **seen,
+    )
+    np.save(out_dir / 'user_features.npy', np.asarray(user_features, dtype=np.float32))
+    np.save(out_dir / 'item_features.npy', np.asarray(item_features, dtype=np.float32))
+    (out_dir / 'manifest.json').write_text(json.dumps({
+        'version': ARTIFACTS_VERSION,
+        'num_users': int(len(user_ids)),
+        'num_items': int(len(item_ids)),
+        'user_feature_dim': int(np.shape(user_features)[1]),
+        'item_feature_dim': int(np.shape(item_features)[1]),
+    }, indent=2))
+    return out_dir
+
+
+class PreprocessingArtifacts:
+    """ID lookup, feature scaling and precomputed feature rows for serving"""
+
+    def __init__(self, user_ids, item_ids, user_mean, user_scale, item_mean, item_scale,
+                 user_features, item_features, manifest=None, seen_indptr=None, seen_indices=None):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.user_mean = user_mean
+        self.user_scale = user_scale
+        self.item_mean = item_mean
+        self.item_scale = item_scale
+        self.user_features = user_features
+        self.item_features = item_features
+        self.manifest = manifest or {}
+        self.seen_indptr = seen_indptr
+        self.seen_indices = seen_indices
+
+    @classmethod
+    def load(cls, in_dir, mmap_mode='r'):
+        """Load artifacts; ID and feature tables are memory-mapped by default"""
+        in_dir = Path(in_dir)
+        manifest = json.loads((in_dir / 'manifest.json').read_text())
+        if manifest.get('version') != ARTIFACTS_VERSION:
+            raise ValueError(f"Unsupported preprocessing artifacts version: {manifest.get('version')}")
+        with np.load(in_dir / 'scalers.npz') as scalers:
+            scalers = dict(scalers)
+        return cls(
+            user_ids=np.load(in_dir / 'user_ids.npy', mmap_mode=mmap_mode),
+            item_ids=np.load(in_dir / 'item_ids.npy', mmap_mode=mmap_mode),
+            user_features=np.load(in_dir / 'user_features.npy', mmap_mode=mmap_mode),
+            item_features=np.load(in_dir / 'item_features.npy', mmap_mode=mmap_mode),
+            manifest=manifest,
+            **scalers,
+        )
+
+    @property
+    def num_users(self):
+        return len(self.user_ids)
+
+    @property
+    def num_items(self):
+        return len(self.item_ids)
+
+    def user_index(self, user_ids):
+        """Embedding index per user ID (-1 for IDs the model has not seen)"""
+        return _lookup(self.user_ids, user_ids)
+
+    def item_index(self, item_ids):
+        return _lookup(self.item_ids, item_ids)
+
+    def user_id_strings(self):
+        return np.char.decode(np.asarray(self.user_ids), 'utf-8')
+
+    def item_id_strings(self):
+        return np.char.decode(np.asarray(self.item_ids), 'utf-8')
+
+    def scale_user_features(self, features):
+        """Apply the training-time StandardScaler to raw user feature rows"""
+        return ((np.asarray(features, dtype=np.float32) - self.user_mean) / self.user_scale).astype(np.float32)
+
+    def scale_item_features(self, features):
+        return ((np.asarray(features, dtype=np.float32) - self.item_mean) / self.item_scale).astype(np.float32)
@@ -0,0 +1,126 @@
+"""
+Stage timing and memory instrumentation for training runs
+=========================================================
+Wrap each pipeline stage in `report.stage(name)` and write the result next
+to the model artifact:
+
+    report = RunReport()
+    with report.stage('fetch'):
+        raw_data = model.fetch_training_data()
+    ...
+    report.write(out_dir / 'run_report.json')
+
+Per stage it records wall time, process CPU time, RSS at start and end, and
+the RSS high-water mark reached during the stage. On Linux the kernel peak
+(VmHWM) is reset at the start of every stage, so each stage gets its own
+high-water mark; elsewhere the process-lifetime peak (ru_maxrss) is used.
+"""
+
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_PROC_STATUS = Path('/proc/self/status')
+_PROC_CLEAR_REFS = Path('/proc/self/clear_refs')
+
+
+def _proc_status_mb(field):
+    """A kB field of /proc/self/status (e.g. VmRSS, VmHWM) in MB, or None"""
+    try:
+        for line in _PROC_STATUS.read_text().splitlines():
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    return _proc_status_mb('VmRSS')
+
+
+def peak_rss_mb():
+    """RSS high-water mark: VmHWM on Linux, ru_maxrss (KB on Linux, bytes on macOS) elsewhere"""
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def reset_peak_rss():
+    """Reset the kernel RSS high-water mark (Linux >= 4.0); False if unsupported"""
+    try:
+        _PROC_CLEAR_REFS.write_text('5')
+        return True
+    except OSError:
+        return False
+
+
+class RunReport:
+    """Collects per-stage timings plus free-form run metadata"""
+
+    def __init__(self, **metadata):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.stages = []
+        self.metadata = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            **metadata,
+        }
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; recorded even if the stage raises"""
+        per_stage_peak = reset_peak_rss()
+        rss_start = current_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        record = {'name': name}
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = f"failed: {type(e).__name__}"
+            raise
+        finally:
+            record.update({
+                'wall_s': time.perf_counter() - wall_start,
+                'cpu_s': time.process_time() - cpu_start,
+                'rss_start_mb': rss_start,
+                'rss_end_mb': current_rss_mb(),
+                'peak_rss_mb': peak_rss_mb(),
+                'peak_scope': 'stage' if per_stage_peak else 'process',
+            })
+            self.stages.append(record)
+            logger.info(f"Stage '{name}' took {record['wall_s']:.2f}s "
+                        f"(cpu {record['cpu_s']:.2f}s, peak RSS {record['peak_rss_mb']:.0f} MB)")
+
+    def add(self, **fields):
+        """Attach extra fields (metrics, dataset sizes, artifact paths) to the report"""
+        self.metadata.update(fields)
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at.isoformat(),
+            'total_wall_s': time.perf_counter() - self._start,
+            'stages': self.stages,
+            **self.metadata,
+        }
+
+    def write(self, path):
+        path = Path(path)
+        path.write_text(json.dumps(self.to_dict(), indent=2, default=str))
+        logger.info(f"Run report written to: {path.resolve()}")
+        return path
@@ -0,0 +1,202 @@
+"""
+Row-sparse updates for the embedding tables
+===========================================
+The gradient of an embedding lookup only has rows for the IDs in the
+batch, but stock Keras touches the whole table on every step:
+
+    Embedding.call   reads the full table before gathering, and the
+                     following in-place update then has to copy it
+    Adam             densifies the IndexedSlices gradient, so the moments
+                     and weights of every row are read and written
+
+RowSparseEmbedding gathers straight from the variable, and LazyAdam applies
+the Adam update only to the rows present in the gradient (the "lazy" Adam
+of TF1 / tensorflow_addons). Rows that are not looked up keep their weights
+and moments untouched, and their moments do not decay while they are idle.
+Dense variables get the ordinary Adam update.
+
+Only step time scales with the batch. Optimizer memory does not: Keras
+creates one slot per variable, so the Adam moments are two full-size copies
+of every embedding table, exactly as with dense Adam (the benchmark's
+optimizer_slots_mb column). What follows the batch size is the per-step
+work and its temporaries; only batch-sized rows are gathered, computed and
+scattered. Over an epoch nearly every user row is touched anyway, so
+moment tables that grow with the touched rows would end up table-sized
+too. An L2 penalty on the whole
+table would densify the gradient again, so the sparse model penalizes the
+looked-up rows instead (see MakanMateRecommendationModel._build_and_compile).
+
+Compare step times of dense and lazy Adam as the user table grows:
+    python sparse_updates.py --users 10000 100000 1000000
+"""
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+
+class RowSparseEmbedding(tf.keras.layers.Embedding):
+    """
+    Embedding whose lookup is a gather on the variable, not on a copy of it.
+    rows_regularizer penalizes the looked-up rows (per example, like an
+    activity regularizer), computed in float32 so the penalty also adds up
+    under mixed precision.
+    """
+
+    def __init__(self, *args, rows_regularizer=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows_regularizer = tf.keras.regularizers.get(rows_regularizer)
+
+    def call(self, inputs):
+        if inputs.dtype not in (tf.int32, tf.int64):
+            inputs = tf.cast(inputs, tf.int32)
+        rows = tf.nn.embedding_lookup(self.embeddings.value, inputs)
+        if self.rows_regularizer is not None:
+            batch_size = tf.cast(tf.shape(rows)[0], rows.dtype)
+            self.add_loss(tf.math.divide_no_nan(self.rows_regularizer(rows), batch_size))
+        return tf.cast(rows, self.compute_dtype)
+
+    def get_config(self):
+        config = super().get_config()
+        config['rows_regularizer'] = tf.keras.regularizers.serialize(self.rows_regularizer)
+        return config
+
+
+class LazyAdam(tf.keras.optimizers.Adam):
+    """Adam that only updates the rows of an IndexedSlices gradient"""
+
+    def update_step(self, gradient, variable, learning_rate):
+        if not isinstance(gradient, tf.IndexedSlices) or self.amsgrad:
+            return super().update_step(gradient, variable, learning_rate)
+
+        dtype = variable.dtype
+        lr = tf.cast(learning_rate, dtype)
+        local_step = tf.cast(self.iterations + 1, dtype)
+        beta_1 = tf.cast(self.beta_1, dtype)
+        beta_2 = tf.cast(self.beta_2, dtype)
+        alpha = lr * tf.sqrt(1 - tf.pow(beta_2, local_step)) / (1 - tf.pow(beta_1, local_step))
+
+        # A row looked up several times in a batch (or on several replicas)
+        # appears once per lookup; sum those before the moment update
+        rows, positions = tf.unique(gradient.indices)
+        values = tf.math.unsorted_segment_sum(
+            tf.cast(gradient.values, dtype), positions, tf.shape(rows)[0]
+        )
+
+        m = self._momentums[self._get_variable_index(variable)]
+        v = self._velocities[self._get_variable_index(variable)]
+        m_rows = beta_1 * tf.gather(m.value, rows) + (1 - beta_1) * values
+        v_rows = beta_2 * tf.gather(v.value, rows) + (1 - beta_2) * tf.square(values)
+
+        self.assign(m, tf.IndexedSlices(m_rows, rows))
+        self.assign(v, tf.IndexedSlices(v_rows, rows))
+        self.assign_sub(
+            variable, tf.IndexedSlices(alpha * m_rows / (tf.sqrt(v_rows) + self.epsilon), rows)
+        )
+
+
+def _synthetic_processed_data(num_users, num_items, interactions, seed=0):
+    """
+    Random arrays in the preprocess_data layout. Generating and featurizing
+    a million synthetic user profiles would dominate the benchmark; the
+    step time only depends on the table sizes and the batch.
+    """
+    from feature_spec import ITEM_FEATURES, USER_FEATURES
+
+    rng = np.random.default_rng(seed)
+    user_features = rng.random((num_users, USER_FEATURES.dim), dtype=np.float32)
+    item_features = rng.random((num_items, ITEM_FEATURES.dim), dtype=np.float32)
+    return {
+        'user_idx': rng.integers(0, num_users, interactions).astype(np.int32),
+        'item_idx': rng.integers(0, num_items, interactions).astype(np.int32),
+        'ratings': rng.uniform(1.0, 5.0, interactions).astype(np.float32),
+        'user_features': user_features,
+        'item_features': item_features,
+    }
+
+
+def benchmark_sparse_updates(user_counts=(10000, 100000, 1000000), items=1000, interactions=51200,
+                             epochs=3, batch_size=512, optimizers=('adam', 'lazy_adam'), seed=0):
+    """
+    Train a fresh model per (table size, optimizer) on the same number of
+    interactions and report the step time, the optimizer slot memory and
+    how far the process RSS rose above its starting point during training
+    (the step's working memory plus whatever the slots add).
+    """
+    from run_report import current_rss_mb, peak_rss_mb, reset_peak_rss
+    from train_recommendation_model import MakanMateRecommendationModel
+    from training_callbacks import StepTimer
+
+    results = []
+    for num_users in user_counts:
+        processed_data = _synthetic_processed_data(num_users, items, interactions, seed)
+        for optimizer in optimizers:
+            logger.info(f"Benchmarking {optimizer} with {num_users} users...")
+            tf.keras.backend.clear_session()
+            tf.keras.utils.set_random_seed(seed)
+            model = MakanMateRecommendationModel(num_users=num_users, num_items=items, optimizer=optimizer)
+            model._build_and_compile()
+
+            timer = StepTimer()
+            rss_before = current_rss_mb()
+            reset_peak_rss()
+            start = time.perf_counter()
+            model.train_model(processed_data, epochs=epochs, batch_size=batch_size,
+                              callbacks=[timer], verbose=0)
+            train_seconds = time.perf_counter() - start
+            steps = timer.steady_step_seconds()
+
+            slot_bytes = sum(
+                int(np.prod(v.shape)) * np.dtype(v.dtype).itemsize
+                for v in model.model.optimizer.variables if len(v.shape)
+            )
+            results.append({
+                'users': num_users,
+                'optimizer': optimizer,
+                'train_seconds': train_seconds,
+                'step_ms_median': float(np.median(steps) * 1000),
+                'step_ms_p95': float(np.percentile(steps, 95) * 1000),
+                'optimizer_slots_mb': slot_bytes / (1024 * 1024),
+                'train_rss_growth_mb': peak_rss_mb() - rss_before,
+            })
+            del model
+
+    return {
+        'items': items,
+        'interactions': interactions,
+        'batch_size': batch_size,
+        'results': results,
+    }
+
+
+def print_sparse_report(report):
+    print(f"{report['interactions']} interactions x {report['items']} items, batch {report['batch_size']}")
+    print(f"  {'users':>9} {'optimizer':<10} {'step ms':>8} {'p95 ms':>8} {'slots MB':>9} {'RSS growth MB':>14}")
+    for r in report['results']:
+        print(f"  {r['users']:>9} {r['optimizer']:<10} {r['step_ms_median']:>8.2f} {r['step_ms_p95']:>8.2f} "
+              f"{r['optimizer_slots_mb']:>9.1f} {r['train_rss_growth_mb']:>14.0f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Dense vs lazy Adam step time by embedding table size")
+    parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--interactions', type=int, default=51200)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = benchmark_sparse_updates(args.users, args.items, args.interactions, args.epochs,
+                                      args.batch_size)
+    print_sparse_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
@@ -0,0 +1,69 @@
+"""
+Resumable Firestore exports against an in-memory Firestore stub
+
+Run with: python -m pytest test_firestore_export.py
+"""
+
+from firestore_export import iter_collection_pages
+from firestore_stub import StubFirestore
+from train_recommendation_model import MakanMateRecommendationModel
+
+
+def _stub_model(interaction_ids):
+    db = StubFirestore({
+        'users': {'u1': {'name': 'Ali'}},
+        'food_items': {'i1': {'name': 'Nasi Lemak'}},
+        'user_interactions': {
+            doc_id: {'userId': 'u1', 'itemId': 'i1', 'interactionType': 'like'}
+            for doc_id in interaction_ids
+        },
+    })
+    model = MakanMateRecommendationModel()
+    model.db = db
+    return model, db.collection('user_interactions')
+
+
+def _interaction_ids(raw_data):
+    return sorted(d['id'] for d in raw_data['interactions'])
+
+
+def test_completed_export_is_not_replayed(tmp_path):
+    model, interactions = _stub_model(['a', 'b'])
+    model.fetch_training_data(checkpoint_dir=tmp_path, page_size=1)
+
+    interactions.docs['c'] = dict(interactions.docs['a'])
+    raw_data = model.fetch_training_data(checkpoint_dir=tmp_path, page_size=1)
+    assert _interaction_ids(raw_data) == ['a', 'b', 'c']
+
+
+def test_completed_sharded_export_is_not_replayed(tmp_path):
+    model, interactions = _stub_model(['A1', 'k2', 'z3'])
+    raw_data = model.fetch_training_data(checkpoint_dir=tmp_path, page_size=1, interaction_shards=2)
+    assert _interaction_ids(raw_data) == ['A1', 'k2', 'z3']
+
+    interactions.docs['b4'] = dict(interactions.docs['A1'])
+    raw_data = model.fetch_training_data(checkpoint_dir=tmp_path, page_size=1, interaction_shards=2)
+    assert _interaction_ids(raw_data) == ['A1', 'b4', 'k2', 'z3']
+
+
+def test_completed_stream_is_not_replayed(tmp_path):
+    model, interactions = _stub_model(['a', 'b'])
+    list(model.iter_interaction_pages(page_size=1, checkpoint_dir=tmp_path))
+
+    interactions.docs['c'] = dict(interactions.docs['a'])
+    pages = model.iter_interaction_pages(page_size=1, checkpoint_dir=tmp_path)
+    assert sorted(d['id'] for page in pages for d in page) == ['a', 'b', 'c']
+
+
+def test_interrupted_export_resumes(tmp_path):
+    model, interactions = _stub_model(['a', 'b', 'c'])
+    pages = iter_collection_pages(interactions, page_size=1, checkpoint_dir=tmp_path)
+    next(pages)
+    next(pages)
+    pages.close()
+
+    interactions.streamed.clear()
+    raw_data = model.fetch_training_data(checkpoint_dir=tmp_path, page_size=1)
+    # 'a' and 'b' are replayed from the spool; only the rest is read
+    assert interactions.streamed == ['c']
+    assert _interaction_ids(raw_data) == ['a', 'b', 'c']
@@ -1,10 +1,22 @@
 """
 Test the TensorFlow Lite model to ensure it works correctly
+
+    python test_model.py [model.tflite]
+    python test_model.py model.tflite --benchmark --json bench.json
 """
 
-import tensorflow as tf
 import numpy as np
+import argparse
+import json
 import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCHMARK_BATCH_SIZES = (1, 8, 64, 512)
+BENCHMARK_THREADS = (1, 2, 4)
 
 def _index_by_name(input_details, target_name_startswith):
     """Find input index by matching the beginning of the tensor name."""
@@ -15,8 +27,202 @@ def _index_by_name(input_details, target_name_startswith):
     raise KeyError(f"Input with name starting '{target_name_startswith}' not found. "
                    f"Available: {[d['name'] for d in input_details]}")
 
-def test_tflite_model(model_path='recommendation_model.tflite'):
-    """Test the TFLite model with sample inputs"""
+def _feature_dims(interpreter):
+    """(user, item) feature widths the model was exported with"""
+    input_details = interpreter.get_input_details()
+    return tuple(
+        int(next(d for d in input_details if d["name"].startswith(prefix))["shape"][-1])
+        for prefix in ("serving_default_user_features", "serving_default_item_features")
+    )
+
+def score_batch(interpreter, user_ids, item_ids, user_features, item_features):
+    """
+    Score N (user, item) pairs in one interpreter call. Inputs are resized to
+    the batch with resize_tensor_input; tensors are only re-allocated when
+    the batch size changes. Models exported with a fixed batch size are fed
+    in chunks of that size instead.
+    """
+    input_details = interpreter.get_input_details()
+    inputs = {
+        "serving_default_user_features": np.asarray(user_features, dtype=np.float32),
+        "serving_default_item_features": np.asarray(item_features, dtype=np.float32),
+        "serving_default_user_id":       np.asarray(user_ids, dtype=np.int32),
+        "serving_default_item_id":       np.asarray(item_ids, dtype=np.int32),
+    }
+    n = len(inputs["serving_default_user_id"])
+
+    fixed_batch = int(input_details[0]["shape_signature"][0])
+    if fixed_batch > 0 and fixed_batch != n:
+        outputs = []
+        for start in range(0, n, fixed_batch):
+            chunk = {k: v[start:start + fixed_batch] for k, v in inputs.items()}
+            size = len(chunk["serving_default_user_id"])
+            # Pad the last chunk up to the baked-in batch size
+            chunk = {k: np.concatenate([v, np.repeat(v[-1:], fixed_batch - size, axis=0)])
+                     for k, v in chunk.items()}
+            outputs.append(score_batch(interpreter, *(chunk[k] for k in (
+                "serving_default_user_id", "serving_default_item_id",
+                "serving_default_user_features", "serving_default_item_features")))[:size])
+        return np.concatenate(outputs)
+
+    if int(input_details[0]["shape"][0]) != n:
+        for d in input_details:
+            interpreter.resize_tensor_input(d["index"], [n] + list(d["shape"][1:]))
+        interpreter.allocate_tensors()
+
+    for prefix, value in inputs.items():
+        interpreter.set_tensor(_index_by_name(interpreter.get_input_details(), prefix), value)
+    interpreter.invoke()
+    output_index = interpreter.get_output_details()[0]["index"]
+    return interpreter.get_tensor(output_index).reshape(-1)
+
+def _check_batched_scoring(interpreter, num_items=500, repeats=20, id_range=50):
+    """Rank num_items items for one user: one batched call vs one call per item"""
+    user_dim, item_dim = _feature_dims(interpreter)
+    user_id = np.random.randint(0, id_range)
+    user_feat = np.random.random((1, user_dim)).astype(np.float32)
+    item_ids = np.random.randint(0, id_range, num_items).astype(np.int32)
+    item_feats = np.random.random((num_items, item_dim)).astype(np.float32)
+    user_ids = np.full(num_items, user_id, dtype=np.int32)
+    user_feats = np.repeat(user_feat, num_items, axis=0)
+
+    # Warm-up call also performs the resize + allocate
+    batched = score_batch(interpreter, user_ids, item_ids, user_feats, item_feats)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        batched = score_batch(interpreter, user_ids, item_ids, user_feats, item_feats)
+    batch_call_ms = (time.perf_counter() - start) * 1000 / repeats
+
+    start = time.perf_counter()
+    single = np.array([
+        score_batch(interpreter, user_ids[i:i + 1], item_ids[i:i + 1],
+                    user_feats[i:i + 1], item_feats[i:i + 1])[0]
+        for i in range(num_items)
+    ])
+    single_total_ms = (time.perf_counter() - start) * 1000
+
+    print(f"   Items scored:        {num_items}")
+    print(f"   Batched:  {batch_call_ms:8.3f} ms/call  {batch_call_ms / num_items * 1000:8.2f} us/item")
+    print(f"   Per-item: {single_total_ms:8.3f} ms total {single_total_ms / num_items * 1000:8.2f} us/item")
+    print(f"   Speed-up:            {single_total_ms / max(batch_call_ms, 1e-9):.1f}x")
+
+    max_diff = float(np.max(np.abs(batched - single)))
+    print(f"   Max |batched - per-item|: {max_diff:.2e}")
+    top = np.argsort(-batched)[:5]
+    print(f"   Top-5 items for user {user_id}: {item_ids[top].tolist()}")
+    return max_diff < 1e-3
+
+def _random_pairs(interpreter, n, id_range=50):
+    """n random (user, item) pairs in score_batch argument order"""
+    user_dim, item_dim = _feature_dims(interpreter)
+    return (
+        np.random.randint(0, id_range, n).astype(np.int32),
+        np.random.randint(0, id_range, n).astype(np.int32),
+        np.random.random((n, user_dim)).astype(np.float32),
+        np.random.random((n, item_dim)).astype(np.float32),
+    )
+
+def _peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _time_calls(fn, runs, warmup):
+    """Per-call wall time in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    timings = np.empty(runs)
+    for i in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings[i] = (time.perf_counter() - start) * 1000
+    return timings
+
+def benchmark_tflite_model(model_path='recommendation_model.tflite', batch_sizes=BENCHMARK_BATCH_SIZES,
+                           thread_counts=BENCHMARK_THREADS, runs=200, warmup=10, id_range=50):
+    """
+    Latency/throughput benchmark of a TFLite model on the CPU interpreter:
+    load and allocate_tensors time, single-pair p50/p95/p99 latency, and
+    batched throughput for every (num_threads, batch size) combination.
+    Peak RSS includes the TensorFlow import; baseline_rss_mb is the peak
+    before the model is loaded. Returns a JSON-serialisable dict.
+    """
+    import tensorflow as tf
+
+    baseline_rss_mb = _peak_rss_mb()
+    start = time.perf_counter()
+    interpreter = tf.lite.Interpreter(model_path=model_path)
+    load_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    interpreter.allocate_tensors()
+    allocate_ms = (time.perf_counter() - start) * 1000
+
+    single = _random_pairs(interpreter, 1, id_range)
+    timings = _time_calls(lambda: score_batch(interpreter, *single), runs, warmup)
+    report = {
+        "model_path": os.path.abspath(model_path),
+        "model_size_kb": os.path.getsize(model_path) / 1024,
+        "inputs": {d["name"]: np.dtype(d["dtype"]).name for d in interpreter.get_input_details()},
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "tensorflow": tf.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+        "load_ms": load_ms,
+        "allocate_ms": allocate_ms,
+        "single": {
+            "mean_ms": float(timings.mean()),
+            "p50_ms": float(np.percentile(timings, 50)),
+            "p95_ms": float(np.percentile(timings, 95)),
+            "p99_ms": float(np.percentile(timings, 99)),
+        },
+        "batched": [],
+    }
+
+    for num_threads in thread_counts:
+        interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        for batch_size in batch_sizes:
+            pairs = _random_pairs(interpreter, batch_size, id_range)
+            # Fewer runs for large batches keeps the total time bounded
+            batch_runs = max(10, runs * 8 // max(batch_size, 8))
+            timings = _time_calls(lambda: score_batch(interpreter, *pairs), batch_runs, warmup)
+            report["batched"].append({
+                "num_threads": num_threads,
+                "batch_size": batch_size,
+                "runs": batch_runs,
+                "p50_ms": float(np.percentile(timings, 50)),
+                "p95_ms": float(np.percentile(timings, 95)),
+                "items_per_sec": float(batch_size / (timings.mean() / 1000)),
+            })
+
+    report["baseline_rss_mb"] = baseline_rss_mb
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+def print_benchmark(report):
+    print("=" * 60)
+    print(f"Benchmark: {report['model_path']} ({report['model_size_kb']:.1f} KB)")
+    print("=" * 60)
+    print(f"   Load:            {report['load_ms']:.2f} ms")
+    print(f"   allocate_tensors: {report['allocate_ms']:.2f} ms")
+    single = report["single"]
+    print(f"   Single pair:     p50 {single['p50_ms']:.3f} ms  p95 {single['p95_ms']:.3f} ms  "
+          f"p99 {single['p99_ms']:.3f} ms")
+    print(f"\n   {'threads':>7} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9} {'items/s':>12}")
+    for row in report["batched"]:
+        print(f"   {row['num_threads']:>7} {row['batch_size']:>6} {row['p50_ms']:>9.3f} "
+              f"{row['p95_ms']:>9.3f} {row['items_per_sec']:>12,.0f}")
+    print(f"\n   Peak RSS:        {report['peak_rss_mb']:.1f} MB "
+          f"(before load: {report['baseline_rss_mb']:.1f} MB)")
+
+def test_tflite_model(model_path='recommendation_model.tflite', batch_items=500):
+    """Test the TFLite model with sample inputs (skipped under pytest if it has not been exported)"""
+    import tensorflow as tf
+
+    if not os.path.exists(model_path):
+        import pytest
+        pytest.skip(f"{model_path} not found; run train_recommendation_model.py export first")
 
     print("=" * 60)
     print("Testing MakanMate Recommendation Model")
@@ -24,13 +230,9 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
 
     # 1) Load model
     print("\n1. Loading model...")
-    try:
-        interpreter = tf.lite.Interpreter(model_path=model_path)
-        interpreter.allocate_tensors()
-        print(" Model loaded successfully")
-    except Exception as e:
-        print(f" Failed to load model: {e}")
-        return False
+    interpreter = tf.lite.Interpreter(model_path=model_path)
+    interpreter.allocate_tensors()
+    print(" Model loaded successfully")
 
     # 2) Inspect I/O
     print("\n2. Checking model structure...")
@@ -59,14 +261,11 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
     #   serving_default_item_features:0
     #   serving_default_user_id:0
     #   serving_default_item_id:0
-    try:
-        idx_user_features = _index_by_name(input_details, "serving_default_user_features")
-        idx_item_features = _index_by_name(input_details, "serving_default_item_features")
-        idx_user_id       = _index_by_name(input_details, "serving_default_user_id")
-        idx_item_id       = _index_by_name(input_details, "serving_default_item_id")
-    except KeyError as e:
-        print(f"\n Could not resolve input indices: {e}")
-        return False
+    # (_index_by_name raises KeyError listing the available names)
+    for prefix in ("serving_default_user_features", "serving_default_item_features",
+                   "serving_default_user_id", "serving_default_item_id"):
+        _index_by_name(input_details, prefix)
+    user_dim, item_dim = _feature_dims(interpreter)
 
     # 4) Create sample inputs with CORRECT shapes/dtypes
     print("\n3. Creating sample inputs...")
@@ -74,12 +273,12 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
     # Expected:
     # - user_id:        int32 [1]
     # - item_id:        int32 [1]
-    # - user_features:  float32 [1, 15]
-    # - item_features:  float32 [1, 15]
+    # - user_features:  float32 [1, user_dim]
+    # - item_features:  float32 [1, item_dim]
     sample_user_id = np.array([1], dtype=np.int32)
     sample_item_id = np.array([3], dtype=np.int32)
-    sample_user_features = np.random.random((1, 15)).astype(np.float32)
-    sample_item_features = np.random.random((1, 15)).astype(np.float32)  # <-- 15, not 20
+    sample_user_features = np.random.random((1, user_dim)).astype(np.float32)
+    sample_item_features = np.random.random((1, item_dim)).astype(np.float32)
 
     print("   ✓ Sample user ID:", sample_user_id, sample_user_id.dtype)
     print("   ✓ Sample item ID:", sample_item_id, sample_item_id.dtype)
@@ -88,26 +287,18 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
 
     # 5) Run inference (feed tensors by resolved indices)
     print("\n4. Running inference...")
-    try:
-        interpreter.set_tensor(idx_user_features, sample_user_features)  # float32 [1,15]
-        interpreter.set_tensor(idx_item_features, sample_item_features)  # float32 [1,15]
-        interpreter.set_tensor(idx_user_id,       sample_user_id)        # int32   [1]
-        interpreter.set_tensor(idx_item_id,       sample_item_id)        # int32   [1]
-
-        interpreter.invoke()
-
-        output = interpreter.get_tensor(output_details[0]['index'])
-        print("    Inference successful!")
-        print(f"   Predicted rating: {float(output[0][0]):.2f} / 5.0")
+    # score_batch feeds tensors by resolved name and also handles
+    # models exported with a fixed batch size
+    output = score_batch(interpreter, sample_user_id, sample_item_id,
+                         sample_user_features, sample_item_features).reshape(-1, 1)
+    assert np.isfinite(output).all(), f"Non-finite prediction: {output[0][0]}"
+    print("    Inference successful!")
+    print(f"   Predicted rating: {float(output[0][0]):.2f} / 5.0")
 
-        if 1.0 <= output[0][0] <= 5.0:
-            print("    Output is in valid range (1-5)")
-        else:
-            print(f"     Warning: Output {output[0][0]} is outside expected range")
-
-    except Exception as e:
-        print(f"    Inference failed: {e}")
-        return False
+    if 1.0 <= output[0][0] <= 5.0:
+        print("    Output is in valid range (1-5)")
+    else:
+        print(f"     Warning: Output {output[0][0]} is outside expected range")
 
     # 6) Multiple test cases
     print("\n5. Running multiple test cases...")
@@ -115,16 +306,10 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
     for i in range(10):
         user_id = np.array([np.random.randint(0, 50)], dtype=np.int32)
         item_id = np.array([np.random.randint(0, 50)], dtype=np.int32)
-        user_feat = np.random.random((1, 15)).astype(np.float32)
-        item_feat = np.random.random((1, 15)).astype(np.float32)
-
-        interpreter.set_tensor(idx_user_features, user_feat)
-        interpreter.set_tensor(idx_item_features, item_feat)
-        interpreter.set_tensor(idx_user_id,       user_id)
-        interpreter.set_tensor(idx_item_id,       item_id)
+        user_feat = np.random.random((1, user_dim)).astype(np.float32)
+        item_feat = np.random.random((1, item_dim)).astype(np.float32)
 
-        interpreter.invoke()
-        out = interpreter.get_tensor(output_details[0]['index'])
+        out = score_batch(interpreter, user_id, item_id, user_feat, item_feat).reshape(-1, 1)
         test_results.append(float(out[0][0]))
         print(f"   Test {i+1}: User {user_id[0]}, Item {item_id[0]} → Rating: {out[0][0]:.2f}")
 
@@ -141,10 +326,41 @@ def test_tflite_model(model_path='recommendation_model.tflite'):
     print("    Model size is optimized for mobile" if model_size < 5.0
           else "     Model size is large, consider optimization")
 
+    # 8) Batched scoring (one call for a whole candidate list)
+    if batch_items:
+        print(f"\n8. Batched scoring...")
+        assert _check_batched_scoring(interpreter, num_items=batch_items), \
+            "Batched and per-item predictions disagree"
+
     print("\n" + "=" * 60)
     print(" MODEL VERIFICATION COMPLETE")
-    return True
 
 if __name__ == "__main__":
-    ok = test_tflite_model('recommendation_model.tflite')
-    print("\n SUCCESS!" if ok else "\n Model verification failed. Please check the errors above.")
+    parser = argparse.ArgumentParser(description="Verify the MakanMate TFLite model")
+    parser.add_argument('model_path', nargs='?', default='recommendation_model.tflite')
+    parser.add_argument('--batch-items', type=int, default=500,
+                        help="items to score in one batched call (0 to skip)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="run the latency/throughput benchmark instead of the checks")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BENCHMARK_BATCH_SIZES))
+    parser.add_argument('--threads', type=int, nargs='+', default=list(BENCHMARK_THREADS))
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--json', help="write the benchmark report to this file")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        report = benchmark_tflite_model(args.model_path, batch_sizes=args.batch_sizes,
+                                        thread_counts=args.threads, runs=args.runs)
+        print_benchmark(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"   Report written to: {args.json}")
+    elif not os.path.exists(args.model_path):
+        print(f" Model not found: {args.model_path}")
+    else:
+        try:
+            test_tflite_model(args.model_path, batch_items=args.batch_items)
+            print("\n SUCCESS!")
+        except Exception as e:
+            print(f"\n Model verification failed: {e!r}")
@@ -0,0 +1,60 @@
+"""
+recommend on a model restored from preprocessing artifacts
+
+Run with: python -m pytest test_recommend.py
+"""
+
+import numpy as np
+import pytest
+
+from train_recommendation_model import MakanMateRecommendationModel
+
+
+@pytest.fixture(scope='module')
+def trained(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp('preprocessing')
+    model = MakanMateRecommendationModel(num_users=20, num_items=10, embedding_dim=4)
+    model.preprocess_data(model.generate_synthetic_data(seed=0))
+    model.build_model()
+    model.export_preprocessing_artifacts(out_dir)
+    return out_dir, model
+
+
+def _restored(out_dir, trained_model):
+    model = MakanMateRecommendationModel(embedding_dim=trained_model.embedding_dim)
+    model.load_preprocessing_artifacts(out_dir)
+    model.build_model()
+    model.model.set_weights(trained_model.model.get_weights())
+    return model
+
+
+def test_recommend_after_artifacts_round_trip(trained):
+    out_dir, trained_model = trained
+    model = _restored(out_dir, trained_model)
+    assert (model.interaction_matrix != trained_model.interaction_matrix).nnz == 0
+
+    user_ids = model.user_encoder.classes_[:5].tolist()
+    recommendations = model.recommend(user_ids, k=3)
+    expected = trained_model.recommend(user_ids, k=3)
+    assert list(recommendations) == user_ids
+    for user_id in user_ids:
+        items = [item for item, _ in recommendations[user_id]]
+        assert items == [item for item, _ in expected[user_id]]
+        seen = model.item_encoder.classes_[model.interaction_matrix[model.user_encoder.transform([user_id])].indices]
+        assert not set(items) & set(seen)
+
+
+def test_exclude_seen_without_interactions_is_an_error(trained, tmp_path):
+    out_dir, trained_model = trained
+    # Artifacts written without the seen-items matrix
+    for path in out_dir.iterdir():
+        (tmp_path / path.name).write_bytes(path.read_bytes())
+    with np.load(out_dir / 'scalers.npz') as scalers:
+        np.savez(tmp_path / 'scalers.npz', **{k: v for k, v in scalers.items() if not k.startswith('seen_')})
+    model = _restored(tmp_path, trained_model)
+    assert model.interaction_matrix is None
+
+    user_ids = model.user_encoder.classes_[:1].tolist()
+    with pytest.raises(ValueError, match='exclude_seen'):
+        model.recommend(user_ids)
+    assert list(model.recommend(user_ids, k=3, exclude_seen=False)) == user_ids
@@ -0,0 +1,63 @@
+"""
+Incremental snapshot refresh against an in-memory Firestore stub
+
+Run with: python -m pytest test_snapshot_cache.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from firestore_stub import StubFirestore
+from snapshot_cache import read_snapshot
+from train_recommendation_model import MakanMateRecommendationModel
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _interaction(user, item, minutes):
+    # Like the app: a 'timestamp' on creation and no 'updatedAt'
+    return {'userId': user, 'itemId': item, 'interactionType': 'like',
+            'timestamp': T0 + timedelta(minutes=minutes)}
+
+
+def test_refresh_pulls_only_new_interactions(tmp_path):
+    db = StubFirestore({
+        'users': {'u1': {'updatedAt': T0}},
+        'food_items': {'i1': {'updatedAt': T0}, 'i2': {'updatedAt': T0}},
+        'user_interactions': {
+            'a': _interaction('u1', 'i1', 1),
+            'b': _interaction('u1', 'i2', 2),
+        },
+    })
+    model = MakanMateRecommendationModel()
+    model.db = db
+
+    model.fetch_training_data(snapshot_dir=tmp_path, page_size=1)
+    interactions = db.collection('user_interactions')
+    assert sorted(interactions.streamed) == ['a', 'b']
+
+    interactions.docs['c'] = _interaction('u1', 'i1', 3)
+    interactions.queries.clear()
+    interactions.streamed.clear()
+    raw_data = model.fetch_training_data(snapshot_dir=tmp_path, page_size=1)
+
+    # Only documents newer than the snapshot's newest 'timestamp' are read...
+    assert interactions.streamed == ['c']
+    assert all(filters == (('timestamp', '>', T0 + timedelta(minutes=2)),)
+               for filters in interactions.queries)
+    # ...and merged into the snapshot
+    assert sorted(read_snapshot(tmp_path, 'user_interactions')['id'].to_pylist()) == ['a', 'b', 'c']
+    assert sorted(d['id'] for d in raw_data['interactions']) == ['a', 'b', 'c']
+
+
+def test_update_field_override(tmp_path):
+    db = StubFirestore({
+        'users': {'u1': {'updatedAt': T0}},
+        'food_items': {'i1': {'updatedAt': T0, 'modified': T0}},
+        'user_interactions': {'a': _interaction('u1', 'i1', 1)},
+    })
+    model = MakanMateRecommendationModel()
+    model.db = db
+
+    model.fetch_training_data(snapshot_dir=tmp_path, update_fields={'food_items': 'modified'})
+    model.fetch_training_data(snapshot_dir=tmp_path, update_fields={'food_items': 'modified'})
+    assert db.collection('food_items').queries[-1] == (('modified', '>', T0),)
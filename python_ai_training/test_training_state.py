@@ -0,0 +1,77 @@
+"""
+Warm-start training state compatibility checks
+
+Run with: python -m pytest test_training_state.py
+"""
+
+import numpy as np
+import pytest
+
+from train_recommendation_model import MakanMateRecommendationModel
+
+
+@pytest.fixture(scope='module')
+def saved_state(tmp_path_factory):
+    state_dir = tmp_path_factory.mktemp('training_state')
+    model = MakanMateRecommendationModel(num_users=20, num_items=10, embedding_dim=4)
+    raw_data = model.generate_synthetic_data(seed=0)
+    processed_data = model.preprocess_data(raw_data)
+    model.build_model()
+    model.save_training_state(state_dir, processed_data)
+    return state_dir, model, raw_data
+
+
+def _fresh_model(saved_model):
+    return MakanMateRecommendationModel(num_users=saved_model.num_users, num_items=saved_model.num_items,
+                                        embedding_dim=saved_model.embedding_dim)
+
+
+def test_matching_state_warm_starts(saved_state):
+    state_dir, saved_model, raw_data = saved_state
+    model = _fresh_model(saved_model)
+    state = model.load_training_state(state_dir)
+    assert state is not None
+
+    model.preprocess_data(raw_data, fit_scalers=False)
+    model.build_model()
+    model.warm_start(state)
+
+
+@pytest.mark.parametrize('dim_attr', ['user_feature_dim', 'item_feature_dim'])
+def test_feature_dim_change_trains_from_scratch(saved_state, dim_attr):
+    state_dir, saved_model, _ = saved_state
+    model = _fresh_model(saved_model)
+    # As if a feature had been added to USER_FEATURES / ITEM_FEATURES
+    setattr(model, dim_attr, getattr(model, dim_attr) + 1)
+    assert model.load_training_state(state_dir) is None
+    assert model.user_scaler is None and model.item_scaler is None
+
+
+def test_restored_model_recommends(saved_state):
+    state_dir, saved_model, _ = saved_state
+    model = MakanMateRecommendationModel.from_training_state(state_dir)
+    user_ids = saved_model.user_encoder.classes_[:3].tolist()
+
+    recommendations = model.recommend(user_ids, k=3)
+    expected = saved_model.recommend(user_ids, k=3)
+    assert {u: [item for item, _ in recs] for u, recs in recommendations.items()} == \
+        {u: [item for item, _ in recs] for u, recs in expected.items()}
+
+
+def test_unchanged_data_fine_tunes_nothing(saved_state):
+    state_dir, saved_model, raw_data = saved_state
+    model = _fresh_model(saved_model)
+    state = model.load_training_state(state_dir)
+    processed_data = model.preprocess_data(raw_data, fit_scalers=False)
+    model.build_model()
+    model.warm_start(state)
+
+    # Rows at the high-water mark were trained on when the state was saved
+    since = state['data_high_water_mark']
+    assert (processed_data['timestamps'] == since).any()
+    assert len(model.recent_rows(processed_data, since)) == 0
+    assert model.fine_tune(processed_data, since=since) is None
+
+    newer = dict(processed_data, timestamps=np.where(processed_data['timestamps'] == since,
+                                                     since + np.timedelta64(1, 's'), processed_data['timestamps']))
+    assert len(model.recent_rows(newer, since)) == (processed_data['timestamps'] == since).sum()
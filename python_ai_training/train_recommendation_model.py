@@ -1,41 +1,193 @@
+"""
+MakanMate recommendation model training pipeline
+
+    python train_recommendation_model.py              # full pipeline (same as `run`)
+    python train_recommendation_model.py fetch --snapshot-dir snapshots
+    python train_recommendation_model.py preprocess --snapshot-dir snapshots --out-dir processed
+    python train_recommendation_model.py train --processed-dir processed
+    python train_recommendation_model.py export --state-dir training_state
+    python train_recommendation_model.py benchmark recommendation_model.tflite
+
+TensorFlow, pandas, scikit-learn, SciPy and firebase_admin are imported
+inside the methods that use them, and Firebase is only initialized the
+first time `db` is used, so --help and offline steps start quickly and
+need no credentials.
+"""
+
 from pathlib import Path
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.model_selection import train_test_split
-import tensorflow as tf
 import numpy as np
-import pandas as pd
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import functools
+import hashlib
+import itertools
 import json
 import pickle
 import os
-from datetime import datetime, timedelta
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import logging
 
+from ann_index import BENCHMARK_NPROBES, DEFAULT_NPROBE, IVFIndex, benchmark_index, choose_nprobe
+from distribute import (
+    STRATEGIES, fit_multi_worker, is_chief, is_multi_worker, make_strategy, strategy_scope, worker_info,
+)
+from feature_spec import ITEM_FEATURES, USER_FEATURES
+from precision import PRECISION_MODES, precision_policy
+from preprocessing_artifacts import PreprocessingArtifacts, save_preprocessing_artifacts
+from run_report import RunReport
+from firestore_export import (
+    DEFAULT_PAGE_SIZE, document_id_shards, iter_collection_pages, reset_checkpoint, shard_query,
+)
+from snapshot_cache import (
+    DEFAULT_UPDATE_FIELD, UPDATE_FIELDS, high_water_mark, merge_snapshot, read_snapshot,
+    snapshot_documents, snapshot_path, update_field_for, write_snapshot,
+)
+
+SCRIPT_DIR = Path(__file__).parent
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Implicit ratings for interactions without an explicit score
+INTERACTION_TYPE_RATINGS = {
+    'order': 5.0,
+    'like': 4.0,
+    'bookmark': 3.5,
+    'view': 2.0,
+}
+DEFAULT_INTERACTION_RATING = 3.0
+
+# Reducers for collapsing repeated (user, item) interactions into one
+# training sample (see preprocess_data(aggregate=...))
+AGGREGATION_REDUCERS = ('max', 'recency', 'precedence')
+# Age at which an interaction counts half as much under the 'recency' reducer
+RECENCY_HALF_LIFE_DAYS = 30.0
+
+# (user, item) pairs scored per model call by score_users / recommend
+RECOMMEND_BATCH_SIZE = 65536
+
+# Users sampled to tune the exported retrieval index against exact scoring
+RETRIEVAL_BENCHMARK_USERS = 200
+
+# Model architectures supported by build_model
+ARCHITECTURES = ('mlp', 'two_tower')
+
+# Optimizers: 'lazy_adam' updates only the embedding rows in the batch
+# (see sparse_updates.py)
+OPTIMIZERS = ('adam', 'lazy_adam')
+EMBEDDING_L2 = 1e-6
+
+# Synthetic data generation
+SYNTHETIC_CUISINES = ['malay', 'chinese', 'indian', 'western', 'thai']
+SYNTHETIC_INTERACTIONS_PER_USER = 20
+SYNTHETIC_CHUNK_SIZE = 1000000
+
+# Firestore collections read by fetch_training_data, in (users, items, interactions) order
+TRAINING_COLLECTIONS = ['users', 'food_items', 'user_interactions']
+
+# Columns of the flattened interaction frame used by preprocessing
+INTERACTION_COLUMNS = ['userId', 'itemId', 'interactionType', 'rating', 'timestamp']
+
+# Preprocessed arrays persisted by save_processed_data
+PROCESSED_ARRAYS = ['user_idx', 'item_idx', 'ratings', 'user_features', 'item_features']
+OPTIONAL_PROCESSED_ARRAYS = ['timestamps', 'sample_weight']
+
+# tf.data streaming defaults for interaction logs larger than memory
+STREAM_CHUNK_SIZE = 65536
+STREAM_SHUFFLE_BUFFER = 100000
+
+# Warm-start state written by save_training_state (next to the
+# preprocessing artifacts, see preprocessing_artifacts)
+TRAINING_STATE_FILE = 'state.json'
+TRAINING_WEIGHTS_FILE = 'weights.npz'
+# Embedding layers whose rows follow an encoder's class order
+EMBEDDING_ENCODERS = {'user_embedding': 'user_encoder', 'item_embedding': 'item_encoder'}
+FINE_TUNE_EPOCHS = 5
+FINE_TUNE_LEARNING_RATE = 1e-4
+
+# TFLite conversion modes, smallest change first
+TFLITE_MODES = ('none', 'dynamic', 'float16', 'int8')
+# Interactions drawn from the training data to calibrate int8 ranges
+REPRESENTATIVE_SAMPLES = 500
+# Held-out interactions scored when comparing quantization modes
+QUANTIZATION_EVAL_SAMPLES = 5000
+QUANTIZATION_LATENCY_RUNS = 200
+
+# Field fallbacks for entity IDs across Firestore schema versions
+USER_ID_KEYS = ['id', 'uid', 'userId', 'user_id']
+ITEM_ID_KEYS = ['id', 'itemId', 'item_id', 'foodId']
+
 class MakanMateRecommendationModel:
-    def __init__(self, num_users=1000, num_items=500, embedding_dim=64):
+    def __init__(self, num_users=1000, num_items=500, embedding_dim=64,
+                 architecture='mlp', tower_dim=32, strategy=None, precision='default',
+                 optimizer='adam'):
+        """
+        architecture: 'mlp' (concatenated towers through dense layers) or
+            'two_tower' (dot product of separately exportable user/item towers)
+        tower_dim: output size of each tower for 'two_tower'
+        strategy: tf.distribute strategy to build and train under (see
+            distribute.make_strategy); None trains on the default strategy
+        precision: 'default', 'xla' (jit_compile) or 'mixed_bfloat16'
+            (see precision.py)
+        optimizer: 'adam', or 'lazy_adam' for row-sparse embedding updates
+            whose step time does not grow with the number of users
+        """
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"Unknown architecture: {architecture}")
+        if precision not in PRECISION_MODES:
+            raise ValueError(f"Unknown precision mode: {precision}")
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer: {optimizer}")
+
         self.num_users = num_users
         self.num_items = num_items
         self.embedding_dim = embedding_dim
-        self.user_feature_dim = 15
-        self.item_feature_dim = 15
+        self.user_feature_dim = USER_FEATURES.dim
+        self.item_feature_dim = ITEM_FEATURES.dim
+        self.architecture = architecture
+        self.tower_dim = tower_dim
+        self.strategy = strategy
+        self.precision = precision
+        self.optimizer = optimizer
 
         
         self.model = None
-        self.user_scaler = StandardScaler()
-        self.item_scaler = StandardScaler()
-        self.user_encoder = LabelEncoder()
-        self.item_encoder = LabelEncoder()
+        self.user_tower = None
+        self.item_tower = None
+        self.user_features_scaled = None
+        self.item_features_scaled = None
+        self.interaction_matrix = None
+        # Fitted by preprocess_data, or restored by load_preprocessing_artifacts
+        self.user_scaler = None
+        self.item_scaler = None
+        self.user_encoder = None
+        self.item_encoder = None
         
-        # Initialize Firebase
-        self.init_firebase()
+        # Firebase is initialized on first use of self.db
+        self._db = None
+        self._firebase_initialized = False
+    
+    @property
+    def db(self):
+        """Firestore client (None if Firebase is unavailable), connected on first access"""
+        if not self._firebase_initialized:
+            self.init_firebase()
+        return self._db
+    
+    @db.setter
+    def db(self, client):
+        self._db = client
+        self._firebase_initialized = True
         
     def init_firebase(self):
         """Initialize Firebase Admin SDK"""
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
         try:
             if not firebase_admin._apps:
                 # You need to download the service account key from Firebase Console
@@ -49,78 +201,227 @@ class MakanMateRecommendationModel:
             # Use dummy data for training if Firebase is not available
             self.db = None
     
-    def fetch_training_data(self):
-        """Fetch training data from Firestore"""
-        logger.info("Fetching training data from Firestore...")
+    def _as_record(self, doc_id, d):
+        """Attach doc.id into the dict so downstream code can rely on 'id'"""
+        if 'id' not in d:
+            d['id'] = doc_id
+        return d
 
-        if self.db is None:
-            logger.warning("Firebase not available, using synthetic data")
-            return self.generate_synthetic_data()
+    def _normalize_interaction(self, d):
+        """Normalize interaction field names for downstream use"""
+        if 'userId' not in d:
+            d['userId'] = d.get('user_id') or d.get('uid') or d.get('user') or ''
+        if 'itemId' not in d:
+            d['itemId'] = d.get('item_id') or d.get('foodId') or d.get('item') or ''
+        return d
 
-        try:
-            users_ref = self.db.collection('users')
-            items_ref = self.db.collection('food_items')
-            interactions_ref = self.db.collection('user_interactions')
-
-            # Attach doc.id into the dicts so downstream code can rely on 'id'
-            users = []
-            for doc in users_ref.stream():
-                d = doc.to_dict() or {}
-                if 'id' not in d:
-                    d['id'] = doc.id
-                users.append(d)
-
-            items = []
-            for doc in items_ref.stream():
-                d = doc.to_dict() or {}
-                if 'id' not in d:
-                    d['id'] = doc.id
-                items.append(d)
-
-            interactions = []
-            for doc in interactions_ref.stream():
-                d = doc.to_dict() or {}
-                # normalize field names for downstream use
-                if 'userId' not in d:
-                    d['userId'] = d.get('user_id') or d.get('uid') or d.get('user') or ''
-                if 'itemId' not in d:
-                    d['itemId'] = d.get('item_id') or d.get('foodId') or d.get('item') or ''
-                interactions.append(d)
-
-            logger.info(f"Fetched {len(users)} users, {len(items)} items, {len(interactions)} interactions")
-
-            # Fallback to synthetic if any critical collection is empty
-            if len(users) == 0 or len(items) == 0 or len(interactions) == 0:
-                logger.warning("Firestore has insufficient data (users/items/interactions). Using synthetic data.")
+    def _iter_documents(self, collection, page_size, checkpoint_dir):
+        """Yield pages of document dicts with doc.id attached as 'id'"""
+        pages = iter_collection_pages(
+            self.db.collection(collection), page_size=page_size,
+            checkpoint_dir=checkpoint_dir, name=collection,
+        )
+        for page in pages:
+            yield [self._as_record(doc_id, d) for doc_id, d in page]
+        if checkpoint_dir is not None:
+            # The export finished; the next fetch must query Firestore again
+            # instead of replaying this spool
+            reset_checkpoint(checkpoint_dir, collection)
+
+    def iter_interaction_pages(self, page_size=DEFAULT_PAGE_SIZE, checkpoint_dir=None):
+        """Yield pages of normalized interaction dicts as they arrive from Firestore"""
+        for page in self._iter_documents('user_interactions', page_size, checkpoint_dir):
+            yield [self._normalize_interaction(d) for d in page]
+
+    def _fetch_snapshot(self, collection, page_size, checkpoint_dir, snapshot_dir,
+                        update_field=DEFAULT_UPDATE_FIELD, refresh=True):
+        """
+        Return a collection's documents from the local Parquet snapshot,
+        first pulling only documents newer than the snapshot's high-water mark.
+        """
+        table = read_snapshot(snapshot_dir, collection)
+        if table is not None and not refresh:
+            logger.info(f"Using '{collection}' snapshot ({table.num_rows} documents, no refresh)")
+            return [self._as_record(doc_id, d) for doc_id, d in snapshot_documents(table)]
+
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        since = high_water_mark(table)
+        query = self.db.collection(collection)
+        order_field = None
+        if since is not None:
+            query = query.where(filter=FieldFilter(update_field, '>', since))
+            order_field = update_field
+        elif table is not None and table.num_rows:
+            logger.warning(f"'{collection}' snapshot has no '{update_field}' values; refreshing in full")
+            table = None
+
+        delta = [
+            doc
+            for page in iter_collection_pages(
+                query, page_size=page_size, checkpoint_dir=checkpoint_dir,
+                name=f"{collection}.delta", order_field=order_field,
+            )
+            for doc in page
+        ]
+        logger.info(f"Pulled {len(delta)} new/updated '{collection}' documents since {since}")
+
+        table = merge_snapshot(table, delta, update_field)
+        write_snapshot(snapshot_dir, collection, table)
+        if checkpoint_dir is not None:
+            # The delta is now part of the snapshot; the next refresh starts a new one
+            reset_checkpoint(checkpoint_dir, f"{collection}.delta")
+
+        return [self._as_record(doc_id, d) for doc_id, d in snapshot_documents(table)]
+
+    def _fetch_collection(self, collection, page_size, checkpoint_dir, shards=1):
+        """Fetch a whole collection as dicts, splitting it into document-ID shards read in parallel"""
+        if shards <= 1:
+            return [d for page in self._iter_documents(collection, page_size, checkpoint_dir) for d in page]
+
+        collection_ref = self.db.collection(collection)
+
+        def fetch_shard(shard, lo, hi):
+            pages = iter_collection_pages(
+                shard_query(collection_ref, lo, hi), page_size=page_size,
+                checkpoint_dir=checkpoint_dir, name=f"{collection}.shard{shard}",
+            )
+            return [self._as_record(doc_id, d) for page in pages for doc_id, d in page]
+
+        ranges = document_id_shards(shards)
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix=collection) as pool:
+            parts = list(pool.map(fetch_shard, range(len(ranges)), *zip(*ranges)))
+        if checkpoint_dir is not None:
+            # Only once every shard is in; a failed shard resumes from its spool
+            for shard in range(len(ranges)):
+                reset_checkpoint(checkpoint_dir, f"{collection}.shard{shard}")
+        return [d for part in parts for d in part]
+
+    def fetch_training_data(self, page_size=DEFAULT_PAGE_SIZE, checkpoint_dir=None,
+                            stream_interactions=False, snapshot_dir=None,
+                            update_fields=None, refresh_snapshot=True,
+                            max_workers=3, interaction_shards=1):
+        """
+        Fetch training data from Firestore with paginated, resumable reads.
+        users, food_items and user_interactions are fetched concurrently.
+
+        page_size: documents per Firestore request
+        checkpoint_dir: spool pages and cursors here so an interrupted fetch
+            resumes after the last completed page (see firestore_export);
+            a collection's checkpoint is removed once it is fully fetched
+        stream_interactions: return 'interactions' as a lazy iterator of pages
+            that preprocess_data consumes page by page, instead of one list
+            (ignored when snapshot_dir is set)
+        snapshot_dir: keep a local Parquet snapshot per collection and only
+            pull documents whose update field is newer than it (see snapshot_cache)
+        update_fields: {collection: field} overriding snapshot_cache.UPDATE_FIELDS
+            ('timestamp' for user_interactions, 'updatedAt' otherwise)
+        refresh_snapshot: if False, use existing snapshots without any Firestore reads
+        max_workers: threads used to fetch the collections
+        interaction_shards: split user_interactions into this many document-ID
+            ranges fetched in parallel (full exports only)
+        """
+        logger.info("Fetching training data from Firestore...")
+
+        have_snapshots = snapshot_dir is not None and all(
+            snapshot_path(snapshot_dir, c).exists() for c in TRAINING_COLLECTIONS
+        )
+        # Reading existing snapshots without a refresh never touches Firebase
+        if not (have_snapshots and not refresh_snapshot) and self.db is None:
+            if have_snapshots:
+                logger.warning("Firebase not available, using local snapshot")
+                refresh_snapshot = False
+            else:
+                logger.warning("Firebase not available, using synthetic data")
                 return self.generate_synthetic_data()
 
-            return {
-                'users': users,
-                'items': items,
-                'interactions': interactions,
-            }
-        except Exception as e:
-            logger.error(f"Error fetching data from Firestore: {e}")
+        users_col, items_col, interactions_col = TRAINING_COLLECTIONS
+        tasks = {}
+        if snapshot_dir is not None:
+            for collection in TRAINING_COLLECTIONS:
+                tasks[collection] = functools.partial(
+                    self._fetch_snapshot, collection, page_size, checkpoint_dir, snapshot_dir,
+                    update_field=update_field_for(collection, update_fields), refresh=refresh_snapshot,
+                )
+        else:
+            tasks[users_col] = functools.partial(self._fetch_collection, users_col, page_size, checkpoint_dir)
+            tasks[items_col] = functools.partial(self._fetch_collection, items_col, page_size, checkpoint_dir)
+            if stream_interactions:
+                interaction_pages = self.iter_interaction_pages(page_size, checkpoint_dir)
+                # Only the first page is read up front (to detect an empty collection)
+                tasks[interactions_col] = lambda: next(interaction_pages, [])
+            else:
+                tasks[interactions_col] = functools.partial(
+                    self._fetch_collection, interactions_col, page_size, checkpoint_dir,
+                    shards=interaction_shards,
+                )
+
+        # Errors are isolated per collection: a failed collection counts as empty
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as pool:
+            futures = {collection: pool.submit(task) for collection, task in tasks.items()}
+            for collection, future in futures.items():
+                try:
+                    results[collection] = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching '{collection}' from Firestore: {e}")
+                    results[collection] = []
+
+        users = results[users_col]
+        items = results[items_col]
+        interactions = results[interactions_col]
+        logger.info(f"Fetched {len(users)} users, {len(items)} items")
+
+        # Fallback to synthetic if any critical collection is empty
+        empty = [collection for collection in TRAINING_COLLECTIONS if len(results[collection]) == 0]
+        if empty:
+            logger.warning(f"Firestore has insufficient data (empty: {', '.join(empty)}). Using synthetic data.")
             return self.generate_synthetic_data()
 
+        if stream_interactions and snapshot_dir is None:
+            interactions = itertools.chain([interactions], interaction_pages)
+        else:
+            interactions = [self._normalize_interaction(d) for d in interactions]
+            logger.info(f"Fetched {len(interactions)} interactions")
+
+        return {
+            'users': users,
+            'items': items,
+            'interactions': interactions,
+        }
+
     
-    def generate_synthetic_data(self):
-        """Generate synthetic Malaysian food data for training"""
+    def generate_synthetic_data(self, seed=None, interactions_per_user=SYNTHETIC_INTERACTIONS_PER_USER):
+        """
+        Generate synthetic Malaysian food data for training.
+        Every field is drawn as one NumPy array per call; interactions are
+        returned as a columnar DataFrame (see iter_synthetic_interactions).
+        """
+        import pandas as pd
+
         logger.info("Generating synthetic Malaysian food data...")
 
-        rng = np.random.default_rng()  # NumPy Generator (safer than RandomState)
+        # Independent, reproducible streams per entity type
+        users_seed, items_seed, interactions_seed = np.random.SeedSequence(seed).spawn(3)
 
-        # Malaysian cuisines and food categories
-        cuisines = ['malay', 'chinese', 'indian', 'western', 'thai']
-        categories = ['rice', 'noodles', 'soup', 'grilled', 'fried', 'dessert', 'beverage']
+        users = self._synthetic_users(np.random.default_rng(users_seed))
+        items = self._synthetic_items(np.random.default_rng(items_seed))
+        interactions = pd.concat(
+            self.iter_synthetic_interactions(
+                self.num_users * interactions_per_user, seed=interactions_seed
+            ),
+            ignore_index=True,
+        )
 
-        # Helper: weighted pick for any options (works for lists-of-lists too)
-        def weighted_pick(options, probs):
-            idx = rng.choice(len(options), p=probs)
-            return options[idx]
+        return {
+            'users': users,
+            'items': items,
+            'interactions': interactions,
+        }
 
-        # Generate users
-        users = []
+    def _synthetic_users(self, rng):
+        """Vectorized synthetic user profiles"""
+        n = self.num_users
         diet_options = [
             ['halal'],
             ['vegetarian'],
@@ -129,28 +430,34 @@ class MakanMateRecommendationModel:
         ]
         diet_probs = [0.6, 0.1, 0.05, 0.25]
 
-        for i in range(self.num_users):
-            user = {
+        cultures = rng.choice(['malay', 'chinese', 'indian', 'mixed'], size=n)
+        spice = rng.uniform(0, 1, size=n)
+        diets = rng.choice(len(diet_options), size=n, p=diet_probs)
+        prefs = rng.uniform(0, 1, size=(n, len(SYNTHETIC_CUISINES)))
+        activity = rng.uniform(0, 1, size=(n, 4))
+
+        return [
+            {
                 'id': f'user_{i}',
                 'name': f'User {i}',
-                'culturalBackground': rng.choice(['malay', 'chinese', 'indian', 'mixed']),
-                'spiceTolerance': float(rng.uniform(0, 1)),
-                # SAFE weighted selection of list-valued field
-                'dietaryRestrictions': weighted_pick(diet_options, diet_probs),
-                'cuisinePreferences': {
-                    cuisine: float(rng.uniform(0, 1)) for cuisine in cuisines
-                },
+                'culturalBackground': str(cultures[i]),
+                'spiceTolerance': float(spice[i]),
+                'dietaryRestrictions': list(diet_options[diets[i]]),
+                'cuisinePreferences': dict(zip(SYNTHETIC_CUISINES, prefs[i].tolist())),
                 'behaviorPatterns': {
-                    'morning_activity': float(rng.uniform(0, 1)),
-                    'afternoon_activity': float(rng.uniform(0, 1)),
-                    'evening_activity': float(rng.uniform(0, 1)),
-                    'weekend_activity': float(rng.uniform(0, 1)),
+                    'morning_activity': float(activity[i, 0]),
+                    'afternoon_activity': float(activity[i, 1]),
+                    'evening_activity': float(activity[i, 2]),
+                    'weekend_activity': float(activity[i, 3]),
                 }
             }
-            users.append(user)
+            for i in range(n)
+        ]
 
-        # Generate food items
-        items = []
+    def _synthetic_items(self, rng):
+        """Vectorized synthetic food items; the first entries are real Malaysian dishes"""
+        n = self.num_items
+        categories = np.array(['rice', 'noodles', 'soup', 'grilled', 'fried', 'dessert', 'beverage'])
         malaysian_foods = [
             ('Nasi Lemak', 'malay', ['rice', 'breakfast'], 0.6),
             ('Char Kway Teow', 'chinese', ['noodles', 'fried'], 0.4),
@@ -164,55 +471,124 @@ class MakanMateRecommendationModel:
             ('Wonton Noodles', 'chinese', ['noodles', 'soup'], 0.3),
         ]
 
-        for i in range(self.num_items):
+        cuisine = rng.choice(SYNTHETIC_CUISINES, size=n)
+        spice = rng.uniform(0, 1, size=n)
+        # 1-3 distinct categories per item: first k columns of a random permutation
+        num_cats = rng.integers(1, 4, size=n)
+        cat_order = np.argsort(rng.random((n, len(categories))), axis=1)
+        price = rng.uniform(5.0, 50.0, size=n)
+        halal = rng.random(n) < 0.7
+        vegetarian = rng.random(n) < 0.2
+        avg_rating = rng.uniform(3.0, 5.0, size=n)
+        total_ratings = rng.integers(0, 1000, size=n)
+        total_orders = rng.integers(0, 500, size=n)
+        nutrition = rng.uniform([200, 5, 20, 5], [800, 50, 100, 40], size=(n, 4))
+
+        items = []
+        for i in range(n):
             if i < len(malaysian_foods):
-                name, cuisine, cats, spice = malaysian_foods[i]
+                name, item_cuisine, cats, item_spice = malaysian_foods[i]
             else:
                 name = f'Food Item {i}'
-                cuisine = rng.choice(cuisines)
-                cats = rng.choice(categories, size=int(rng.integers(1, 4)), replace=False).tolist()
-                spice = float(rng.uniform(0, 1))
+                item_cuisine = str(cuisine[i])
+                cats = categories[cat_order[i, :num_cats[i]]].tolist()
+                item_spice = float(spice[i])
 
-            item = {
+            items.append({
                 'id': f'item_{i}',
                 'name': name,
-                'cuisineType': cuisine,
+                'cuisineType': item_cuisine,
                 'categories': cats,
-                'price': float(rng.uniform(5.0, 50.0)),
-                'spiceLevel': spice,
-                'isHalal': bool(rng.choice([True, False], p=[0.7, 0.3])),
-                'isVegetarian': bool(rng.choice([True, False], p=[0.2, 0.8])),
-                'averageRating': float(rng.uniform(3.0, 5.0)),
-                'totalRatings': int(rng.integers(0, 1000)),
-                'totalOrders': int(rng.integers(0, 500)),
+                'price': float(price[i]),
+                'spiceLevel': item_spice,
+                'isHalal': bool(halal[i]),
+                'isVegetarian': bool(vegetarian[i]),
+                'averageRating': float(avg_rating[i]),
+                'totalRatings': int(total_ratings[i]),
+                'totalOrders': int(total_orders[i]),
                 'nutritionalInfo': {
-                    'calories': float(rng.uniform(200, 800)),
-                    'protein': float(rng.uniform(5, 50)),
-                    'carbs': float(rng.uniform(20, 100)),
-                    'fat': float(rng.uniform(5, 40)),
+                    'calories': float(nutrition[i, 0]),
+                    'protein': float(nutrition[i, 1]),
+                    'carbs': float(nutrition[i, 2]),
+                    'fat': float(nutrition[i, 3]),
                 }
-            }
-            items.append(item)
-
-        # Generate interactions
-        interactions = []
-        interaction_types = ['view', 'like', 'order', 'rate', 'bookmark']
-        for _ in range(self.num_users * 20):  # ~20 interactions per user
-            itype = rng.choice(interaction_types)
-            rating = float(rng.uniform(1, 5)) if rng.random() < 0.3 else None
-            interaction = {
-                'userId': f'user_{int(rng.integers(0, self.num_users))}',
-                'itemId': f'item_{int(rng.integers(0, self.num_items))}',
-                'interactionType': itype,
+            })
+        return items
+
+    def iter_synthetic_interactions(self, num_interactions, chunk_size=SYNTHETIC_CHUNK_SIZE, seed=None):
+        """
+        Yield synthetic interactions as columnar DataFrame chunks
+        (userId, itemId, interactionType, rating, timestamp).
+        Chunks can be fed straight into preprocess_data or written to Parquet.
+        Output is reproducible for a given seed and chunk_size.
+        """
+        import pandas as pd
+
+        rng = np.random.default_rng(seed)
+        interaction_types = np.array(['view', 'like', 'order', 'rate', 'bookmark'])
+        now = np.datetime64(datetime.now(), 'ms')
+
+        for start in range(0, num_interactions, chunk_size):
+            n = min(chunk_size, num_interactions - start)
+            user_idx = rng.integers(0, self.num_users, size=n)
+            item_idx = rng.integers(0, self.num_items, size=n)
+            itype = interaction_types[rng.integers(0, len(interaction_types), size=n)]
+            # ~30% of interactions carry an explicit rating
+            rating = np.where(rng.random(n) < 0.3, rng.uniform(1, 5, size=n), np.nan)
+            age_days = rng.integers(0, 90, size=n)
+
+            yield pd.DataFrame({
+                'userId': np.char.add('user_', user_idx.astype(str)).astype(object),
+                'itemId': np.char.add('item_', item_idx.astype(str)).astype(object),
+                'interactionType': itype.astype(object),
                 'rating': rating,
-                'timestamp': datetime.now() - timedelta(days=int(rng.integers(0, 90))),
-            }
-            interactions.append(interaction)
+                'timestamp': now - age_days.astype('timedelta64[D]'),
+            })
+
+    def export_synthetic_parquet(self, out_dir, seed=None,
+                                 interactions_per_user=SYNTHETIC_INTERACTIONS_PER_USER,
+                                 chunk_size=SYNTHETIC_CHUNK_SIZE):
+        """
+        Write a synthetic dataset to <out_dir>/{users,items,interactions}.parquet,
+        streaming interactions chunk by chunk so memory stays bounded.
+        Load it back with load_synthetic_parquet.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        users_seed, items_seed, interactions_seed = np.random.SeedSequence(seed).spawn(3)
+
+        pq.write_table(pa.Table.from_pylist(self._synthetic_users(np.random.default_rng(users_seed))),
+                       out_dir / 'users.parquet')
+        pq.write_table(pa.Table.from_pylist(self._synthetic_items(np.random.default_rng(items_seed))),
+                       out_dir / 'items.parquet')
 
+        num_interactions = self.num_users * interactions_per_user
+        writer = None
+        try:
+            for chunk in self.iter_synthetic_interactions(num_interactions, chunk_size, interactions_seed):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_dir / 'interactions.parquet', table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        logger.info(f"Synthetic dataset ({self.num_users} users, {self.num_items} items, "
+                    f"{num_interactions} interactions) written to: {out_dir.resolve()}")
+
+    def load_synthetic_parquet(self, in_dir):
+        """Load a dataset written by export_synthetic_parquet as raw_data"""
+        import pyarrow.parquet as pq
+
+        in_dir = Path(in_dir)
         return {
-            'users': users,
-            'items': items,
-            'interactions': interactions,
+            'users': pq.read_table(in_dir / 'users.parquet', memory_map=True).to_pylist(),
+            'items': pq.read_table(in_dir / 'items.parquet', memory_map=True).to_pylist(),
+            'interactions': pq.read_table(in_dir / 'interactions.parquet', memory_map=True).to_pandas(),
         }
 
     
@@ -222,185 +598,318 @@ class MakanMateRecommendationModel:
                 return d[k]
         return default
 
-    def preprocess_data(self, raw_data):
-        """Preprocess raw data for training"""
+    def preprocess_data(self, raw_data, fit_scalers=True, aggregate=None):
+        """
+        Preprocess raw data for training
+        fit_scalers: refit the feature scalers; pass False to keep scalers
+            restored by load_training_state (warm start)
+        aggregate: collapse repeated (user, item) interactions into one
+            weighted sample with this reducer (see AGGREGATION_REDUCERS and
+            _aggregate_pairs); None keeps one sample per interaction
+        """
+        import pandas as pd
+        from sklearn.preprocessing import LabelEncoder, StandardScaler
+
         logger.info("Preprocessing training data...")
 
         users = raw_data['users']
         items = raw_data['items']
         interactions = raw_data['interactions']
 
-        # Build stable ID lists with fallbacks
-        user_ids = []
-        for u in users:
-            uid = self._first(u, ['id', 'uid', 'userId', 'user_id'])
-            if uid is None:
-                continue
-            user_ids.append(str(uid))
-
-        item_ids = []
-        for it in items:
-            iid = self._first(it, ['id', 'itemId', 'item_id', 'foodId'])
-            if iid is None:
-                continue
-            item_ids.append(str(iid))
+        # Deduplicated entity tables in LabelEncoder class order
+        user_ids, users = self._build_entity_table(users, USER_ID_KEYS)
+        item_ids, items = self._build_entity_table(items, ITEM_ID_KEYS)
 
         if len(user_ids) == 0 or len(item_ids) == 0:
             logger.warning("No valid users/items after preprocessing; using synthetic data.")
-            return self.preprocess_data(self.generate_synthetic_data())
+            return self.preprocess_data(self.generate_synthetic_data(), fit_scalers, aggregate)
 
-        # Fit encoders
-        self.user_encoder.fit(user_ids)
-        self.item_encoder.fit(item_ids)
+        # Fit encoders (IDs are already unique and sorted, so classes_ == *_ids)
+        self.user_encoder = LabelEncoder().fit(user_ids)
+        self.item_encoder = LabelEncoder().fit(item_ids)
 
         # IMPORTANT: resize embedding vocab to actual counts
         self.num_users = len(self.user_encoder.classes_)
         self.num_items = len(self.item_encoder.classes_)
 
-        # Extract features
-        user_features = [self._extract_user_features(u) for u in users if self._first(u, ['id','uid','userId','user_id']) in self.user_encoder.classes_]
-        item_features = [self._extract_item_features(it) for it in items if self._first(it, ['id','itemId','item_id','foodId']) in self.item_encoder.classes_]
+        # Extract features; row i belongs to encoder class i
+        user_features = USER_FEATURES.transform(users)
+        item_features = ITEM_FEATURES.transform(items)
 
         # Scale
-        user_features_scaled = self.user_scaler.fit_transform(user_features)
-        item_features_scaled = self.item_scaler.fit_transform(item_features)
+        if fit_scalers or self.user_scaler is None:
+            self.user_scaler = StandardScaler().fit(user_features)
+            self.item_scaler = StandardScaler().fit(item_features)
+        user_features_scaled = self.user_scaler.transform(user_features)
+        item_features_scaled = self.item_scaler.transform(item_features)
 
-        # Index lookup for fast mapping
-        user_index_map = {k: i for i, k in enumerate(self.user_encoder.classes_)}
-        item_index_map = {k: i for i, k in enumerate(self.item_encoder.classes_)}
-
-        # Build samples
-        training_samples = []
-        for inter in interactions:
-            uid = self._first(inter, ['userId', 'user_id', 'uid'])
-            iid = self._first(inter, ['itemId', 'item_id', 'foodId'])
-            if uid is None or iid is None:
-                continue
-            uid = str(uid); iid = str(iid)
-            if uid not in user_index_map or iid not in item_index_map:
-                continue
-            uidx = user_index_map[uid]
-            iidx = item_index_map[iid]
-            rating = self._calculate_rating(inter)
-
-            training_samples.append({
-                'user_idx': uidx,
-                'item_idx': iidx,
-                'user_features': user_features_scaled[uidx],
-                'item_features': item_features_scaled[iidx],
-                'rating': rating,
-            })
+        # Map interactions onto encoder indices in one vectorized pass
+        frame = self._interaction_frame(interactions)
+        user_idx = pd.Index(self.user_encoder.classes_).get_indexer(frame['userId'])
+        item_idx = pd.Index(self.item_encoder.classes_).get_indexer(frame['itemId'])
+        valid = (user_idx >= 0) & (item_idx >= 0)
 
-        if len(training_samples) == 0:
+        if not valid.any():
             logger.warning("No interactions matched known users/items; using synthetic data.")
-            return self.preprocess_data(self.generate_synthetic_data())
+            return self.preprocess_data(self.generate_synthetic_data(), fit_scalers, aggregate)
+
+        ratings = self._calculate_ratings(frame)
+        samples = {
+            'user_idx': user_idx[valid],
+            'item_idx': item_idx[valid],
+            'ratings': ratings[valid],
+            # Interaction time (UTC, NaT when missing); used to pick recent rows
+            'timestamps': self._interaction_timestamps(frame['timestamp'])[valid],
+        }
+        if aggregate is not None:
+            explicit = self._has_explicit_rating(self._explicit_ratings(frame))[valid]
+            samples = self._aggregate_pairs(samples, aggregate, explicit)
+
+        logger.info(f"Preprocessed {len(samples['ratings'])} training samples")
+        processed_data = {
+            'user_idx': np.ascontiguousarray(samples['user_idx'], dtype=np.int32),
+            'item_idx': np.ascontiguousarray(samples['item_idx'], dtype=np.int32),
+            'ratings': np.ascontiguousarray(samples['ratings'], dtype=np.float32),
+            'user_features': np.asarray(user_features_scaled, dtype=np.float32),
+            'item_features': np.asarray(item_features_scaled, dtype=np.float32),
+            'timestamps': samples['timestamps'],
+        }
+        if 'sample_weight' in samples:
+            processed_data['sample_weight'] = np.ascontiguousarray(samples['sample_weight'], dtype=np.float32)
+        self.attach_processed_data(processed_data)
+        return processed_data
+
+    def _aggregate_pairs(self, samples, reducer, explicit, half_life_days=RECENCY_HALF_LIFE_DAYS):
+        """
+        Collapse repeated (user, item) interactions into one sample per pair.
+
+        reducer:
+        - max: the highest rating
+        - recency: mean rating weighted by 0.5 ** (age / half_life_days),
+          age measured from the newest interaction (undated ones count as
+          the oldest)
+        - precedence: _calculate_rating's order per pair, i.e. the latest
+          explicit rating if there is one, else the strongest implicit
+          signal (order > like > bookmark > view)
+
+        Each sample keeps the pair's latest timestamp and gets a
+        sample_weight of 1 + log(interaction count), normalized to mean 1
+        so the effective learning rate does not change.
+        """
+        import pandas as pd
+
+        if reducer not in AGGREGATION_REDUCERS:
+            raise ValueError(f"Unknown aggregation reducer: {reducer} (expected one of {AGGREGATION_REDUCERS})")
+
+        pair = samples['user_idx'].astype(np.int64) * self.num_items + samples['item_idx']
+        frame = pd.DataFrame({
+            'pair': pair,
+            'rating': np.asarray(samples['ratings'], dtype=np.float64),
+            'timestamp': samples['timestamps'],
+        })
+        groups = frame.groupby('pair', sort=True)
+        counts = groups.size()
+        pairs = counts.index.to_numpy()
+
+        if reducer == 'max':
+            ratings = groups['rating'].max()
+        elif reducer == 'recency':
+            age_days = (frame['timestamp'].max() - frame['timestamp']) / pd.Timedelta(days=1)
+            age_days = age_days.fillna(age_days.max()).fillna(0.0).to_numpy()
+            frame['weight'] = 0.5 ** (age_days / half_life_days)
+            frame['weighted'] = frame['weight'] * frame['rating']
+            ratings = groups['weighted'].sum() / groups['weight'].sum()
+        else:
+            # Undated explicit ratings sort first, so any dated one wins
+            latest_explicit = (
+                frame[explicit].sort_values('timestamp', kind='stable', na_position='first')
+                .groupby('pair')['rating'].last()
+            )
+            strongest_implicit = frame[~explicit].groupby('pair')['rating'].max()
+            ratings = latest_explicit.reindex(pairs).fillna(strongest_implicit.reindex(pairs))
 
-        logger.info(f"Preprocessed {len(training_samples)} training samples")
+        weights = 1.0 + np.log(counts.to_numpy(dtype=np.float64))
+        logger.info(f"Aggregated {len(frame)} interactions into {len(pairs)} (user, item) samples ({reducer})")
         return {
-            'training_samples': training_samples,
-            'user_features': user_features_scaled,
-            'item_features': item_features_scaled,
+            'user_idx': pairs // self.num_items,
+            'item_idx': pairs % self.num_items,
+            'ratings': ratings.to_numpy(dtype=np.float64),
+            'timestamps': groups['timestamp'].max().to_numpy(dtype='datetime64[ms]'),
+            'sample_weight': weights / weights.mean(),
         }
 
-    
-    def _extract_user_features(self, user):
-        """Extract numerical features from user profile"""
-        features = []
-        
-        # Cuisine preferences (5 features)
-        cuisines = ['malay', 'chinese', 'indian', 'western', 'thai']
-        prefs = user.get('cuisinePreferences', {})
-        for cuisine in cuisines:
-            features.append(prefs.get(cuisine, 0.0))
-        
-        # Dietary restrictions (3 features)
-        restrictions = user.get('dietaryRestrictions', [])
-        features.append(1.0 if 'halal' in restrictions else 0.0)
-        features.append(1.0 if 'vegetarian' in restrictions else 0.0)
-        features.append(1.0 if 'vegan' in restrictions else 0.0)
-        
-        # Spice tolerance (1 feature)
-        features.append(user.get('spiceTolerance', 0.5))
-        
-        # Cultural background (4 features - one-hot)
-        culture = user.get('culturalBackground', 'mixed').lower()
-        cultures = ['malay', 'chinese', 'indian', 'mixed']
-        for c in cultures:
-            features.append(1.0 if culture == c else 0.0)
-        
-        # Behavioral patterns (2 features)
-        patterns = user.get('behaviorPatterns', {})
-        features.append(patterns.get('morning_activity', 0.0))
-        features.append(patterns.get('evening_activity', 0.0))
-        
-        return features
-    
-    def _extract_item_features(self, item):
-        """Extract numerical features from food item"""
-        features = []
-        
-        # Basic features (6 features)
-        features.append(item.get('price', 0.0) / 100.0)  # Normalize price
-        features.append(item.get('spiceLevel', 0.5))
-        features.append(1.0 if item.get('isHalal', False) else 0.0)
-        features.append(1.0 if item.get('isVegetarian', False) else 0.0)
-        features.append(item.get('averageRating', 0.0) / 5.0)
-        features.append(min(item.get('totalOrders', 0) / 100.0, 1.0))
-        
-        # Cuisine type (5 features - one-hot)
-        cuisine = item.get('cuisineType', 'western').lower()
-        cuisines = ['malay', 'chinese', 'indian', 'western', 'thai']
-        for c in cuisines:
-            features.append(1.0 if cuisine == c else 0.0)
-        
-        # Categories (4 features - binary indicators)
-        categories = item.get('categories', [])
-        common_cats = ['rice', 'noodles', 'soup', 'dessert']
-        for cat in common_cats:
-            has_cat = any(cat in c.lower() for c in categories)
-            features.append(1.0 if has_cat else 0.0)
-        
-        return features
-    
+    def _interaction_timestamps(self, values):
+        """Interaction timestamps as naive-UTC datetime64[ms]; naive inputs are taken as UTC"""
+        import pandas as pd
+
+        timestamps = pd.to_datetime(pd.Series(values), utc=True, errors='coerce', format='mixed')
+        return timestamps.dt.tz_convert(None).to_numpy(dtype='datetime64[ms]')
+
+    def recent_rows(self, processed_data, since):
+        """
+        Indices of interactions strictly after `since` (datetime or
+        datetime64, UTC), so rows at a saved high-water mark, which were
+        already trained on, are not picked up again. Interactions without a
+        timestamp are treated as old.
+        """
+        import pandas as pd
+
+        since = pd.Timestamp(since)
+        if since.tzinfo is not None:
+            since = since.tz_convert('UTC').tz_localize(None)
+        timestamps = processed_data.get('timestamps')
+        if timestamps is None:
+            return np.arange(len(processed_data['ratings']))
+        return np.flatnonzero(timestamps > since.to_datetime64())
+
+    def attach_processed_data(self, processed_data):
+        """
+        Keep the scaled feature tables and a CSR user x item interaction
+        matrix for scoring (see recommend). Called by preprocess_data; call it
+        after load_processed_data when scoring without preprocessing.
+        """
+        from scipy import sparse
+
+        self.user_features_scaled = processed_data['user_features']
+        self.item_features_scaled = processed_data['item_features']
+        user_idx = np.asarray(processed_data['user_idx'])
+        self.interaction_matrix = sparse.csr_matrix(
+            (np.ones(len(user_idx), dtype=np.bool_), (user_idx, np.asarray(processed_data['item_idx']))),
+            shape=(len(self.user_features_scaled), len(self.item_features_scaled)),
+        )
+
+    def _build_entity_table(self, records, id_keys):
+        """
+        Deduplicate records by ID in a single hashed pass.
+        Returns (ids, records) sorted by ID, i.e. in LabelEncoder class order.
+        When an ID appears more than once, the last record wins.
+        """
+        by_id = {}
+        for record in records:
+            rid = self._first(record, id_keys)
+            if rid is None:
+                continue
+            by_id[str(rid)] = record
+
+        ids = sorted(by_id)
+        return ids, [by_id[rid] for rid in ids]
+
+    def _interaction_frame(self, interactions):
+        """
+        Flatten raw interactions into a columnar DataFrame.
+        Accepts a list of dicts, a DataFrame, or an iterable of either as
+        pages (e.g. iter_interaction_pages, iter_synthetic_interactions);
+        pages are converted one at a time.
+        """
+        import pandas as pd
+
+        if isinstance(interactions, (list, pd.DataFrame)):
+            return self._interaction_page_frame(interactions)
+
+        frames = [self._interaction_page_frame(page) for page in interactions]
+        if not frames:
+            return self._interaction_page_frame([])
+        return pd.concat(frames, ignore_index=True)
+
+    def _interaction_page_frame(self, interactions):
+        """Flatten one page of interactions into a columnar DataFrame"""
+        import pandas as pd
+
+        if isinstance(interactions, pd.DataFrame):
+            frame = interactions.reindex(columns=INTERACTION_COLUMNS)
+            for column in ['userId', 'itemId']:
+                ids = frame[column]
+                if not pd.api.types.is_string_dtype(ids):
+                    frame[column] = ids.where(ids.isna(), ids.astype(str))
+            return frame
+
+        user_ids, item_ids, types, ratings, timestamps = [], [], [], [], []
+        for inter in interactions:
+            uid = self._first(inter, ['userId', 'user_id', 'uid'])
+            iid = self._first(inter, ['itemId', 'item_id', 'foodId'])
+            user_ids.append(None if uid is None else str(uid))
+            item_ids.append(None if iid is None else str(iid))
+            types.append(inter.get('interactionType'))
+            ratings.append(inter.get('rating'))
+            timestamps.append(inter.get('timestamp'))
+
+        return pd.DataFrame({
+            'userId': pd.Series(user_ids, dtype=object),
+            'itemId': pd.Series(item_ids, dtype=object),
+            'interactionType': pd.Series(types, dtype=object),
+            'rating': pd.Series(ratings, dtype=object),
+            'timestamp': pd.Series(timestamps, dtype=object),
+        })
+
     def _calculate_rating(self, interaction):
         """Calculate rating from interaction"""
         if interaction.get('rating'):
             return interaction['rating']
         
-        interaction_type = interaction.get('interactionType', '').lower()
-        if interaction_type == 'order':
-            return 5.0
-        elif interaction_type == 'like':
-            return 4.0
-        elif interaction_type == 'bookmark':
-            return 3.5
-        elif interaction_type == 'view':
-            return 2.0
-        else:
-            return 3.0
+        interaction_type = (interaction.get('interactionType') or '').lower()
+        return INTERACTION_TYPE_RATINGS.get(interaction_type, DEFAULT_INTERACTION_RATING)
+
+    def _explicit_ratings(self, frame):
+        import pandas as pd
+
+        return pd.to_numeric(frame['rating'], errors='coerce').to_numpy(dtype=np.float64)
+
+    def _has_explicit_rating(self, explicit):
+        """Same test as _calculate_rating: a truthy explicit rating wins"""
+        return ~np.isnan(explicit) & (explicit != 0)
+
+    def _calculate_ratings(self, frame):
+        """Vectorized _calculate_rating over an interaction DataFrame"""
+        explicit = self._explicit_ratings(frame)
+        implicit = (
+            frame['interactionType'].fillna('').astype(str).str.lower()
+            .map(INTERACTION_TYPE_RATINGS)
+            .fillna(DEFAULT_INTERACTION_RATING)
+            .to_numpy(dtype=np.float64)
+        )
+        return np.where(self._has_explicit_rating(explicit), explicit, implicit)
     
     def build_model(self):
         """Build the recommendation model"""
         logger.info("Building recommendation model...")
         
+        # Variables created under the strategy scope are mirrored across
+        # replicas; layers pick up the precision mode's dtype policy
+        with strategy_scope(self.strategy), precision_policy(self.precision):
+            self._build_and_compile()
+        
+        logger.info("Model built successfully")
+        self.model.summary()
+        
+        return self.model
+    
+    def _build_and_compile(self):
+        import tensorflow as tf
+
         # Input layers
         user_id_input = tf.keras.Input(shape=(), name='user_id', dtype='int32')
         item_id_input = tf.keras.Input(shape=(), name='item_id', dtype='int32')
         user_features_input = tf.keras.Input(shape=(self.user_feature_dim,), name='user_features')
         item_features_input = tf.keras.Input(shape=(self.item_feature_dim,), name='item_features')
         
-        # Embedding layers
-        user_embedding = tf.keras.layers.Embedding(
+        # Embedding layers. lazy_adam needs row-sparse gradients: the lookup
+        # gathers from the variable and the L2 penalty only covers the rows
+        # looked up in the batch (a whole-table penalty has a dense gradient)
+        if self.optimizer == 'lazy_adam':
+            from sparse_updates import RowSparseEmbedding as Embedding
+            regularization = {'rows_regularizer': tf.keras.regularizers.l2(EMBEDDING_L2)}
+        else:
+            Embedding = tf.keras.layers.Embedding
+            regularization = {'embeddings_regularizer': tf.keras.regularizers.l2(EMBEDDING_L2)}
+        user_embedding = Embedding(
             self.num_users, self.embedding_dim,
-            embeddings_regularizer=tf.keras.regularizers.l2(1e-6),
-            name='user_embedding'
+            name='user_embedding', **regularization
         )(user_id_input)
         user_embedding = tf.keras.layers.Flatten()(user_embedding)
         
-        item_embedding = tf.keras.layers.Embedding(
+        item_embedding = Embedding(
             self.num_items, self.embedding_dim,
-            embeddings_regularizer=tf.keras.regularizers.l2(1e-6),
-            name='item_embedding'
+            name='item_embedding', **regularization
         )(item_id_input)
         item_embedding = tf.keras.layers.Flatten()(item_embedding)
         
@@ -426,7 +935,39 @@ class MakanMateRecommendationModel:
             item_embedding, item_features_dense
         ], name='item_combined')
         
-        # Deep interaction layers
+        if self.architecture == 'two_tower':
+            output = self._two_tower_head(
+                user_id_input, item_id_input, user_features_input, item_features_input,
+                user_combined, item_combined,
+            )
+        else:
+            output = self._mlp_head(user_combined, item_combined)
+        
+        # Create model
+        self.model = tf.keras.Model(
+            inputs=[user_id_input, item_id_input, user_features_input, item_features_input],
+            outputs=output,
+            name='MakanMateRecommendationModel'
+        )
+        
+        if self.optimizer == 'lazy_adam':
+            from sparse_updates import LazyAdam
+            optimizer = LazyAdam(learning_rate=0.001)
+        else:
+            optimizer = tf.keras.optimizers.Adam(learning_rate=0.001)
+
+        # Compile model
+        self.model.compile(
+            optimizer=optimizer,
+            loss='mse',
+            metrics=['mae'],
+            jit_compile=self.precision == 'xla',
+        )
+    
+    def _mlp_head(self, user_combined, item_combined):
+        """Deep interaction layers over the concatenated user and item towers"""
+        import tensorflow as tf
+
         concat_layer = tf.keras.layers.concatenate([
             user_combined, item_combined
         ], name='concat_layer')
@@ -443,145 +984,865 @@ class MakanMateRecommendationModel:
         dense_3 = tf.keras.layers.Dense(32, activation='relu', name='dense_3')(dense_2)
         dense_3 = tf.keras.layers.Dropout(0.2)(dense_3)
         
-        # Output layer
-        output = tf.keras.layers.Dense(1, activation='sigmoid', name='output')(dense_3)
-        output = tf.keras.layers.Lambda(lambda x: x * 4 + 1, name='rating_scale')(output)
+        # Output layer (float32 under mixed precision, like every model output)
+        output = tf.keras.layers.Dense(1, activation='sigmoid', dtype='float32', name='output')(dense_3)
+        return tf.keras.layers.Lambda(lambda x: x * 4 + 1, dtype='float32', name='rating_scale')(output)
+
+    def _two_tower_head(self, user_id_input, item_id_input, user_features_input,
+                        item_features_input, user_combined, item_combined):
+        """
+        Score = sigmoid(user_vector . item_vector) scaled to 1-5. The towers are
+        kept as self.user_tower / self.item_tower so item vectors can be
+        precomputed and a catalog ranked with one matrix-vector product.
+        """
+        import tensorflow as tf
+
+        user_vector = tf.keras.layers.Dense(64, activation='relu', name='user_tower_hidden')(user_combined)
+        user_vector = tf.keras.layers.Dense(self.tower_dim, dtype='float32', name='user_tower_output')(user_vector)
         
-        # Create model
-        self.model = tf.keras.Model(
-            inputs=[user_id_input, item_id_input, user_features_input, item_features_input],
-            outputs=output,
-            name='MakanMateRecommendationModel'
-        )
+        item_vector = tf.keras.layers.Dense(64, activation='relu', name='item_tower_hidden')(item_combined)
+        item_vector = tf.keras.layers.Dense(self.tower_dim, dtype='float32', name='item_tower_output')(item_vector)
         
-        # Compile model
-        self.model.compile(
-            optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-            loss='mse',
-            metrics=['mae']
+        self.user_tower = tf.keras.Model(
+            inputs=[user_id_input, user_features_input], outputs=user_vector, name='user_tower'
+        )
+        self.item_tower = tf.keras.Model(
+            inputs=[item_id_input, item_features_input], outputs=item_vector, name='item_tower'
         )
         
-        logger.info("Model built successfully")
-        self.model.summary()
-        
-        return self.model
+        # Fixed (monotonic) output transform, so ranking by the dot product is exact
+        score = tf.keras.layers.Dot(axes=1, dtype='float32', name='tower_dot')([user_vector, item_vector])
+        output = tf.keras.layers.Activation('sigmoid', dtype='float32', name='output')(score)
+        return tf.keras.layers.Lambda(lambda x: x * 4 + 1, dtype='float32', name='rating_scale')(output)
+
+    def export_item_embeddings(self, item_features, batch_size=4096):
+        """
+        Run the item tower over the whole catalog (two_tower only).
+        Returns a float32 (num_items, tower_dim) matrix; row i is item index i.
+        Rank the catalog for a user with item_embeddings @ user_vector.
+        """
+        if self.item_tower is None:
+            raise ValueError("Item embeddings require architecture='two_tower'")
+        item_ids = np.arange(self.num_items, dtype=np.int32)
+        embeddings = self.item_tower.predict(
+            {'item_id': item_ids, 'item_features': np.asarray(item_features, dtype=np.float32)},
+            batch_size=batch_size, verbose=0,
+        )
+        return embeddings.astype(np.float32)
+
+    def item_retrieval_vectors(self, item_features):
+        """
+        Per-item vectors for candidate retrieval, row i = item index i: the
+        item tower output, which is exactly what two_tower scores with.
+        The mlp score is not an inner product of any per-user and per-item
+        vectors, so it has no retrieval vectors (rank with score_users).
+        """
+        if self.architecture != 'two_tower':
+            raise ValueError("Retrieval vectors require architecture='two_tower'; "
+                             "the mlp score is not an inner product")
+        return self.export_item_embeddings(item_features)
+
+    def user_query_vectors(self, user_idx, user_features):
+        """Query vectors matching item_retrieval_vectors for the given user indices (two_tower only)"""
+        if self.architecture != 'two_tower':
+            raise ValueError("Query vectors require architecture='two_tower'")
+        user_idx = np.asarray(user_idx, dtype=np.int32)
+        user_features = np.asarray(user_features, dtype=np.float32)[user_idx]
+        return self.user_tower.predict(
+            {'user_id': user_idx, 'user_features': user_features}, verbose=0
+        ).astype(np.float32)
+
+    def build_retrieval_index(self, item_features, nlist=None, nprobe=DEFAULT_NPROBE):
+        """IVF index over item_retrieval_vectors (see ann_index; two_tower only)"""
+        logger.info("Building item retrieval index...")
+        index = IVFIndex.build(self.item_retrieval_vectors(item_features), nlist=nlist, nprobe=nprobe)
+        logger.info(f"Indexed {self.num_items} items into {index.nlist} cells")
+        return index
+
+    def benchmark_retrieval_index(self, index, user_idx=None, k=10, nprobes=BENCHMARK_NPROBES,
+                                  num_users=RETRIEVAL_BENCHMARK_USERS, seed=0):
+        """
+        Recall@k of the index against the model's exact top-k from
+        score_users, for user_idx (default: num_users random users).
+        """
+        if user_idx is None:
+            rng = np.random.default_rng(seed)
+            user_idx = rng.choice(self.num_users, min(num_users, self.num_users), replace=False)
+        scores = self.score_users(user_idx, item_vectors=index.item_vectors())
+        k = min(k, self.num_items)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        report = benchmark_index(
+            index, self.user_query_vectors(user_idx, self.user_features_scaled),
+            k=k, nprobes=nprobes, reference=top,
+        )
+        report['reference'] = 'score_users'
+        return report
+
+    def score_users(self, user_idx, batch_size=RECOMMEND_BATCH_SIZE, item_vectors=None):
+        """
+        Predicted ratings of the given user indices against every item,
+        as a float32 (len(user_idx), num_items) matrix. Users are scored in
+        blocks of about batch_size (user, item) pairs.
+        item_vectors: precomputed export_item_embeddings (two_tower only)
+        """
+        user_idx = np.asarray(user_idx, dtype=np.int32)
+        item_ids = np.arange(self.num_items, dtype=np.int32)
+        item_features = np.asarray(self.item_features_scaled, dtype=np.float32)
+        scores = np.empty((len(user_idx), self.num_items), dtype=np.float32)
+
+        if self.architecture == 'two_tower':
+            # One tower call per user block plus a matrix product with the catalog
+            if item_vectors is None:
+                item_vectors = self.export_item_embeddings(item_features)
+            user_vectors = self.user_query_vectors(user_idx, self.user_features_scaled)
+            logits = user_vectors @ item_vectors.T
+            scores[:] = 4.0 / (1.0 + np.exp(-logits)) + 1.0
+            return scores
+
+        block = max(1, batch_size // self.num_items)
+        user_features = np.asarray(self.user_features_scaled, dtype=np.float32)
+        for start in range(0, len(user_idx), block):
+            users = user_idx[start:start + block]
+            pair_users = np.repeat(users, self.num_items)
+            predictions = self.model.predict({
+                'user_id': pair_users,
+                'item_id': np.tile(item_ids, len(users)),
+                'user_features': user_features[pair_users],
+                'item_features': np.tile(item_features, (len(users), 1)),
+            }, batch_size=batch_size, verbose=0)
+            scores[start:start + len(users)] = predictions.reshape(len(users), self.num_items)
+        return scores
+
+    def recommend(self, user_ids, k=10, exclude_seen=True, batch_size=RECOMMEND_BATCH_SIZE):
+        """
+        Top-k items for each user ID, scored against the whole catalog.
+
+        exclude_seen: drop items the user already interacted with (from the
+            CSR interaction matrix built by attach_processed_data or restored
+            by load_preprocessing_artifacts)
+        Returns {user_id: [(item_id, predicted_rating), ...]} best first;
+        unknown user IDs are skipped with a warning.
+        """
+        import pandas as pd
+
+        if exclude_seen and self.interaction_matrix is None:
+            raise ValueError(
+                "exclude_seen needs the interaction matrix: call attach_processed_data, "
+                "or load artifacts exported with it, or pass exclude_seen=False"
+            )
+
+        user_ids = [str(u) for u in user_ids]
+        user_idx = pd.Index(self.user_encoder.classes_).get_indexer(user_ids)
+        known = user_idx >= 0
+        if not known.all():
+            missing = [u for u, ok in zip(user_ids, known) if not ok]
+            logger.warning(f"Skipping {len(missing)} unknown users: {missing[:5]}")
+        user_ids = [u for u, ok in zip(user_ids, known) if ok]
+        user_idx = user_idx[known]
+
+        k = min(k, self.num_items)
+        item_classes = self.item_encoder.classes_
+        item_vectors = None
+        if self.architecture == 'two_tower':
+            item_vectors = self.export_item_embeddings(self.item_features_scaled)
+        recommendations = {}
+        block = max(1, batch_size // self.num_items)
+        for start in range(0, len(user_idx), block):
+            users = user_idx[start:start + block]
+            scores = self.score_users(users, batch_size=batch_size, item_vectors=item_vectors)
+            if exclude_seen:
+                seen_rows, seen_items = self.interaction_matrix[users].nonzero()
+                scores[seen_rows, seen_items] = -np.inf
+
+            # Partial selection of the k best per row, then sort only those k
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            for row, user_id in enumerate(user_ids[start:start + len(users)]):
+                valid = np.isfinite(top_scores[row])
+                recommendations[user_id] = list(zip(
+                    item_classes[top[row][valid]].tolist(), top_scores[row][valid].tolist()
+                ))
+        return recommendations
+
+    def save_processed_data(self, processed_data, out_dir):
+        """Write preprocessed arrays as .npy files so they can be memory-mapped later"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for key in PROCESSED_ARRAYS + OPTIONAL_PROCESSED_ARRAYS:
+            if key in processed_data:
+                np.save(out_dir / f"{key}.npy", processed_data[key])
+        logger.info(f"Preprocessed arrays written to: {out_dir.resolve()}")
+
+    def load_processed_data(self, in_dir, mmap_mode='r'):
+        """Load arrays written by save_processed_data (memory-mapped by default)"""
+        in_dir = Path(in_dir)
+        processed_data = {
+            key: np.load(in_dir / f"{key}.npy", mmap_mode=mmap_mode)
+            for key in PROCESSED_ARRAYS
+        }
+        for key in OPTIONAL_PROCESSED_ARRAYS:
+            if (in_dir / f"{key}.npy").exists():
+                processed_data[key] = np.load(in_dir / f"{key}.npy", mmap_mode=mmap_mode)
+        return processed_data
+
+    def _stream_source(self, processed_data, chunk_size=STREAM_CHUNK_SIZE,
+                       validation_split=0.0, subset=None, shard=None):
+        """
+        Stream (user_idx, item_idx, rating[, sample_weight]) rows in
+        contiguous chunks, so only one chunk of a (memory-mapped) interaction
+        log is resident at a time.
+        With validation_split, each chunk is split by a mask seeded from its
+        offset; subset selects 'training' or 'validation' rows.
+        shard: (num_shards, index) to keep only rows whose position is
+            index modulo num_shards (balanced whatever the chunk count)
+        """
+        import tensorflow as tf
+
+        user_idx = processed_data['user_idx']
+        item_idx = processed_data['item_idx']
+        ratings = processed_data['ratings']
+        sample_weight = processed_data.get('sample_weight')
+        num_rows = len(ratings)
+
+        def chunks():
+            for start in range(0, num_rows, chunk_size):
+                stop = min(start + chunk_size, num_rows)
+                keep = np.ones(stop - start, dtype=bool)
+                if validation_split:
+                    is_val = np.random.default_rng([42, start]).random(stop - start) < validation_split
+                    keep = is_val if subset == 'validation' else ~is_val
+                elif subset == 'validation':
+                    # No split, no validation rows
+                    keep[:] = False
+                if shard is not None:
+                    keep &= np.arange(start, stop) % shard[0] == shard[1]
+                chunk = (
+                    np.asarray(user_idx[start:stop], dtype=np.int32)[keep],
+                    np.asarray(item_idx[start:stop], dtype=np.int32)[keep],
+                    np.asarray(ratings[start:stop], dtype=np.float32)[keep],
+                )
+                if sample_weight is not None:
+                    chunk += (np.asarray(sample_weight[start:stop], dtype=np.float32)[keep],)
+                yield chunk
+
+        signature = (
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.float32),
+        )
+        if sample_weight is not None:
+            signature += (tf.TensorSpec(shape=(None,), dtype=tf.float32),)
+        return tf.data.Dataset.from_generator(chunks, output_signature=signature).unbatch()
+
+    def _cache_key(self, processed_data, rows=None, validation_split=0.0, stream=False,
+                   chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Hash of the training rows (index arrays, ratings, weights, the
+        selected rows and how they are split; streaming splits differently
+        from the in-memory path), so a tf.data cache written for one
+        dataset is never replayed for another. Hashed chunk by chunk, so
+        memory-mapped arrays are never fully resident.
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(repr((len(processed_data['ratings']), float(validation_split), bool(stream))).encode())
+        arrays = [processed_data[key] for key in ('user_idx', 'item_idx', 'ratings')]
+        if processed_data.get('sample_weight') is not None:
+            arrays.append(processed_data['sample_weight'])
+        if rows is not None:
+            arrays.append(np.asarray(rows))
+        for array in arrays:
+            for start in range(0, len(array), chunk_size):
+                digest.update(np.ascontiguousarray(array[start:start + chunk_size]).tobytes())
+        return digest.hexdigest()
+
+    def _make_dataset(self, processed_data, rows=None, batch_size=512, shuffle_buffer=0,
+                      cache_path=None, stream=False, validation_split=0.0, subset=None,
+                      shard=None, repeat=False):
+        """
+        tf.data pipeline over (user_idx, item_idx, rating) that gathers the
+        scaled user/item feature rows per batch. The feature tables are held
+        once, so memory scales with users + items rather than interactions.
+        If processed_data has a sample_weight array (aggregated pairs), batches
+        are (inputs, rating, sample_weight) so model.fit weights the loss.
+
+        stream=True reads the index arrays chunk by chunk (see _stream_source)
+        instead of copying them into a tensor; cache_path caches the source
+        rows to disk after the first epoch.
+
+        shard / repeat are for multi-worker training: each worker streams
+        its own rows (in-memory rows are sharded by the caller) and repeats
+        them so every worker can run the same fixed number of steps.
+        """
+        import tensorflow as tf
+
+        if stream:
+            dataset = self._stream_source(
+                processed_data, validation_split=validation_split, subset=subset, shard=shard
+            )
+        else:
+            columns = (processed_data['user_idx'], processed_data['item_idx'], processed_data['ratings'])
+            if processed_data.get('sample_weight') is not None:
+                columns += (processed_data['sample_weight'],)
+            if rows is not None:
+                columns = tuple(column[rows] for column in columns)
+            dataset = tf.data.Dataset.from_tensor_slices(columns)
+
+        user_table = tf.constant(processed_data['user_features'], dtype=tf.float32)
+        item_table = tf.constant(processed_data['item_features'], dtype=tf.float32)
+
+        def gather_features(uidx, iidx, rating, *sample_weight):
+            inputs = {
+                'user_id': uidx,
+                'item_id': iidx,
+                'user_features': tf.gather(user_table, uidx),
+                'item_features': tf.gather(item_table, iidx),
+            }
+            return (inputs, rating) + sample_weight
+
+        if cache_path is not None:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            dataset = dataset.cache(str(cache_path))
+        if shuffle_buffer:
+            dataset = dataset.shuffle(shuffle_buffer, seed=42, reshuffle_each_iteration=True)
+        if repeat:
+            dataset = dataset.repeat()
+
+        # Gather after batching: one vectorized lookup per batch instead of per row
+        dataset = dataset.batch(batch_size).map(gather_features, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
     
-    def train_model(self, processed_data, epochs=50, batch_size=512, validation_split=0.2):
-        """Train the recommendation model"""
+    def train_model(self, processed_data, epochs=50, batch_size=512, validation_split=0.2,
+                    shuffle_buffer=None, cache_dir=None, stream=None,
+                    profile_dir=None, profile_steps=None, rows=None, verbose=1, callbacks=None):
+        """
+        Train the recommendation model.
+
+        batch_size: per replica; under a tf.distribute strategy the global
+            batch is batch_size * num_replicas_in_sync
+        shuffle_buffer: rows held in the shuffle buffer (default: the whole
+            training split in memory, STREAM_SHUFFLE_BUFFER when streaming)
+        validation_split: fraction of rows held out for val_loss (early
+            stopping, LR decay); 0 trains on every row and monitors loss
+        cache_dir: if set, cache the training/validation source rows to disk,
+            under a subdirectory keyed by the data (see _cache_key)
+        stream: stream the index arrays in chunks; defaults to True when they
+            are memory-mapped (see load_processed_data)
+        profile_dir / profile_steps: capture a TensorBoard profiler trace of
+            training steps (start, stop) into profile_dir
+        rows: train (and validate) on these interaction rows only; always
+            uses the in-memory path
+        callbacks: extra Keras callbacks (e.g. training_callbacks.StepTimer)
+
+        Under a multi-worker strategy each worker trains on its own shard of
+        the rows for a fixed number of steps per epoch (see
+        distribute.fit_multi_worker); the profiler is not available there.
+        """
+        import tensorflow as tf
+        from sklearn.model_selection import train_test_split
+
         logger.info("Starting model training...")
         
-        training_samples = processed_data['training_samples']
-        
-        # Prepare training data
-        user_ids = np.array([sample['user_idx'] for sample in training_samples])
-        item_ids = np.array([sample['item_idx'] for sample in training_samples])
-        user_features = np.array([sample['user_features'] for sample in training_samples])
-        item_features = np.array([sample['item_features'] for sample in training_samples])
-        ratings = np.array([sample['rating'] for sample in training_samples])
-        
-        # Split data
-        indices = np.arange(len(ratings))
-        train_idx, val_idx = train_test_split(indices, test_size=validation_split, random_state=42)
-        
-        # Training data
-        X_train = {
-            'user_id': user_ids[train_idx],
-            'item_id': item_ids[train_idx],
-            'user_features': user_features[train_idx],
-            'item_features': item_features[train_idx],
-        }
-        y_train = ratings[train_idx]
-        
-        # Validation data
-        X_val = {
-            'user_id': user_ids[val_idx],
-            'item_id': item_ids[val_idx],
-            'user_features': user_features[val_idx],
-            'item_features': item_features[val_idx],
-        }
-        y_val = ratings[val_idx]
+        ratings = processed_data['ratings']
+        if stream is None:
+            stream = isinstance(ratings, np.memmap) and rows is None
+        
+        replicas = self.strategy.num_replicas_in_sync if self.strategy is not None else 1
+        global_batch_size = batch_size * replicas
+        num_workers, worker_index = worker_info(self.strategy)
+        multi_worker = num_workers > 1
+        # fit() splits a global batch over the replicas; multi-worker datasets
+        # are per-replica pipelines over each worker's own rows instead
+        worker_batch_size = global_batch_size // num_workers
+        dataset_batch_size = batch_size if multi_worker else global_batch_size
+        shard = (num_workers, worker_index) if multi_worker else None
+        if replicas > 1:
+            logger.info(f"Training on {replicas} replicas, global batch size {global_batch_size}")
+        
+        has_validation = validation_split > 0
+        cache_train = cache_val = None
+        if cache_dir is not None:
+            suffix = f"-{worker_index}" if multi_worker else ""
+            cache_root = Path(cache_dir) / self._cache_key(processed_data, rows, validation_split, stream)
+            logger.info(f"Caching dataset rows under {cache_root}")
+            cache_train = cache_root / f'train{suffix}'
+            cache_val = cache_root / f'validation{suffix}'
+        
+        val_ds = None
+        if stream:
+            train_ds = self._make_dataset(
+                processed_data, batch_size=dataset_batch_size,
+                shuffle_buffer=shuffle_buffer or STREAM_SHUFFLE_BUFFER,
+                cache_path=cache_train, stream=True,
+                validation_split=validation_split, subset='training',
+                shard=shard, repeat=multi_worker,
+            )
+            if has_validation:
+                val_ds = self._make_dataset(
+                    processed_data, batch_size=dataset_batch_size, cache_path=cache_val, stream=True,
+                    validation_split=validation_split, subset='validation',
+                    shard=shard, repeat=multi_worker,
+                )
+            num_val = int(len(ratings) * validation_split)
+            num_train = len(ratings) - num_val
+        else:
+            # Split data
+            indices = np.arange(len(ratings)) if rows is None else np.asarray(rows)
+            if has_validation:
+                train_idx, val_idx = train_test_split(indices, test_size=validation_split, random_state=42)
+            else:
+                train_idx, val_idx = indices, indices[:0]
+            num_train, num_val = len(train_idx), len(val_idx)
+            if multi_worker:
+                train_idx, val_idx = train_idx[worker_index::num_workers], val_idx[worker_index::num_workers]
+            
+            train_ds = self._make_dataset(
+                processed_data, train_idx, dataset_batch_size,
+                shuffle_buffer=shuffle_buffer or len(train_idx), cache_path=cache_train,
+                repeat=multi_worker,
+            )
+            if has_validation:
+                val_ds = self._make_dataset(processed_data, val_idx, dataset_batch_size,
+                                            cache_path=cache_val, repeat=multi_worker)
         
-        # Callbacks
-        callbacks = [
+        if multi_worker:
+            history = fit_multi_worker(
+                self.model, self.strategy, train_ds, val_ds, epochs,
+                steps_per_epoch=max(1, num_train // num_workers // worker_batch_size),
+                validation_steps=max(1, num_val // num_workers // worker_batch_size),
+                global_batch_size=global_batch_size,
+            )
+            logger.info("Model training completed")
+            return history
+        
+        # Callbacks (on the training loss when nothing is held out)
+        monitor = 'val_loss' if has_validation else 'loss'
+        callbacks = list(callbacks or []) + [
             tf.keras.callbacks.EarlyStopping(
-                patience=10, restore_best_weights=True, monitor='val_loss'
+                patience=10, restore_best_weights=True, monitor=monitor
             ),
             tf.keras.callbacks.ReduceLROnPlateau(
-                factor=0.8, patience=5, monitor='val_loss'
+                factor=0.8, patience=5, monitor=monitor
             ),
             tf.keras.callbacks.ModelCheckpoint(
-                'best_model.h5', save_best_only=True, monitor='val_loss'
+                'best_model.h5', save_best_only=True, monitor=monitor
             ),
         ]
+        if profile_dir is not None and profile_steps:
+            from training_callbacks import ProfileSteps
+            callbacks.append(ProfileSteps(profile_dir, *profile_steps))
         
         # Train model
         history = self.model.fit(
-            X_train, y_train,
-            validation_data=(X_val, y_val),
+            train_ds,
+            validation_data=val_ds,
             epochs=epochs,
-            batch_size=batch_size,
             callbacks=callbacks,
-            verbose=1
+            verbose=verbose
         )
         
         logger.info("Model training completed")
         return history
     
-    def convert_to_tflite(self, mode: str = "dynamic"):
+    def _weighted_layers(self):
+        return [layer for layer in self.model.layers if layer.weights]
+
+    def export_preprocessing_artifacts(self, out_dir):
+        """
+        Write encoder classes, scaler mean/scale, the scaled feature tables
+        and (when attached) the seen-items CSR in the sklearn-free format of
+        preprocessing_artifacts, for serving and warm starts. Requires
+        preprocess_data to have run.
+        """
+        save_preprocessing_artifacts(
+            out_dir,
+            user_ids=self.user_encoder.classes_,
+            item_ids=self.item_encoder.classes_,
+            user_mean=self.user_scaler.mean_, user_scale=self.user_scaler.scale_,
+            item_mean=self.item_scaler.mean_, item_scale=self.item_scaler.scale_,
+            user_features=self.user_features_scaled,
+            item_features=self.item_features_scaled,
+            seen_items=self.interaction_matrix,
+        )
+        logger.info(f"Preprocessing artifacts written to: {Path(out_dir).resolve()}")
+
+    def load_preprocessing_artifacts(self, in_dir):
+        """
+        Restore encoders, scalers, the scaled feature tables and the
+        seen-items matrix written by export_preprocessing_artifacts, e.g. to
+        train, export or recommend from arrays on disk without re-running
+        preprocess_data.
+        """
+        from scipy import sparse
+        from sklearn.preprocessing import LabelEncoder
+
+        artifacts = PreprocessingArtifacts.load(in_dir)
+        self.user_encoder = LabelEncoder()
+        self.user_encoder.classes_ = artifacts.user_id_strings()
+        self.item_encoder = LabelEncoder()
+        self.item_encoder.classes_ = artifacts.item_id_strings()
+        self.user_scaler = self._restore_scaler(artifacts.user_mean, artifacts.user_scale)
+        self.item_scaler = self._restore_scaler(artifacts.item_mean, artifacts.item_scale)
+        self.num_users = artifacts.num_users
+        self.num_items = artifacts.num_items
+        self.user_features_scaled = artifacts.user_features
+        self.item_features_scaled = artifacts.item_features
+        self.interaction_matrix = None
+        if artifacts.seen_indptr is not None:
+            self.interaction_matrix = sparse.csr_matrix(
+                (np.ones(len(artifacts.seen_indices), dtype=np.bool_), artifacts.seen_indices, artifacts.seen_indptr),
+                shape=(self.num_users, self.num_items),
+            )
+        return artifacts
+
+    @classmethod
+    def from_training_state(cls, state_dir):
+        """
+        Rebuild a trained model from save_training_state output, for export
+        or scoring. recommend's exclude_seen uses the seen-items matrix saved
+        with the state; states saved without it need exclude_seen=False.
+        """
+        config = json.loads((Path(state_dir) / TRAINING_STATE_FILE).read_text())
+        model = cls(
+            embedding_dim=config['embedding_dim'],
+            architecture=config['architecture'],
+            tower_dim=config['tower_dim'],
+        )
+        model.load_preprocessing_artifacts(state_dir)
+        state = model.load_training_state(state_dir)
+        model.build_model()
+        model.warm_start(state)
+        return model
+
+    def _restore_scaler(self, mean, scale):
+        """A fitted StandardScaler from saved mean/scale arrays"""
+        from sklearn.preprocessing import StandardScaler
+
+        scaler = StandardScaler()
+        scaler.mean_ = np.asarray(mean, dtype=np.float64)
+        scaler.scale_ = np.asarray(scale, dtype=np.float64)
+        scaler.var_ = scaler.scale_ ** 2
+        scaler.n_features_in_ = len(scaler.mean_)
+        scaler.n_samples_seen_ = 0
+        return scaler
+
+    def save_training_state(self, state_dir, processed_data=None):
+        """
+        Persist what a warm start needs: the preprocessing artifacts (encoder
+        classes, scalers), the model config and newest interaction time
+        trained on (state.json), and the weights of every layer in layer
+        order (weights.npz).
+        """
+        state_dir = Path(state_dir)
+        self.export_preprocessing_artifacts(state_dir)
+
+        high_water_mark = None
+        timestamps = None if processed_data is None else processed_data.get('timestamps')
+        if timestamps is not None and (~np.isnat(timestamps)).any():
+            high_water_mark = str(timestamps[~np.isnat(timestamps)].max())
+
+        layers = self._weighted_layers()
+        state = {
+            'architecture': self.architecture,
+            'embedding_dim': self.embedding_dim,
+            'tower_dim': self.tower_dim,
+            'user_feature_dim': self.user_feature_dim,
+            'item_feature_dim': self.item_feature_dim,
+            'layers': [layer.name for layer in layers],
+            'data_high_water_mark': high_water_mark,
+        }
+        (state_dir / TRAINING_STATE_FILE).write_text(json.dumps(state, indent=2))
+        np.savez(state_dir / TRAINING_WEIGHTS_FILE, **{
+            f"{k}/{j}": weight
+            for k, layer in enumerate(layers)
+            for j, weight in enumerate(layer.get_weights())
+        })
+        logger.info(f"Training state written to: {state_dir.resolve()}")
+
+    def load_training_state(self, state_dir):
+        """
+        Load a state written by save_training_state and restore its scalers,
+        so preprocess_data(..., fit_scalers=False) scales features the way
+        the saved weights expect. Returns None (train from scratch) if there
+        is no state or it was saved for a different model configuration
+        (including a different USER_FEATURES / ITEM_FEATURES layout).
+        """
+        state_dir = Path(state_dir)
+        if not (state_dir / TRAINING_STATE_FILE).exists():
+            logger.info(f"No training state in {state_dir}; training from scratch")
+            return None
+        state = json.loads((state_dir / TRAINING_STATE_FILE).read_text())
+
+        config = (self.architecture, self.embedding_dim, self.tower_dim,
+                  self.user_feature_dim, self.item_feature_dim)
+        # States written before the feature dims were recorded count as mismatched
+        saved_config = (state['architecture'], state['embedding_dim'], state['tower_dim'],
+                        state.get('user_feature_dim'), state.get('item_feature_dim'))
+        if config != saved_config:
+            logger.warning(f"Training state is for {saved_config}, not {config}; training from scratch")
+            return None
+
+        if state['data_high_water_mark'] is not None:
+            state['data_high_water_mark'] = np.datetime64(state['data_high_water_mark'])
+        with np.load(state_dir / TRAINING_WEIGHTS_FILE) as weights:
+            state['weights'] = dict(weights)
+
+        artifacts = PreprocessingArtifacts.load(state_dir, mmap_mode=None)
+        state['classes'] = {
+            'user_encoder': artifacts.user_id_strings(),
+            'item_encoder': artifacts.item_id_strings(),
+        }
+        self.user_scaler = self._restore_scaler(artifacts.user_mean, artifacts.user_scale)
+        self.item_scaler = self._restore_scaler(artifacts.item_mean, artifacts.item_scale)
+        return state
+
+    def warm_start(self, state):
+        """
+        Copy the saved weights into the freshly built model. Embedding rows
+        are moved to each ID's position in the new encoder; IDs seen for the
+        first time keep their fresh initialization and IDs that disappeared
+        are dropped. All other layers must match the saved shapes.
+        """
+        import pandas as pd
+
+        layers = self._weighted_layers()
+        if len(layers) != len(state['layers']):
+            raise ValueError(f"Saved model has {len(state['layers'])} weighted layers, "
+                             f"current model has {len(layers)}")
+
+        for k, layer in enumerate(layers):
+            weights = [state['weights'][f"{k}/{j}"] for j in range(len(layer.weights))]
+            if layer.name in EMBEDDING_ENCODERS:
+                encoder = EMBEDDING_ENCODERS[layer.name]
+                old_classes = state['classes'][encoder]
+                table = layer.get_weights()[0]
+                new_rows = pd.Index(getattr(self, encoder).classes_).get_indexer(old_classes)
+                kept = new_rows >= 0
+                table[new_rows[kept]] = weights[0][kept]
+                logger.info(f"{layer.name}: kept {int(kept.sum())} rows, "
+                            f"{len(table) - int(kept.sum())} new, {int((~kept).sum())} dropped")
+                weights = [table]
+            layer.set_weights(weights)
+        logger.info("Warm-started model from previous weights")
+
+    def fine_tune(self, processed_data, since=None, epochs=FINE_TUNE_EPOCHS,
+                  learning_rate=FINE_TUNE_LEARNING_RATE, **train_kwargs):
+        """
+        Continue training a warm-started model on interactions after `since`
+        (all interactions if None) for a few epochs at a lower
+        learning rate. Returns the History, or None if there is nothing new.
+        """
+        rows = None
+        if since is not None:
+            rows = self.recent_rows(processed_data, since)
+            logger.info(f"Fine-tuning on {len(rows)} interactions since {since}")
+            if len(rows) < 2:
+                logger.info("Not enough new interactions to fine-tune; keeping previous weights")
+                return None
+        self.model.optimizer.learning_rate.assign(learning_rate)
+        return self.train_model(processed_data, epochs=epochs, rows=rows, **train_kwargs)
+
+    def _float32_twin(self, model):
+        """
+        `model` (self.model or one of the towers) rebuilt with float32
+        compute and the same weights. Variables are float32 in every
+        precision mode, so the weights copy over unchanged.
+        """
+        twin = MakanMateRecommendationModel(
+            num_users=self.num_users, num_items=self.num_items, embedding_dim=self.embedding_dim,
+            architecture=self.architecture, tower_dim=self.tower_dim,
+        )
+        twin._build_and_compile()
+        twin.model.set_weights(self.model.get_weights())
+        twins = {m.name: m for m in (twin.model, twin.user_tower, twin.item_tower) if m is not None}
+        return twins[model.name]
+
+    def _export_serving_model(self, model, export_dir, batch_size=None):
+        """
+        Write a SavedModel whose serving_default concrete function has an
+        explicit batch dimension: None exports a dynamic batch
+        (resize_tensor_input at runtime), an int bakes that batch size in.
+        Input names are kept, so the TFLite tensors stay serving_default_<name>.
+        """
+        import tensorflow as tf
+
+        specs = [
+            tf.TensorSpec([batch_size] + list(model_input.shape[1:]), model_input.dtype, name=model_input.name)
+            for model_input in model.inputs
+        ]
+        # ExportArchive tracks every model variable (incl. non-trainable
+        # state); a bare tf.function over the model does not convert cleanly
+        archive = tf.keras.export.ExportArchive()
+        archive.track(model)
+        archive.add_endpoint(
+            'serving_default',
+            lambda *inputs: model(list(inputs), training=False),
+            input_signature=specs,
+        )
+        archive.write_out(export_dir)
+        return export_dir
+
+    def convert_to_tflite(self, mode: str = "dynamic", model=None, batch_size=None,
+                          processed_data=None):
         """
         mode: "none" | "dynamic" | "float16" | "int8"
         - none: FP32 TFLite (largest)
         - dynamic: dynamic-range (recommended quick fix)
         - float16: weights in FP16 (good size/speed on GPU/NNAPI)
-        - int8: full int8 (requires representative dataset, see _representative_data_gen)
+        - int8: full int8 weights and activations, calibrated on
+          processed_data (see _representative_data_gen); inputs and output
+          stay float32/int32 so callers feed it like the other modes
+        model: Keras model to convert (default: the full model; pass
+            self.user_tower to export the two-tower user side on its own)
+        batch_size: None for a dynamic batch dimension, or a fixed batch size
+            for delegates that need static shapes
+        processed_data: output of preprocess_data (required for int8)
+        A mixed_bfloat16 model is converted through a float32 copy (see
+        _float32_twin); TFLite has no bfloat16 kernels.
         """
         import tensorflow as tf
 
-        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        model = model or self.model
+        if self.precision == 'mixed_bfloat16':
+            model = self._float32_twin(model)
+        with tempfile.TemporaryDirectory(prefix='makanmate_serving_') as export_dir:
+            converter = tf.lite.TFLiteConverter.from_saved_model(
+                self._export_serving_model(model, export_dir, batch_size)
+            )
 
-        if mode == "none":
-            pass  # no optimization
+            if mode == "none":
+                pass  # no optimization
 
-        elif mode == "dynamic":
-            converter.optimizations = [tf.lite.Optimize.DEFAULT]  # no rep dataset needed
+            elif mode == "dynamic":
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]  # no rep dataset needed
 
-        elif mode == "float16":
-            converter.optimizations = [tf.lite.Optimize.DEFAULT]
-            converter.target_spec.supported_types = [tf.float16]
+            elif mode == "float16":
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
 
-        elif mode == "int8":
-            converter.optimizations = [tf.lite.Optimize.DEFAULT]
-            converter.representative_dataset = self._representative_data_gen()
-            # Keep embeddings’ id tensors as int32, output as float32
-            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
-            converter.inference_input_type = tf.int32
-            converter.inference_output_type = tf.float32
-        else:
-            raise ValueError(f"Unknown TFLite mode: {mode}")
+            elif mode == "int8":
+                if processed_data is None:
+                    raise ValueError("int8 conversion needs processed_data for calibration")
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = self._representative_data_gen(
+                    processed_data, model, batch_size
+                )
+                converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+                # ID inputs are int32 already; float features and the rating are
+                # (de)quantized inside the model so the interface is unchanged
+                converter.inference_output_type = tf.float32
+            else:
+                raise ValueError(f"Unknown TFLite mode: {mode}")
 
-        tflite_model = converter.convert()
+            tflite_model = converter.convert()
         return tflite_model
     
+    def _sample_rows(self, processed_data, num_samples, seed=42):
+        """Sorted random interaction rows (all rows if there are fewer)"""
+        num_rows = len(processed_data['ratings'])
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(num_rows, min(num_samples, num_rows), replace=False))
+
+    def _pair_inputs(self, processed_data, rows):
+        """Model input dict for the given interaction rows"""
+        user_idx = np.asarray(processed_data['user_idx'][rows], dtype=np.int32)
+        item_idx = np.asarray(processed_data['item_idx'][rows], dtype=np.int32)
+        return {
+            'user_id': user_idx,
+            'item_id': item_idx,
+            'user_features': np.asarray(processed_data['user_features'][user_idx], dtype=np.float32),
+            'item_features': np.asarray(processed_data['item_features'][item_idx], dtype=np.float32),
+        }
+
+    def _representative_data_gen(self, processed_data, model=None, batch_size=None,
+                                 num_samples=REPRESENTATIVE_SAMPLES):
+        """
+        Calibration samples for int8 conversion: real training interactions,
+        fed through the same inputs the model being converted takes.
+        """
+        input_names = [model_input.name for model_input in (model or self.model).inputs]
+        inputs = self._pair_inputs(processed_data, self._sample_rows(processed_data, num_samples))
+        step = batch_size or 1
+
+        def gen():
+            for start in range(0, len(inputs['user_id']) - step + 1, step):
+                yield {name: inputs[name][start:start + step] for name in input_names}
+
+        return gen
+
+    def quantization_report(self, processed_data, modes=TFLITE_MODES,
+                            num_samples=QUANTIZATION_EVAL_SAMPLES, latency_batch_size=512,
+                            latency_runs=QUANTIZATION_LATENCY_RUNS):
+        """
+        Convert the model in each mode and compare, on a sample of
+        interactions: file size, RMSE against the ratings and its delta to the
+        FP32 Keras model, max |prediction difference| to Keras, and CPU
+        interpreter latency (p50 of single-pair calls and of one batched call).
+        """
+        import tensorflow as tf
+
+        rows = self._sample_rows(processed_data, num_samples, seed=7)
+        inputs = self._pair_inputs(processed_data, rows)
+        ratings = np.asarray(processed_data['ratings'][rows], dtype=np.float32)
+        keras_predictions = self.model.predict(inputs, batch_size=4096, verbose=0).reshape(-1)
+        keras_rmse = float(np.sqrt(np.mean((ratings - keras_predictions) ** 2)))
+
+        single = {name: value[:1] for name, value in inputs.items()}
+        batch = {name: value[:latency_batch_size] for name, value in inputs.items()}
+
+        def p50_ms(runner, feed):
+            runner(**feed)  # warm-up (and tensor allocation for this shape)
+            timings = []
+            for _ in range(latency_runs):
+                start = time.perf_counter()
+                runner(**feed)
+                timings.append((time.perf_counter() - start) * 1000)
+            return float(np.percentile(timings, 50))
+
+        report = {'num_samples': int(len(rows)), 'keras_rmse': keras_rmse, 'modes': []}
+        for mode in modes:
+            tflite_model = self.convert_to_tflite(mode, processed_data=processed_data)
+            interpreter = tf.lite.Interpreter(model_content=tflite_model)
+            runner = interpreter.get_signature_runner('serving_default')
+            predictions = runner(**inputs)['output_0'].reshape(-1)
+            rmse = float(np.sqrt(np.mean((ratings - predictions) ** 2)))
+            report['modes'].append({
+                'mode': mode,
+                'size_kb': len(tflite_model) / 1024,
+                'rmse': rmse,
+                'rmse_delta': rmse - keras_rmse,
+                'max_abs_diff': float(np.max(np.abs(predictions - keras_predictions))),
+                'latency_single_ms': p50_ms(runner, single),
+                'latency_batch_ms': p50_ms(runner, batch),
+                'batch_size': int(len(batch['user_id'])),
+            })
+
+        logger.info(f"Quantization report ({report['num_samples']} interactions, "
+                    f"Keras FP32 RMSE {keras_rmse:.4f}):")
+        logger.info(f"  {'mode':<8} {'size KB':>9} {'RMSE':>8} {'dRMSE':>9} {'max diff':>9} "
+                    f"{'1-pair ms':>10} {'batch ms':>9}")
+        for row in report['modes']:
+            logger.info(f"  {row['mode']:<8} {row['size_kb']:>9.1f} {row['rmse']:>8.4f} "
+                        f"{row['rmse_delta']:>+9.4f} {row['max_abs_diff']:>9.4f} "
+                        f"{row['latency_single_ms']:>10.3f} {row['latency_batch_ms']:>9.3f}")
+        return report
+
     def evaluate_model(self, processed_data):
         """Evaluate model performance"""
         logger.info("Evaluating model performance...")
         
-        training_samples = processed_data['training_samples']
-        
-        # Prepare test data
-        user_ids = np.array([sample['user_idx'] for sample in training_samples])
-        item_ids = np.array([sample['item_idx'] for sample in training_samples])
-        user_features = np.array([sample['user_features'] for sample in training_samples])
-        item_features = np.array([sample['item_features'] for sample in training_samples])
-        ratings = np.array([sample['rating'] for sample in training_samples])
+        ratings = processed_data['ratings']
         
         # Make predictions
-        predictions = self.model.predict({
-            'user_id': user_ids,
-            'item_id': item_ids,
-            'user_features': user_features,
-            'item_features': item_features,
-        })
+        dataset = self._make_dataset(processed_data, stream=isinstance(ratings, np.memmap))
+        if is_multi_worker(self.strategy):
+            # predict() would wait on collectives the other workers never join
+            predictions = np.concatenate([self.model(batch[0], training=False).numpy() for batch in dataset])
+        else:
+            predictions = self.model.predict(dataset)
         
         # Calculate metrics
         mse = np.mean((ratings - predictions.flatten()) ** 2)
@@ -599,31 +1860,133 @@ class MakanMateRecommendationModel:
             'mse': mse,
         }
 
-def main():
-    """Main training function"""
-    logger.info("Starting MakanMate AI Model Training Pipeline")
-    
-    # Create model instance
-    model = MakanMateRecommendationModel()
-    
-    # Fetch and preprocess data
-    raw_data = model.fetch_training_data()
-    processed_data = model.preprocess_data(raw_data)
-    
-    # Build and train model
-    model.build_model()
-    history = model.train_model(processed_data)
-    
-    # Evaluate model
-    metrics = model.evaluate_model(processed_data)
+def export_models(model, out_dir, report, mode='dynamic', batch_size=None,
+                  processed_data=None, compare_quantization=False):
+    """
+    Write the serving artifacts of a trained model into out_dir:
+    recommendation_model.tflite, preprocessing/ and, for two_tower,
+    user_tower.tflite, item_embeddings.npy, item_index.npz and
+    retrieval_report.json (index recall vs. the model). compare_quantization
+    also writes quantization_report.json; it and mode='int8' need processed_data.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    item_features = model.item_features_scaled
     
     # Convert to TensorFlow Lite
-    tflite_model = model.convert_to_tflite(mode="dynamic")
-    out_dir = Path(__file__).parent
+    with report.stage('convert'):
+        tflite_model = model.convert_to_tflite(mode=mode, batch_size=batch_size,
+                                               processed_data=processed_data)
     out_path = out_dir / "recommendation_model.tflite"
     out_path.write_bytes(tflite_model)
+    report.add(tflite_path=str(out_path.resolve()), tflite_mode=mode,
+               tflite_size_kb=len(tflite_model) / 1024)
     logger.info(f"TFLite model written to: {out_path.resolve()}")
     
+    if compare_quantization:
+        with report.stage('quantization_report'):
+            report_path = out_dir / "quantization_report.json"
+            report_path.write_text(json.dumps(model.quantization_report(processed_data), indent=2))
+        logger.info(f"Quantization report written to: {report_path.resolve()}")
+    
+    with report.stage('export_retrieval'):
+        if model.architecture == 'two_tower':
+            # Precomputed item vectors + a small user tower for on-device ranking
+            user_tower_path = out_dir / "user_tower.tflite"
+            user_tower_path.write_bytes(model.convert_to_tflite(
+                mode=mode, model=model.user_tower, batch_size=batch_size, processed_data=processed_data
+            ))
+            item_embeddings_path = out_dir / "item_embeddings.npy"
+            np.save(item_embeddings_path, model.export_item_embeddings(item_features))
+            logger.info(f"User tower written to: {user_tower_path.resolve()}")
+            logger.info(f"Item embeddings written to: {item_embeddings_path.resolve()}")
+            
+            # Candidate retrieval index, probing as few cells as reach
+            # TARGET_RECALL against the model's own top-k
+            index = model.build_retrieval_index(item_features)
+            retrieval_report = model.benchmark_retrieval_index(index)
+            index.nprobe = choose_nprobe(retrieval_report)
+            index_path = out_dir / "item_index.npz"
+            index.save(index_path)
+            (out_dir / "retrieval_report.json").write_text(json.dumps(retrieval_report, indent=2))
+            recall = next(r['recall_at_k'] for r in retrieval_report['ivf'] if r['nprobe'] == index.nprobe)
+            report.add(retrieval_nprobe=index.nprobe, retrieval_recall_at_k=recall)
+            logger.info(f"Retrieval index written to: {index_path.resolve()} "
+                        f"(nprobe={index.nprobe}, recall@{retrieval_report['k']} {recall:.3f})")
+        else:
+            logger.info("No retrieval index for the mlp architecture; rank with score_users / recommend")
+        
+        # ID -> embedding index tables and scalers for the app / scoring services
+        model.export_preprocessing_artifacts(out_dir / "preprocessing")
+
+
+def main(architecture='mlp', compare_quantization=False, profile_steps=None, warm_start=False,
+         aggregate=None, precision='default', optimizer='adam'):
+    """
+    Main training function
+    compare_quantization: also write quantization_report.json comparing
+        every TFLite mode (see quantization_report)
+    profile_steps: (start, stop) training steps to capture with the
+        TensorBoard profiler into logs/profile
+    warm_start: start from the previous run's training_state/ and fine-tune
+        on interactions newer than it instead of training from scratch
+    aggregate: reducer for collapsing repeated (user, item) interactions
+        into weighted samples (see AGGREGATION_REDUCERS)
+    precision: training precision/compilation mode (see precision.py)
+    optimizer: 'adam' or 'lazy_adam' (row-sparse embedding updates)
+    Stage timings and memory high-water marks go to run_report.json.
+    """
+    logger.info("Starting MakanMate AI Model Training Pipeline")
+    out_dir = SCRIPT_DIR
+    state_dir = out_dir / "training_state"
+    report = RunReport(architecture=architecture, aggregate=aggregate, precision=precision,
+                       optimizer=optimizer)
+    
+    # Create model instance
+    model = MakanMateRecommendationModel(architecture=architecture, precision=precision,
+                                         optimizer=optimizer)
+    
+    try:
+        # Fetch and preprocess data
+        with report.stage('fetch'):
+            raw_data = model.fetch_training_data()
+        with report.stage('preprocess'):
+            state = model.load_training_state(state_dir) if warm_start else None
+            processed_data = model.preprocess_data(raw_data, fit_scalers=state is None,
+                                                   aggregate=aggregate)
+        report.add(num_users=model.num_users, num_items=model.num_items,
+                   num_interactions=int(len(processed_data['ratings'])))
+        
+        # Build and train model
+        with report.stage('build'):
+            model.build_model()
+            if state is not None:
+                model.warm_start(state)
+        report.add(warm_start=state is not None)
+        profile_dir = None
+        if profile_steps:
+            profile_dir = out_dir / "logs" / "profile"
+            report.add(profile_dir=str(profile_dir), profile_steps=list(profile_steps))
+        with report.stage('train'):
+            if state is not None:
+                history = model.fine_tune(processed_data, since=state['data_high_water_mark'],
+                                          profile_dir=profile_dir, profile_steps=profile_steps)
+            else:
+                history = model.train_model(processed_data, profile_dir=profile_dir,
+                                            profile_steps=profile_steps)
+            model.save_training_state(state_dir, processed_data)
+        report.add(epochs_run=len(history.history['loss']) if history else 0)
+        
+        # Evaluate model
+        with report.stage('evaluate'):
+            metrics = model.evaluate_model(processed_data)
+        report.add(metrics={name: float(value) for name, value in metrics.items()})
+        
+        export_models(model, out_dir, report, processed_data=processed_data,
+                      compare_quantization=compare_quantization)
+    finally:
+        # Written on failure too, so a slow or crashing stage still shows up
+        report.write(out_dir / "run_report.json")
     
     logger.info("Training pipeline completed successfully!")
     logger.info(f"Model saved as 'recommendation_model.tflite'")
@@ -631,5 +1994,240 @@ def main():
     
     return model, history, metrics
 
+def _fetch_command(args):
+    model = MakanMateRecommendationModel(num_users=args.users, num_items=args.items)
+    if args.synthetic_dir:
+        model.export_synthetic_parquet(args.synthetic_dir, seed=args.seed)
+        return 0
+    if model.db is None:
+        logger.error("Firebase is not available; nothing fetched")
+        return 1
+    model.fetch_training_data(page_size=args.page_size, checkpoint_dir=args.checkpoint_dir,
+                              snapshot_dir=args.snapshot_dir, update_fields=dict(args.update_field))
+    return 0
+
+
+def _preprocess_command(args):
+    model = MakanMateRecommendationModel(num_users=args.users, num_items=args.items)
+    if args.synthetic_dir:
+        raw_data = model.load_synthetic_parquet(args.synthetic_dir)
+    elif args.snapshot_dir:
+        raw_data = model.fetch_training_data(snapshot_dir=args.snapshot_dir, refresh_snapshot=False)
+    else:
+        raw_data = model.generate_synthetic_data(seed=args.seed)
+    if args.scalers_from:
+        # Keep a previous run's scaling so its weights can be warm-started
+        model.load_preprocessing_artifacts(args.scalers_from)
+    processed_data = model.preprocess_data(raw_data, fit_scalers=not args.scalers_from,
+                                           aggregate=args.aggregate)
+    model.save_processed_data(processed_data, args.out_dir)
+    model.export_preprocessing_artifacts(Path(args.out_dir) / "preprocessing")
+    return 0
+
+
+def _train_command(args):
+    # First TensorFlow use: logical CPU devices can only be set up before it
+    strategy = make_strategy(args.strategy, args.replicas)
+    chief = is_chief(strategy)
+    report = RunReport(architecture=args.architecture, strategy=args.strategy,
+                       replicas=strategy.num_replicas_in_sync if strategy is not None else 1,
+                       workers=worker_info(strategy)[0], precision=args.precision,
+                       optimizer=args.optimizer)
+    model = MakanMateRecommendationModel(architecture=args.architecture, strategy=strategy,
+                                         precision=args.precision, optimizer=args.optimizer)
+    try:
+        with report.stage('load'):
+            state = model.load_training_state(args.state_dir) if args.warm_start else None
+            processed_data = model.load_processed_data(args.processed_dir)
+            model.load_preprocessing_artifacts(Path(args.processed_dir) / "preprocessing")
+            model.attach_processed_data(processed_data)
+        report.add(num_users=model.num_users, num_items=model.num_items,
+                   num_interactions=int(len(processed_data['ratings'])), warm_start=state is not None)
+        with report.stage('build'):
+            model.build_model()
+            if state is not None:
+                model.warm_start(state)
+        with report.stage('train'):
+            train_kwargs = dict(batch_size=args.batch_size, cache_dir=args.cache_dir,
+                                profile_dir=args.profile_dir, profile_steps=args.profile_steps)
+            if state is not None:
+                history = model.fine_tune(processed_data, since=state['data_high_water_mark'],
+                                          **train_kwargs)
+            else:
+                history = model.train_model(processed_data, epochs=args.epochs, **train_kwargs)
+            if chief:
+                model.save_training_state(args.state_dir, processed_data)
+        report.add(epochs_run=len(history.history['loss']) if history else 0)
+        if chief:
+            with report.stage('evaluate'):
+                metrics = model.evaluate_model(processed_data)
+            report.add(metrics={name: float(value) for name, value in metrics.items()})
+    finally:
+        # Other workers hold identical weights; only the chief writes
+        if chief:
+            report.write(args.report)
+    return 0
+
+
+def _export_command(args):
+    needs_data = args.mode == 'int8' or args.compare_quantization
+    if needs_data and not args.processed_dir:
+        logger.error("--processed-dir is required for int8 and --compare-quantization")
+        return 2
+    report = RunReport()
+    try:
+        with report.stage('load'):
+            model = MakanMateRecommendationModel.from_training_state(args.state_dir)
+            processed_data = None
+            if args.processed_dir:
+                processed_data = model.load_processed_data(args.processed_dir)
+        report.add(architecture=model.architecture)
+        export_models(model, args.out_dir, report, mode=args.mode, batch_size=args.batch_size,
+                      processed_data=processed_data, compare_quantization=args.compare_quantization)
+    finally:
+        report.write(Path(args.out_dir) / "export_report.json")
+    return 0
+
+
+def _benchmark_command(args):
+    from test_model import benchmark_tflite_model, print_benchmark
+
+    report = benchmark_tflite_model(args.model_path, batch_sizes=args.batch_sizes,
+                                    thread_counts=args.threads, runs=args.runs)
+    print_benchmark(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    return 0
+
+
+def _run_command(args):
+    main(architecture=args.architecture, compare_quantization=args.compare_quantization,
+         profile_steps=args.profile_steps, warm_start=args.warm_start, aggregate=args.aggregate,
+         precision=args.precision, optimizer=args.optimizer)
+    return 0
+
+
+def _collection_field(value):
+    """argparse type for COLLECTION=FIELD"""
+    collection, sep, field = value.partition('=')
+    if not (sep and collection and field):
+        raise argparse.ArgumentTypeError(f"expected COLLECTION=FIELD, got '{value}'")
+    return collection, field
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="MakanMate recommendation model pipeline. "
+                    "Without a subcommand, runs the full pipeline (same as `run`)."
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_architecture(sub):
+        sub.add_argument('--architecture', choices=ARCHITECTURES, default='mlp')
+
+    def add_profile_steps(sub):
+        sub.add_argument('--profile-steps', type=int, nargs=2, metavar=('START', 'STOP'),
+                         help="capture a TensorFlow profiler trace of these training steps")
+
+    def add_precision(sub):
+        sub.add_argument('--precision', choices=PRECISION_MODES, default='default',
+                         help="xla: jit_compile the train/predict steps; mixed_bfloat16: bf16 compute")
+
+    def add_optimizer(sub):
+        sub.add_argument('--optimizer', choices=OPTIMIZERS, default='adam',
+                         help="lazy_adam: update only the embedding rows in each batch")
+
+    def add_aggregate(sub):
+        sub.add_argument('--aggregate', choices=AGGREGATION_REDUCERS,
+                         help="collapse repeated (user, item) interactions into one weighted sample")
+
+    def add_synthetic_size(sub):
+        sub.add_argument('--users', type=int, default=1000, help="synthetic users")
+        sub.add_argument('--items', type=int, default=500, help="synthetic items")
+        sub.add_argument('--seed', type=int, default=None)
+
+    sub = subparsers.add_parser('run', help="full pipeline: fetch, preprocess, train, evaluate, export")
+    add_architecture(sub)
+    add_profile_steps(sub)
+    sub.add_argument('--compare-quantization', action='store_true')
+    sub.add_argument('--warm-start', action='store_true',
+                     help="fine-tune from training_state/ on interactions since the last run")
+    add_aggregate(sub)
+    add_precision(sub)
+    add_optimizer(sub)
+    sub.set_defaults(func=_run_command)
+
+    sub = subparsers.add_parser('fetch', help="refresh local Parquet snapshots from Firestore")
+    sub.add_argument('--snapshot-dir', default=str(SCRIPT_DIR / 'snapshots'))
+    sub.add_argument('--checkpoint-dir', help="spool pages here so an interrupted fetch resumes")
+    sub.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    sub.add_argument('--update-field', type=_collection_field, action='append', default=[],
+                     metavar='COLLECTION=FIELD',
+                     help="field whose newer values mark changed documents "
+                          f"(default: {DEFAULT_UPDATE_FIELD}; {UPDATE_FIELDS})")
+    sub.add_argument('--synthetic-dir', help="write a synthetic dataset here instead (no Firebase)")
+    add_synthetic_size(sub)
+    sub.set_defaults(func=_fetch_command)
+
+    sub = subparsers.add_parser('preprocess', help="build training arrays and preprocessing artifacts")
+    source = sub.add_mutually_exclusive_group()
+    source.add_argument('--snapshot-dir', help="read Firestore snapshots written by `fetch`")
+    source.add_argument('--synthetic-dir', help="read a dataset written by `fetch --synthetic-dir`")
+    sub.add_argument('--out-dir', default=str(SCRIPT_DIR / 'processed'))
+    sub.add_argument('--scalers-from', metavar='DIR',
+                     help="reuse scalers from preprocessing artifacts (e.g. training_state) for warm starts")
+    add_aggregate(sub)
+    add_synthetic_size(sub)
+    sub.set_defaults(func=_preprocess_command)
+
+    sub = subparsers.add_parser('train', help="train on preprocessed arrays and save the training state")
+    add_architecture(sub)
+    add_profile_steps(sub)
+    add_precision(sub)
+    add_optimizer(sub)
+    sub.add_argument('--processed-dir', default=str(SCRIPT_DIR / 'processed'))
+    sub.add_argument('--state-dir', default=str(SCRIPT_DIR / 'training_state'))
+    sub.add_argument('--epochs', type=int, default=50)
+    sub.add_argument('--batch-size', type=int, default=512)
+    sub.add_argument('--cache-dir', help="cache tf.data source rows on disk")
+    sub.add_argument('--profile-dir', default=str(SCRIPT_DIR / 'logs' / 'profile'))
+    sub.add_argument('--warm-start', action='store_true',
+                     help="fine-tune from --state-dir (preprocess with --scalers-from it first)")
+    sub.add_argument('--strategy', choices=STRATEGIES, default='default',
+                     help="tf.distribute strategy; multi_worker reads TF_CONFIG (see distribute.py launch)")
+    sub.add_argument('--replicas', type=int, default=None,
+                     help="logical CPU devices for --strategy mirrored (default: CPU count)")
+    sub.add_argument('--report', default=str(SCRIPT_DIR / 'run_report.json'))
+    sub.set_defaults(func=_train_command)
+
+    sub = subparsers.add_parser('export', help="convert a saved training state to TFLite and serving files")
+    sub.add_argument('--state-dir', default=str(SCRIPT_DIR / 'training_state'))
+    sub.add_argument('--processed-dir', help="preprocessed arrays (int8 calibration, quantization report)")
+    sub.add_argument('--out-dir', default=str(SCRIPT_DIR))
+    sub.add_argument('--mode', choices=TFLITE_MODES, default='dynamic')
+    sub.add_argument('--batch-size', type=int, default=None,
+                     help="bake in a fixed batch size (default: dynamic)")
+    sub.add_argument('--compare-quantization', action='store_true')
+    sub.set_defaults(func=_export_command)
+
+    sub = subparsers.add_parser('benchmark', help="TFLite interpreter latency/throughput benchmark")
+    sub.add_argument('model_path', nargs='?', default=str(SCRIPT_DIR / 'recommendation_model.tflite'))
+    sub.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 64, 512])
+    sub.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    sub.add_argument('--runs', type=int, default=200)
+    sub.add_argument('--json', help="write the report to this file")
+    sub.set_defaults(func=_benchmark_command)
+
+    return parser
+
+
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        main()
+        return 0
+    return args.func(args)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(cli())
@@ -0,0 +1,78 @@
+"""
+Keras callbacks used by train_recommendation_model
+
+Kept in their own module so the training script can import TensorFlow
+lazily: this module is only imported when a callback is actually needed.
+"""
+
+import logging
+import time
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileSteps(tf.keras.callbacks.Callback):
+    """
+    Capture a TensorFlow profiler trace of training steps [start, stop)
+    (counted across epochs) into log_dir; open it in TensorBoard's Profile tab.
+    Unlike the TensorBoard callback this writes no scalar summaries.
+    """
+
+    def __init__(self, log_dir, start, stop):
+        super().__init__()
+        self.log_dir = str(log_dir)
+        self.start, self.stop = start, stop
+        self.step = 0
+        self.active = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.step == self.start:
+            logger.info(f"Profiling training steps {self.start}-{self.stop} into {self.log_dir}")
+            tf.profiler.experimental.start(self.log_dir)
+            self.active = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        if self.active and self.step >= self.stop:
+            self._finish()
+
+    def on_train_end(self, logs=None):
+        if self.active:
+            self._finish()
+
+    def _finish(self):
+        tf.profiler.experimental.stop()
+        self.active = False
+
+
+class StepTimer(tf.keras.callbacks.Callback):
+    """
+    Wall time of every training step, grouped by epoch. The first epoch's
+    steps include tracing (and XLA compilation), so compare later epochs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.epoch_steps = []
+        self._start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_steps.append([])
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.epoch_steps[-1].append(time.perf_counter() - self._start)
+
+    def steady_step_seconds(self):
+        """
+        Step times without tracing / XLA compilation: every epoch after the
+        first, or the first epoch minus its first 5 steps if it is the only one
+        """
+        epochs = self.epoch_steps
+        steps = [t for epoch in epochs[1:] for t in epoch] if len(epochs) > 1 else epochs[0][5:]
+        return np.array(steps or epochs[0])